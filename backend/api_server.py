@@ -9,18 +9,28 @@ Run with: uvicorn api_server:app --host 0.0.0.0 --port 8000 --reload
 """
 
 import os
+import re
 import json
+import time
 import tempfile
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Set, Tuple
 from datetime import datetime
 
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, TypeAdapter, PrivateAttr, ValidationError, field_validator
 import sys
 
+# orjson is optional: fall back to pydantic's own JSON encoder if missing
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    orjson = None
+    DefaultResponse = JSONResponse
+
 # Ensure backend directory is in python path for local imports
 sys.path.append(str(Path(__file__).parent))
 
@@ -32,28 +42,28 @@ from pdf_extractor import (
 from header_mapper import HeaderMapper
 from fraud_detector import FraudDetector
 
-# Gemini setup
 # Gemini setup
 try:
     import google.generativeai as genai
     from dotenv import load_dotenv
-    import itertools
     
-    # Load environment variables
+    # Load environment variables (before context_cache reads its settings)
     load_dotenv(Path(__file__).parent.parent / ".env")
     
+    from context_cache import GeminiPool, prompt_prefix
+    
     # Parse keys
     keys_str = os.environ.get("GEMINI_API_KEYS") or os.environ.get("GEMINI_API_KEY")
-    API_KEYS = [k.strip() for k in keys_str.split(",")] if keys_str else []
+    API_KEYS = [k.strip() for k in keys_str.split(",") if k.strip()] if keys_str else []
     
-    # Create valid key cycle
-    KEY_CYCLE = itertools.cycle(API_KEYS) if API_KEYS else None
+    # Per-key models; static prompt prefixes go through Gemini context caching
+    GEMINI = GeminiPool(API_KEYS) if API_KEYS else None
     
     print(f"Loaded {len(API_KEYS)} Gemini API keys.")
     
 except ImportError:
     genai = None
-    KEY_CYCLE = None
+    GEMINI = None
 
 
 # --- PYDANTIC MODELS ---
@@ -64,6 +74,14 @@ class LineItem(BaseModel):
     qty: float = 0
     unit_price: float = 0
     total: float = 0
+    
+    @field_validator("qty", "unit_price", "total", mode="before")
+    @classmethod
+    def reject_bool(cls, value):
+        # Pydantic would coerce an LLM's true/false to 1.0/0.0
+        if isinstance(value, bool):
+            raise ValueError("expected a number, got a boolean")
+        return value
 
 
 class GatekeeperResult(BaseModel):
@@ -84,6 +102,11 @@ class AnalystResult(BaseModel):
     currency: str = "USD"
     extraction_method: str = "pdfplumber"
 
+    # Source table rows behind each line item (same order), kept server-side
+    # so self-correction can re-ground flagged items without the full text.
+    _source_headers: List[str] = PrivateAttr(default_factory=list)
+    _source_rows: List[List[str]] = PrivateAttr(default_factory=list)
+
 
 class GuardianResult(BaseModel):
     status: str  # PASS, REVIEW, REJECT
@@ -129,12 +152,35 @@ class ExtractionResponse(BaseModel):
     extracted_at: str
 
 
+# LLM output (untrusted JSON) is validated as a whole list in one pass.
+LINE_ITEMS_ADAPTER = TypeAdapter(List[LineItem])
+
+
+def validate_line_items(raw_items: Any) -> List[LineItem]:
+    """Validate a list of LLM-produced line item dicts in a single pass."""
+    return LINE_ITEMS_ADAPTER.validate_python(raw_items or [])
+
+
+def serialize_response(model: BaseModel) -> Response:
+    """
+    Serialize a response model with orjson, bypassing FastAPI's
+    response_model re-validation and jsonable_encoder walk.
+    """
+    if orjson is None:
+        return Response(content=model.model_dump_json(), media_type="application/json")
+    return Response(
+        content=orjson.dumps(model.model_dump(), option=orjson.OPT_NON_STR_KEYS),
+        media_type="application/json"
+    )
+
+
 # --- FASTAPI APP ---
 
 app = FastAPI(
     title="ORC Extraction API",
     description="AI-powered document extraction with pdfplumber and Gemini",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=DefaultResponse
 )
 
 # CORS for Next.js frontend (configurable for production)
@@ -159,50 +205,85 @@ async def global_exception_handler(request, exc):
     )
 
 
+@app.on_event("shutdown")
+def close_gemini():
+    # Delete our cached prompt prefixes instead of paying storage until their TTL
+    if GEMINI:
+        GEMINI.close()
+
+
 # --- AGENT FUNCTIONS ---
 
-def get_model():
-    """Get Gemini model instance with key rotation."""
-    if not KEY_CYCLE or not genai:
-        return None
-    
-    # Rotate key
-    current_key = next(KEY_CYCLE)
-    genai.configure(api_key=current_key)
-    
-    return genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        generation_config={
-            "temperature": 0.1,
-            "response_mime_type": "application/json"
-        }
-    )
+MODEL_NAME = "gemini-2.5-flash"
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "response_mime_type": "application/json"
+}
+
+# Static part of each prompt (system instruction, cached per key when large
+# enough); calls only send the document-specific part as contents.
+GATEKEEPER_INSTRUCTION = """
+You are the Gatekeeper. Classify the document and extract metadata.
+
+Return JSON:
+{
+    "doc_type": "Invoice" | "Purchase_Order" | "Chat_Log" | "Email" | "Unknown",
+    "vendor_name": "Best guess of vendor name or null",
+    "confidence_score": 0.0-1.0,
+    "summary": "One sentence summary"
+}
+"""
+
+CORRECTION_INSTRUCTION = """
+You are a senior data analyst. Some values in your previous extraction failed validation.
+Fix ONLY the values you are given, using the source rows from the document.
+
+Return JSON:
+{
+    "line_items": [{"index": 0, "sku": "...", "desc": "...", "qty": 0, "unit_price": 0.00, "total": 0.00}],
+    "subtotal": 0.00, "tax": 0.00, "total": 0.00
+}
+Only include line items you were given (keep their index). Omit totals if they are correct.
+Ensure all math is consistent (qty * unit_price = total).
+"""
+
+LINE_ITEMS_INSTRUCTION = """
+Extract line items from the document text.
+
+Return JSON array:
+[
+    {"sku": "ABC123", "desc": "Product name", "qty": 10, "unit_price": 25.00, "total": 250.00},
+    ...
+]
+"""
+
+TOTALS_INSTRUCTION = """
+Extract financial totals from the document.
+
+Return JSON:
+{"subtotal": 0.00, "tax": 0.00, "total": 0.00, "currency": "USD"}
+"""
+
+if GEMINI:
+    GATEKEEPER_PREFIX = prompt_prefix("gatekeeper", MODEL_NAME, GATEKEEPER_INSTRUCTION, GENERATION_CONFIG)
+    CORRECTION_PREFIX = prompt_prefix("correction", MODEL_NAME, CORRECTION_INSTRUCTION, GENERATION_CONFIG)
+    LINE_ITEMS_PREFIX = prompt_prefix("line-items", MODEL_NAME, LINE_ITEMS_INSTRUCTION, GENERATION_CONFIG)
+    TOTALS_PREFIX = prompt_prefix("totals", MODEL_NAME, TOTALS_INSTRUCTION, GENERATION_CONFIG)
+    GEMINI.report_caching([GATEKEEPER_PREFIX, CORRECTION_PREFIX, LINE_ITEMS_PREFIX, TOTALS_PREFIX])
 
 
 def run_gatekeeper(text: str) -> GatekeeperResult:
     """
     Classify document type and extract basic metadata.
     """
-    model = get_model()
-    
     prompt = """
-You are the Gatekeeper. Classify this document and extract metadata.
-
 DOCUMENT TEXT:
 {text}
-
-Return JSON:
-{{
-    "doc_type": "Invoice" | "Purchase_Order" | "Chat_Log" | "Email" | "Unknown",
-    "vendor_name": "Best guess of vendor name or null",
-    "confidence_score": 0.0-1.0,
-    "summary": "One sentence summary"
-}}
 """.format(text=text[:5000])  # Limit text length
     
-    if model:
+    if GEMINI:
         try:
-            response = model.generate_content(prompt)
+            response = GEMINI.generate(GATEKEEPER_PREFIX, prompt)
             data = json.loads(response.text)
             return GatekeeperResult(**data)
         except Exception as e:
@@ -225,61 +306,11 @@ Return JSON:
     )
 
 
-def _ai_refine_extraction(text: str, previous_result: AnalystResult, feedback: str) -> AnalystResult:
-    """
-    Refine extraction based on Guardian feedback.
-    """
-    model = get_model()
-    if not model:
-        return previous_result
-    
-    prev_json = previous_result.model_dump_json()
-    
-    prompt = f"""
-You are a senior data analyst. Your previous extraction contained errors.
-Refine the extraction based on the feedback.
-
-DOCUMENT TEXT:
-{text[:10000]}
-
-PREVIOUS EXTRACTION:
-{prev_json}
-
-FEEDBACK (ERRORS TO FIX):
-{feedback}
-
-Return corrections as JSON with keys: line_items (array of objects with qty, desc, unit_price, total, sku), subtotal, tax, total, currency.
- Ensure all math is consistent (qty * unit_price = total).
-"""
-    try:
-        response = model.generate_content(prompt)
-        # Parse response (handle potential markdown blocks)
-        cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
-        data = json.loads(cleaned_text)
-        
-        line_items = [LineItem(**item) for item in data.get("line_items", [])]
-        
-        return AnalystResult(
-            line_items=line_items,
-            subtotal=data.get("subtotal", 0.0),
-            tax_amount=data.get("tax", 0.0),
-            total_amount=data.get("total", 0.0),
-            currency=data.get("currency", "USD"),
-            extraction_method="ai_refinement"
-        )
-    except Exception as e:
-        print(f"[Analyst] Refinement failed: {e}")
-        return previous_result
-
-def run_analyst(pdf_path: Path, text: str, feedback: Optional[str] = None, previous_result: Optional[AnalystResult] = None) -> AnalystResult:
+def run_analyst(pdf_path: Path, text: str) -> AnalystResult:
     """
     Extract structured data from document using pdfplumber + AI.
-    Supports self-correction if feedback is provided.
+    Self-correction is incremental, see run_correction.
     """
-    if feedback and previous_result:
-        print(f"⚡ Analyst running in correction mode. Feedback: {feedback}")
-        return _ai_refine_extraction(text, previous_result, feedback)
-
     # Step 1: Extract tables with pdfplumber
     tables = extract_tables(pdf_path)
     line_items_table = find_line_items_table(tables)
@@ -330,7 +361,7 @@ def run_analyst(pdf_path: Path, text: str, feedback: Optional[str] = None, previ
     # Try to extract totals from text using AI
     totals = _extract_totals(text)
     
-    return AnalystResult(
+    result = AnalystResult(
         line_items=line_items,
         subtotal=totals.get("subtotal", subtotal),
         tax_amount=totals.get("tax", 0),
@@ -338,33 +369,213 @@ def run_analyst(pdf_path: Path, text: str, feedback: Optional[str] = None, previ
         currency=totals.get("currency", "USD"),
         extraction_method=extraction_method
     )
+    if line_items_table:
+        result._source_headers = line_items_table["headers"]
+        result._source_rows = line_items_table["rows"]
+    
+    return result
+
+
+# --- SELF-CORRECTION ---
+
+MAX_CORRECTION_RETRIES = 2
+CORRECTION_TOKEN_BUDGET = int(os.environ.get("CORRECTION_TOKEN_BUDGET", "8000"))
+CORRECTION_TIME_BUDGET_S = float(os.environ.get("CORRECTION_TIME_BUDGET_S", "30"))
+
+TOTALS_LINE_PATTERN = re.compile(r"sub\s*-?\s*total|total|tax|vat|amount\s+due|balance", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token) for budgeting before a call."""
+    return len(text) // 4 + 1
+
+
+class CorrectionBudget:
+    """
+    Per-request token and wall-clock allowance for self-correction retries.
+    """
+    
+    def __init__(self, max_tokens: int = CORRECTION_TOKEN_BUDGET, max_seconds: float = CORRECTION_TIME_BUDGET_S):
+        self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + max_seconds
+        self.tokens_used = 0
+    
+    def can_afford(self, prompt: str) -> bool:
+        if time.monotonic() >= self.deadline:
+            return False
+        # Assume the answer is about as long as the prompt
+        return self.tokens_used + 2 * estimate_tokens(prompt) <= self.max_tokens
+    
+    def charge(self, prompt: str, response: Any):
+        usage = getattr(response, "usage_metadata", None)
+        used = getattr(usage, "total_token_count", 0) if usage else 0
+        if not used:
+            used = estimate_tokens(prompt) + estimate_tokens(getattr(response, "text", ""))
+        self.tokens_used += used
+
+
+def _flagged_line_items(analyst: AnalystResult, fraud: Optional[FraudResult]) -> Dict[int, List[str]]:
+    """
+    Map line item index -> issues that point at that specific item.
+    """
+    issues: Dict[int, List[str]] = {}
+    
+    for idx, item in enumerate(analyst.line_items):
+        if item.total == 0:
+            issues.setdefault(idx, []).append("Line total is zero")
+    
+    if fraud:
+        for flag in fraud.flags:
+            for idx in flag.affected_items:
+                if 0 <= idx < len(analyst.line_items):
+                    issues.setdefault(idx, []).append(flag.message)
+    
+    return issues
+
+
+def _correction_targets(
+    analyst: AnalystResult,
+    guardian: GuardianResult,
+    fraud: Optional[FraudResult]
+) -> Tuple[Dict[int, List[str]], List[str]]:
+    """
+    What a correction can act on: flagged line items (index -> issues) and
+    the Guardian's totals (math) issues. Other REVIEW reasons (low
+    classification confidence, no line items) aren't correctable.
+    """
+    totals_issues = [f for f in guardian.flags if f.startswith("Math discrepancy")]
+    return _flagged_line_items(analyst, fraud), totals_issues
+
+
+def _grounded_source_row(analyst: AnalystResult, text: str, idx: int) -> str:
+    """
+    Return the source table row for a line item, or the best matching
+    document line when the items came from the AI fallback.
+    """
+    if idx < len(analyst._source_rows):
+        return " | ".join(analyst._source_rows[idx])
+    
+    item = analyst.line_items[idx]
+    needles = [n.lower() for n in (item.sku, item.desc) if n]
+    for line in text.splitlines():
+        line_lower = line.lower()
+        if any(n in line_lower for n in needles):
+            return line.strip()
+    return ""
+
+
+def run_correction(
+    text: str,
+    analyst: AnalystResult,
+    guardian: GuardianResult,
+    fraud: Optional[FraudResult],
+    budget: CorrectionBudget
+) -> Optional[Tuple[AnalystResult, Set[int]]]:
+    """
+    Incremental self-correction: send only the flagged line items with their
+    grounded source rows (plus the document's totals lines when the totals
+    are in question), then merge the fixes into the previous result.
+    
+    Returns (corrected_result, changed_item_indices), or None if there is
+    nothing to correct, no model, or the budget would be exceeded.
+    """
+    if not GEMINI:
+        return None
+    
+    flagged, totals_issues = _correction_targets(analyst, guardian, fraud)
+    
+    if not flagged and not totals_issues:
+        return None
+    
+    flagged_payload = [
+        {
+            "index": idx,
+            "extracted": analyst.line_items[idx].model_dump(),
+            "source_row": _grounded_source_row(analyst, text, idx),
+            "issues": item_issues
+        }
+        for idx, item_issues in sorted(flagged.items())
+    ]
+    
+    sections = []
+    if analyst._source_headers:
+        sections.append(f"TABLE HEADERS: {' | '.join(analyst._source_headers)}")
+    if flagged_payload:
+        sections.append(f"FLAGGED LINE ITEMS:\n{json.dumps(flagged_payload)}")
+    if totals_issues:
+        totals_lines = [line.strip() for line in text.splitlines() if TOTALS_LINE_PATTERN.search(line)]
+        line_sum = sum(item.total for item in analyst.line_items)
+        sections.append(
+            "DOCUMENT TOTALS ISSUES:\n" + "\n".join(totals_issues) +
+            f"\nPREVIOUS TOTALS: subtotal={analyst.subtotal}, tax={analyst.tax_amount}, total={analyst.total_amount}, line items sum={line_sum:.2f}" +
+            "\nTOTALS LINES FROM DOCUMENT:\n" + "\n".join(totals_lines[:20])
+        )
+    
+    prompt = "\n\n".join(sections)
+    # Budget the whole request: the cached instruction is still part of the model's input
+    full_prompt = CORRECTION_PREFIX.system_instruction + prompt
+    
+    if not budget.can_afford(full_prompt):
+        print(f"⏹ [Orchestrator] Correction budget exhausted ({budget.tokens_used}/{budget.max_tokens} tokens)")
+        return None
+    
+    try:
+        response = GEMINI.generate(CORRECTION_PREFIX, prompt)
+        budget.charge(full_prompt, response)
+        cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
+        data = json.loads(cleaned_text)
+    except Exception as e:
+        print(f"[Analyst] Incremental correction failed: {e}")
+        return None
+    
+    try:
+        return _merge_corrections(analyst, data, allowed=set(flagged))
+    except (ValidationError, AttributeError, TypeError) as e:
+        # Malformed answer (not an object, bad line items): keep the previous result
+        print(f"[Analyst] Discarding malformed correction: {e}")
+        return None
+
+
+def _merge_corrections(analyst: AnalystResult, data: Dict[str, Any], allowed: Set[int]) -> Tuple[AnalystResult, Set[int]]:
+    """
+    Merge corrected line items (by index) and totals into a copy of `analyst`.
+    """
+    corrected = [item for item in data.get("line_items") or [] if isinstance(item, dict)]
+    indices = [item.pop("index", None) for item in corrected]
+    validated = validate_line_items(corrected)
+    
+    line_items = list(analyst.line_items)
+    changed: Set[int] = set()
+    for idx, item in zip(indices, validated):
+        if isinstance(idx, int) and not isinstance(idx, bool) and idx in allowed and line_items[idx].model_dump() != item.model_dump():
+            line_items[idx] = item
+            changed.add(idx)
+    
+    update: Dict[str, Any] = {"line_items": line_items, "extraction_method": "ai_refinement"}
+    for key, field in (("subtotal", "subtotal"), ("tax", "tax_amount"), ("total", "total_amount")):
+        if isinstance(data.get(key), (int, float)) and not isinstance(data.get(key), bool):
+            update[field] = float(data[key])
+    
+    # model_copy keeps private attrs (source rows) and skips re-validation
+    return analyst.model_copy(update=update), changed
 
 
 def _ai_extract_line_items(text: str) -> List[LineItem]:
     """
     Fallback: Use AI to extract line items when pdfplumber fails.
     """
-    model = get_model()
-    if not model:
+    if not GEMINI:
         return []
     
     prompt = """
-Extract line items from this document text.
-
 DOCUMENT:
 {text}
-
-Return JSON array:
-[
-    {{"sku": "ABC123", "desc": "Product name", "qty": 10, "unit_price": 25.00, "total": 250.00}},
-    ...
-]
 """.format(text=text[:8000])
     
     try:
-        response = model.generate_content(prompt)
+        response = GEMINI.generate(LINE_ITEMS_PREFIX, prompt)
         items = json.loads(response.text)
-        return [LineItem(**item) for item in items]
+        return validate_line_items(items)
     except Exception as e:
         print(f"[Analyst] AI extraction failed: {e}")
         return []
@@ -374,32 +585,37 @@ def _extract_totals(text: str) -> Dict[str, Any]:
     """
     Extract total, subtotal, tax from document text.
     """
-    model = get_model()
-    if not model:
+    if not GEMINI:
         return {}
     
     prompt = """
-Extract financial totals from this document.
-
 DOCUMENT:
 {text}
-
-Return JSON:
-{{"subtotal": 0.00, "tax": 0.00, "total": 0.00, "currency": "USD"}}
 """.format(text=text[:5000])
     
     try:
-        response = model.generate_content(prompt)
+        response = GEMINI.generate(TOTALS_PREFIX, prompt)
         return json.loads(response.text)
     except Exception as e:
         print(f"[Analyst] Totals extraction failed: {e}")
         return {}
 
 
-def run_guardian(gatekeeper: GatekeeperResult, analyst: AnalystResult) -> tuple:
+FRAUD_DETECTOR = FraudDetector()
+
+
+def run_guardian(
+    gatekeeper: GatekeeperResult,
+    analyst: AnalystResult,
+    previous_fraud: Optional[FraudResult] = None,
+    changed_items: Optional[Set[int]] = None
+) -> tuple:
     """
     Validate extraction results for compliance and accuracy.
     Returns (GuardianResult, FraudResult)
+    
+    When `previous_fraud` and `changed_items` are given (self-correction),
+    per-item fraud rules only re-run on the changed line items.
     """
     flags = []
     status = "PASS"
@@ -427,12 +643,16 @@ def run_guardian(gatekeeper: GatekeeperResult, analyst: AnalystResult) -> tuple:
         status = "REVIEW"
     
     # Check 5: Fraud Detection
-    fraud_detector = FraudDetector()
-    line_items_dicts = [
-        {"sku": item.sku, "desc": item.desc, "qty": item.qty, "unit_price": item.unit_price, "total": item.total}
-        for item in analyst.line_items
-    ]
-    fraud_result = fraud_detector.analyze(line_items_dicts, analyst.total_amount)
+    line_items_dicts = analyst.model_dump(include={"line_items"})["line_items"]
+    if previous_fraud is not None and changed_items is not None:
+        fraud_result = FRAUD_DETECTOR.reanalyze(
+            line_items_dicts,
+            analyst.total_amount,
+            [f.model_dump() for f in previous_fraud.flags],
+            changed_items
+        )
+    else:
+        fraud_result = FRAUD_DETECTOR.analyze(line_items_dicts, analyst.total_amount)
     
     # Elevate status based on fraud risk
     if fraud_result["risk_score"] >= 60:
@@ -463,6 +683,53 @@ def run_guardian(gatekeeper: GatekeeperResult, analyst: AnalystResult) -> tuple:
     return guardian, fraud
 
 
+def _totals(analyst: AnalystResult) -> Tuple[float, float, float]:
+    return analyst.subtotal, analyst.tax_amount, analyst.total_amount
+
+
+def run_self_correction(
+    text: str,
+    gatekeeper: GatekeeperResult,
+    analyst: AnalystResult,
+    guardian: GuardianResult,
+    fraud: FraudResult,
+    budget: Optional[CorrectionBudget] = None
+) -> Tuple[AnalystResult, GuardianResult, FraudResult]:
+    """
+    Self-correction loop: while the Guardian wants a review and there are
+    flagged line items or totals to fix, correct them incrementally (only
+    flagged items are re-sent and re-checked), bounded by MAX_CORRECTION_RETRIES
+    and a per-request token/time budget.
+    """
+    budget = budget or CorrectionBudget()
+    retries = 0
+    while (guardian.status != "PASS" and retries < MAX_CORRECTION_RETRIES
+           and any(_correction_targets(analyst, guardian, fraud))):
+        retries += 1
+        print(f"↺ [Orchestrator] Self-Correction Attempt {retries}/{MAX_CORRECTION_RETRIES}")
+        
+        correction = run_correction(text, analyst, guardian, fraud, budget)
+        if correction is None:
+            break
+        
+        corrected, changed_items = correction
+        if not changed_items and _totals(corrected) == _totals(analyst):
+            # The same prompt would be sent again: stop instead of spending the budget
+            print("   Correction changed nothing, stopping")
+            break
+        analyst = corrected
+        print(f"   Corrected {len(changed_items)} line item(s), {budget.tokens_used} tokens used")
+        
+        # Re-evaluate with Guardian (only the changed items' checks)
+        guardian, fraud = run_guardian(gatekeeper, analyst, previous_fraud=fraud, changed_items=changed_items)
+        
+        if guardian.status == "PASS":
+            print("✅ [Orchestrator] Correction Successful!")
+            break
+    
+    return analyst, guardian, fraud
+
+
 # --- API ENDPOINTS ---
 
 @app.get("/")
@@ -474,7 +741,8 @@ def root():
 def health():
     return {
         "status": "healthy",
-        "gemini_configured": KEY_CYCLE is not None,
+        "gemini_configured": GEMINI is not None,
+        "context_cache": GEMINI.stats() if GEMINI else None,
         "timestamp": datetime.now().isoformat()
     }
 
@@ -545,39 +813,13 @@ async def extract_document(file: UploadFile = File(...)):
             
             analyst_result = run_analyst(tmp_path, text)
             guardian_result, fraud_data = run_guardian(gatekeeper_result, analyst_result)
-
-            # --- Self-Correction Loop ---
-            MAX_RETRIES = 2
-            retries = 0
-            while guardian_result.status == "REJECT" and retries < MAX_RETRIES:
-                retries += 1
-                print(f"↺ [Orchestrator] Self-Correction Attempt {retries}/{MAX_RETRIES}")
-                
-                # Format feedback
-                issues = []
-                if guardian_result.flags:
-                    issues.append(f"Flags: {', '.join(guardian_result.flags)}")
-                if fraud_data and fraud_data.flags:
-                    issues.append(f"Fraud Flags: {', '.join([f.message for f in fraud_data.flags])}")
-                    
-                feedback = ". ".join(issues)
-                
-                if not feedback:
-                    break
-                
-                # Retry Analyst with feedback
-                analyst_result = run_analyst(tmp_path, text, feedback=feedback, previous_result=analyst_result)
-                
-                # Re-evaluate with Guardian
-                guardian_result, fraud_data = run_guardian(gatekeeper_result, analyst_result)
-                
-                if guardian_result.status == "PASS":
-                    print("✅ [Orchestrator] Correction Successful!")
-                    break
+            analyst_result, guardian_result, fraud_data = run_self_correction(
+                text, gatekeeper_result, analyst_result, guardian_result, fraud_data
+            )
         
         processing_time = int((time.time() - start_time) * 1000)
         
-        return ExtractionResponse(
+        return serialize_response(ExtractionResponse(
             gatekeeper=gatekeeper_result,
             analyst=analyst_result,
             guardian=guardian_result,
@@ -585,7 +827,7 @@ async def extract_document(file: UploadFile = File(...)):
             fraud=fraud_data,
             processing_time_ms=processing_time,
             extracted_at=datetime.now().isoformat()
-        )
+        ))
 
     except Exception as e:
         print("CRITICAL FAILURE: Server Error during extraction:")
@@ -605,5 +847,5 @@ async def extract_document(file: UploadFile = File(...)):
 if __name__ == "__main__":
     import uvicorn
     print("Starting ORC Extraction API...")
-    print(f"Gemini API Keys: {'Configured' if KEY_CYCLE else 'NOT SET'}")
+    print(f"Gemini API Keys: {'Configured' if GEMINI else 'NOT SET'}")
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,158 @@
+"""
+ORC Context Cache Lifecycle Test
+Runs the orchestrator's agent prompts (orc_prompt_engine.json) through
+GeminiPool against a fake Gemini API (fake_gemini_server.py) and checks the
+cached-content lifecycle end to end.
+
+Phases:
+1. Warm: one cache per (agent, key), every later call served from it
+2. Refresh: past the refresh margin, each cache's TTL is extended (not recreated)
+3. Eviction: the server drops every cache; calls fall back inline without
+   failing and the caches are recreated
+4. Caching unavailable: every create is rejected; all calls go inline
+5. Baseline: caching off, for billed input tokens and latency
+
+The agent preambles are below Gemini's real minimum cacheable size, so the
+fake server's minimum defaults to 0 here (see --min-cache-tokens).
+
+Run with: python benchmark_context_cache.py [--docs 200] [--keys 2]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_gemini_server import start_server
+from context_cache import GeminiPool, PromptPrefix
+from prompt_engine import load_prompt_engine
+
+PROMPT_ENGINE_PATH = Path(__file__).parent.parent / "orc_prompt_engine.json"
+
+
+def agent_prefixes(engine):
+    return [
+        PromptPrefix(f"{engine.version}-{agent.name}", engine.model, agent.preamble, agent.generation_config)
+        for agent in engine.agents.values()
+    ]
+
+
+def document(i: int, tokens: int) -> str:
+    line = f"INVOICE INV-{i:05d} | Widget {i % 17} | qty 3 | unit 12.50 | total 37.50\n"
+    return line * max(1, tokens * 4 // len(line))
+
+
+def run_docs(pool: GeminiPool, prefixes, args, offset: int = 0):
+    """Every agent on args.docs documents. Returns (elapsed seconds, failed calls)."""
+    def one(i):
+        failed = 0
+        for prefix in prefixes:
+            try:
+                pool.generate(prefix, document(offset + i, args.doc_tokens))
+            except Exception as e:
+                print(f"❌ {prefix.cache_id}: {e}")
+                failed += 1
+        return failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        failed = sum(executor.map(one, range(args.docs)))
+    return time.perf_counter() - start, failed
+
+
+def check(results, label: str, ok: bool, detail: str):
+    results.append(ok)
+    print(f"{'✅' if ok else '❌'} {label}: {detail}")
+
+
+def run_lifecycle_test(args) -> bool:
+    engine = load_prompt_engine(Path(args.prompt_engine))
+    prefixes = agent_prefixes(engine)
+    keys = [f"fake-key-{i + 1}" for i in range(args.keys)]
+    slots = len(prefixes) * len(keys)
+    options = dict(latency_ms=args.latency_ms, ms_per_1k_tokens=args.ms_per_1k_tokens)
+    results = []
+    timings = {}
+
+    print(f"🚀 {len(prefixes)} agent prefixes x {len(keys)} keys, {args.docs} documents per phase "
+          f"(prompt version {engine.version})")
+
+    # 1-3. Caching on: warm, refresh, eviction
+    server = start_server(min_cache_tokens=args.min_cache_tokens, **options)
+    # Short TTL, refresh in its second half: the next phase runs once every cache is due
+    pool = GeminiPool(keys, cache_enabled=True, ttl_s=args.ttl, refresh_margin_s=args.ttl / 2,
+                      min_tokens=args.min_cache_tokens, api_endpoint=server.base_url)
+
+    elapsed, failed = run_docs(pool, prefixes, args)
+    timings["cached"] = elapsed
+    stats = pool.stats()
+    check(results, "Warm", failed == 0 and stats.get("created") == slots and stats.get("inline_calls", 0) == 0,
+          f"{stats.get('created')} caches for {slots} slots, {stats.get('cached_calls')} cached calls, {failed} failed")
+
+    time.sleep(args.ttl / 2 + 0.2)
+    elapsed, failed = run_docs(pool, prefixes, args, offset=args.docs)
+    stats = pool.stats()
+    check(results, "Refresh", failed == 0 and stats.get("refreshed", 0) >= slots and stats.get("created") == slots,
+          f"{stats.get('refreshed', 0)} TTL refreshes, {stats.get('created')} caches created in total")
+
+    server.gemini.expire_all()
+    elapsed, failed = run_docs(pool, prefixes, args, offset=2 * args.docs)
+    stats = pool.stats()
+    check(results, "Eviction", failed == 0 and stats.get("invalidated") == slots and stats.get("created") == 2 * slots,
+          f"{stats.get('invalidated')} caches invalidated, {stats.get('inline_calls', 0)} inline retries, "
+          f"{stats.get('created') - slots} recreated, {failed} failed")
+
+    pool.close()
+    cached_server = server.stats()
+    check(results, "Cleanup", cached_server["active_caches"] == 0, f"{cached_server.get('caches_deleted', 0)} caches deleted")
+    server.shutdown()
+
+    # 4. Server rejects caching
+    server = start_server(min_cache_tokens=args.min_cache_tokens, caching=False, **options)
+    pool = GeminiPool(keys, cache_enabled=True, min_tokens=args.min_cache_tokens, api_endpoint=server.base_url)
+    elapsed, failed = run_docs(pool, prefixes, args)
+    stats = pool.stats()
+    check(results, "Caching unavailable", failed == 0 and stats.get("create_failed") == slots
+          and stats.get("inline_calls") == args.docs * len(prefixes),
+          f"{stats.get('create_failed')} create attempts, {stats.get('inline_calls')} inline calls, {failed} failed")
+    server.shutdown()
+
+    # 5. Baseline: caching off
+    server = start_server(min_cache_tokens=args.min_cache_tokens, **options)
+    pool = GeminiPool(keys, cache_enabled=False, api_endpoint=server.base_url)
+    timings["inline"], _ = run_docs(pool, prefixes, args)
+    inline_server = server.stats()
+    server.shutdown()
+
+    # Time: warm phase vs baseline (same documents); billed tokens: all caching-on calls vs baseline
+    calls = args.docs * len(prefixes)
+    cached_billed = cached_server["billed_input_tokens"] / cached_server["calls"]
+    inline_billed = inline_server["billed_input_tokens"] / inline_server["calls"]
+    print("\n=== CONTEXT CACHE ===")
+    print(f"  {'mode':<8} {'time':>8} {'docs/s':>8} {'billed in/call':>15}")
+    for label, billed in (("inline", inline_billed), ("cached", cached_billed)):
+        print(f"  {label:<8} {timings[label]:7.2f}s {args.docs / timings[label]:8.1f} {billed:15.0f}")
+    print(f"  Cached input tokens/call: {cached_server['cached_input_tokens'] / cached_server['cached_calls']:.0f} "
+          f"(billed at the reduced cached rate)")
+    print(f"  Calls per phase: {calls}")
+
+    ok = all(results)
+    print("✅ Cache lifecycle verified" if ok else "❌ Cache lifecycle check failed")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Context Cache Lifecycle Test")
+    parser.add_argument("--prompt-engine", default=str(PROMPT_ENGINE_PATH))
+    parser.add_argument("--docs", type=int, default=200, help="Documents per phase (3 agent calls each)")
+    parser.add_argument("--doc-tokens", type=int, default=150, help="Per-document input size")
+    parser.add_argument("--keys", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--ttl", type=int, default=6, help="Cache TTL (s), short so the refresh phase is quick")
+    parser.add_argument("--min-cache-tokens", type=int, default=0, help="Gemini 2.5 Flash's real minimum is 1024")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Fake API latency per call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=20, help="Extra latency per 1k uncached input tokens")
+    args = parser.parse_args()
+
+    sys.exit(0 if run_lifecycle_test(args) else 1)
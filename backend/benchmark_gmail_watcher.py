@@ -0,0 +1,120 @@
+"""
+ORC Gmail Watcher Load Test
+Drains a fake mailbox (fake_gmail_server.py) with GmailWatcher and checks
+exactly-once delivery to the (fake) /extract endpoint.
+
+Phases:
+1. Full sync of the initial mailbox (paginated search)
+2. Incremental sync after new mail arrives (history API); some of the new
+   messages are deleted before they can be fetched (404 -> 'gone'), some
+   have a PDF /extract rejects (400 -> 'failed' after one try) and some one it
+   keeps failing on (500 -> 'failed' after MAX_FETCH_ATTEMPTS syncs)
+3. A final sync that must be a no-op, with nothing left pending
+
+Run with: python benchmark_gmail_watcher.py [--messages 10000] [--error-rate 0.02]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from fake_gmail_server import start_server
+
+
+def run_load_test(args) -> bool:
+    server = start_server(
+        Path(args.pdf_dir), args.messages,
+        attachments_per_message=args.attachments,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        page_size=args.page_size,
+        extract_latency_ms=args.extract_latency_ms
+    )
+
+    # gmail_watcher reads its endpoints at import time
+    os.environ["GMAIL_API_BASE_URL"] = server.base_url
+    os.environ["ORC_API_URL"] = server.base_url + "extract"
+    from gmail_watcher import GmailWatcher, SyncStore, MAX_FETCH_ATTEMPTS
+
+    state_dir = tempfile.mkdtemp(prefix="orc_gmail_")
+    store = SyncStore(Path(state_dir) / "state.db")
+    watcher = GmailWatcher(store=store, max_downloads=args.downloads, max_inflight=args.inflight)
+    watcher.authenticate()
+
+    def drain(label: str):
+        # Injected 429s can leave messages pending; keep syncing until clear
+        start = time.perf_counter()
+        rounds = 0
+        while True:
+            rounds += 1
+            watcher.sync()
+            if not store.pending_messages() or rounds >= args.max_rounds:
+                break
+        elapsed = time.perf_counter() - start
+        return label, elapsed, rounds
+
+    timings = [drain("full sync")]
+    drained = server.stats()["expected_attachments"]
+
+    new_ids = server.mailbox.add_messages(args.new_messages)
+    server.mailbox.delete_messages(new_ids[:args.deleted_messages])
+    rejected_ids = new_ids[args.deleted_messages:args.deleted_messages + args.rejected_messages]
+    failing_ids = new_ids[args.deleted_messages + args.rejected_messages:][:args.failing_messages]
+    server.mailbox.poison_messages(rejected_ids, 400)
+    server.mailbox.poison_messages(failing_ids, 500)
+    timings.append(drain("history sync"))
+    timings.append(drain("idle sync"))
+    still_pending = len(store.pending_messages())
+
+    stats = server.stats()
+    store.close()
+    server.shutdown()
+
+    print("\n=== GMAIL WATCHER LOAD TEST ===")
+    for label, elapsed, rounds in timings:
+        print(f"  {label:<14} {elapsed:8.2f}s  ({rounds} sync round(s))")
+    print(f"  Full-sync drain rate: {drained / timings[0][1]:.1f} PDFs/s")
+    print(f"  Attachments expected: {stats['expected_attachments']}")
+    print(f"  Submitted (unique):   {stats['submitted_unique']}")
+    print(f"  Duplicates:           {stats['duplicates']}")
+    print(f"  Missing:              {stats['missing']}")
+    print(f"  Injected 429s:        {stats['injected_429s']}")
+    print(f"  Deleted before fetch: {min(args.deleted_messages, args.new_messages)}")
+    print(f"  Still pending:        {still_pending}")
+    rejections = stats["rejections"]
+    rejected_calls = [rejections.get(f"invoice-{m}-{p}.pdf", 0) for m in rejected_ids for p in range(1, args.attachments + 1)]
+    failing_calls = [rejections.get(f"invoice-{m}-{p}.pdf", 0) for m in failing_ids for p in range(1, args.attachments + 1)]
+    print(f"  /extract 400 calls:   {sum(rejected_calls)} for {len(rejected_calls)} PDFs")
+    print(f"  /extract 500 calls:   {sum(failing_calls)} for {len(failing_calls)} PDFs")
+
+    ok = stats["duplicates"] == 0 and stats["missing"] == 0
+    print("✅ Exactly-once delivery verified" if ok else "❌ Exactly-once delivery violated")
+    settled = still_pending == 0 and timings[-1][2] == 1
+    print("✅ Nothing left to re-request" if settled else "❌ Messages stuck pending")
+    capped = all(c == 1 for c in rejected_calls) and all(c <= MAX_FETCH_ATTEMPTS for c in failing_calls)
+    print("✅ Rejected PDFs submitted once, failing ones capped" if capped else "❌ Poison PDFs resubmitted")
+    return ok and settled and capped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Gmail Watcher Load Test")
+    parser.add_argument("--pdf-dir", default=str(Path(__file__).parent.parent / "data" / "golden_dataset"))
+    parser.add_argument("--messages", type=int, default=10000, help="Messages in the mailbox at start")
+    parser.add_argument("--new-messages", type=int, default=500, help="Messages delivered before the history sync")
+    parser.add_argument("--deleted-messages", type=int, default=20, help="New messages deleted before the history sync")
+    parser.add_argument("--rejected-messages", type=int, default=5, help="New messages whose PDF /extract answers 400")
+    parser.add_argument("--failing-messages", type=int, default=5, help="New messages whose PDF /extract answers 500")
+    parser.add_argument("--attachments", type=int, default=1, help="PDF attachments per message")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Gmail API latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of Gmail API calls that return 429")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--extract-latency-ms", type=int, default=20, help="Simulated /extract time")
+    parser.add_argument("--downloads", type=int, default=8)
+    parser.add_argument("--inflight", type=int, default=4)
+    parser.add_argument("--max-rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    sys.exit(0 if run_load_test(args) else 1)
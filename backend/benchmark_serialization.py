@@ -0,0 +1,129 @@
+"""
+ORC Serialization Benchmark
+Measures the non-LLM cost of building and serializing an extraction
+response for a large (5,000 line) invoice.
+
+Compares FastAPI's default encoder (response_model re-validation +
+jsonable_encoder + json.dumps) with orjson. Models are always built with
+validation; building is timed for scale. (Skipping validation with
+model_construct() showed no measurable gain, so the API doesn't.)
+
+Run with: python benchmark_serialization.py [--lines 5000] [--repeat 5]
+"""
+
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from api_server import (
+    LineItem, AnalystResult, GatekeeperResult, GroundingItem, GroundingData,
+    ExtractionResponse, run_guardian, serialize_response, parse_number
+)
+
+
+def make_rows(n: int):
+    """Synthetic pdfplumber-style rows (strings, as they come off the page)."""
+    return [
+        {
+            "sku": f"SKU-{i:05d}",
+            "desc": f"Industrial component #{i}",
+            "qty": str(1 + i % 40),
+            "unit_price": f"${(i % 97) + 0.99:,.2f}",
+            "total": f"${(1 + i % 40) * ((i % 97) + 0.99):,.2f}"
+        }
+        for i in range(n)
+    ]
+
+
+def make_grounding(n: int):
+    return [
+        {"text": f"cell {i}", "bbox": [10.0, 20.0 + i, 110.0, 32.0 + i], "page": 1 + i // 50, "type": "cell"}
+        for i in range(n * 5)
+    ]
+
+
+def build_items(rows):
+    items = []
+    for item in rows:
+        qty = parse_number(item["qty"])
+        unit_price = parse_number(item["unit_price"])
+        total = parse_number(item["total"])
+        items.append(LineItem(sku=item["sku"], desc=item["desc"], qty=qty, unit_price=unit_price, total=total))
+    return items
+
+
+def build_response(rows, grounding) -> ExtractionResponse:
+    items = build_items(rows)
+    analyst = AnalystResult(line_items=items, total_amount=sum(i.total for i in items))
+    gatekeeper = GatekeeperResult(doc_type="Invoice", confidence_score=0.95, summary="Benchmark invoice")
+    guardian, fraud = run_guardian(gatekeeper, analyst)
+
+    grounding_data = GroundingData(
+        items=[GroundingItem(**g) for g in grounding],
+        page_dimensions={1: {"width": 612.0, "height": 792.0}}
+    )
+
+    return ExtractionResponse(
+        gatekeeper=gatekeeper,
+        analyst=analyst,
+        guardian=guardian,
+        grounding=grounding_data,
+        fraud=fraud,
+        processing_time_ms=0,
+        extracted_at=datetime.now().isoformat()
+    )
+
+
+def serialize_default(response: ExtractionResponse) -> bytes:
+    # What FastAPI does for a response_model: re-validate, then encode
+    validated = ExtractionResponse.model_validate(response.model_dump())
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+
+def serialize_fast(response: ExtractionResponse) -> bytes:
+    return serialize_response(response).body
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run_benchmark(lines: int, repeat: int):
+    print(f"📊 Benchmarking response path for a {lines}-line invoice (median of {repeat})\n")
+    rows = make_rows(lines)
+    grounding = make_grounding(lines)
+
+    response = build_response(rows, grounding)
+    assert json.loads(serialize_default(response)) == json.loads(serialize_fast(response))
+
+    results = [
+        ("build (validated)", timed(lambda: build_response(rows, grounding), repeat)),
+        ("serialize (FastAPI default)", timed(lambda: serialize_default(response), repeat)),
+        ("serialize (orjson)", timed(lambda: serialize_fast(response), repeat)),
+    ]
+
+    for name, ms in results:
+        print(f"  {name:<30} {ms:9.1f} ms")
+
+    before = results[0][1] + results[1][1]
+    after = results[0][1] + results[2][1]
+    print(f"\n  {'total before':<30} {before:9.1f} ms")
+    print(f"  {'total after':<30} {after:9.1f} ms  ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Serialization Benchmark")
+    parser.add_argument("--lines", type=int, default=5000, help="Line items in the synthetic invoice")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per measurement")
+    args = parser.parse_args()
+
+    run_benchmark(args.lines, args.repeat)
@@ -0,0 +1,313 @@
+"""
+ORC Gemini Context Cache
+Gemini client pool shared by main.py and api_server.py that sends the static
+part of each prompt through Gemini context caching.
+
+A PromptPrefix is that static part: system instruction + generation config,
+identified by a cache_id that changes whenever its content does. The first
+call with a prefix on an API key registers it as cached content
+(cachedContents.create, TTL CACHE_TTL_S); later calls reference it by name,
+so only the per-document part is sent and billed at the full input rate.
+A cache is refreshed (ttl update) once it is within CACHE_REFRESH_MARGIN_S of
+expiring, and deleted on retain()/close().
+
+The prefix is sent inline (as system_instruction) instead when:
+- caching is off (GEMINI_CONTEXT_CACHE=0) or the prefix is below the model's
+  minimum cacheable size (GEMINI_CACHE_MIN_TOKENS, estimated locally)
+- creating the cache failed (retried after CACHE_RETRY_S)
+- a call on a cache fails because the cache is gone (expired, evicted): that
+  call is retried inline and the cache recreated on the next one
+
+Cached content belongs to the API key (project) that created it, so there is
+one cache per (prefix, key); calls are spread round-robin over the keys, each
+model pinned to its key. GEMINI_API_ENDPOINT sends everything over REST to
+another endpoint, e.g. fake_gemini_server.py for offline tests.
+
+Gemini only caches prefixes of at least GEMINI_CACHE_MIN_TOKENS; smaller ones
+(the agent prompts in this repo are ~100-200 tokens) always go inline and save
+nothing. report_caching() says which prefixes that applies to at startup.
+"""
+
+import os
+import json
+import time
+import hashlib
+import itertools
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+try:
+    import google.generativeai as genai
+    from google.generativeai import caching
+    from google.generativeai import client as genai_client
+    from google.api_core import exceptions as api_exceptions
+except ImportError:
+    genai = None
+
+# --- CONFIGURATION ---
+CACHE_ENABLED = os.environ.get("GEMINI_CONTEXT_CACHE", "1") != "0"
+CACHE_TTL_S = int(os.environ.get("GEMINI_CACHE_TTL_S", "3600"))
+CACHE_REFRESH_MARGIN_S = int(os.environ.get("GEMINI_CACHE_REFRESH_MARGIN_S", "300"))
+CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CACHE_MIN_TOKENS", "1024"))  # Gemini 2.5 Flash minimum
+CACHE_RETRY_S = 600
+API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """Static part of a prompt. `cache_id` must change whenever the rest does."""
+    cache_id: str
+    model: str
+    system_instruction: str
+    generation_config: Mapping[str, Any]
+
+
+def prompt_prefix(name: str, model: str, system_instruction: str, generation_config: Mapping[str, Any]) -> PromptPrefix:
+    """PromptPrefix whose cache_id is `name` plus a hash of its content."""
+    content = json.dumps([model, system_instruction, dict(generation_config)], sort_keys=True, default=str)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+    return PromptPrefix(f"{name}-{digest}", model, system_instruction, generation_config)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token)."""
+    return len(text) // 4 + 1
+
+
+def is_cache_error(error: Exception) -> bool:
+    """The referenced cache is gone (expired, evicted, deleted) or not ours."""
+    if isinstance(error, (api_exceptions.NotFound, api_exceptions.PermissionDenied)):
+        return True
+    return "cachedcontent" in str(error).lower().replace(" ", "")
+
+
+class _CacheEntry:
+    __slots__ = ("cache", "model", "key_index", "expires_at")
+
+    def __init__(self, cache, model, key_index: int, expires_at: float):
+        self.cache = cache
+        self.model = model
+        self.key_index = key_index
+        self.expires_at = expires_at
+
+
+class GeminiPool:
+    """
+    Per-key models for each PromptPrefix, with the prefix held in Gemini's
+    context cache when possible. Thread-safe; model and cache setup is
+    serialized on one lock because genai.configure() is process-global.
+    """
+
+    def __init__(self, api_keys: List[str], cache_enabled: bool = CACHE_ENABLED, ttl_s: int = CACHE_TTL_S,
+                 refresh_margin_s: int = CACHE_REFRESH_MARGIN_S, min_tokens: int = CACHE_MIN_TOKENS,
+                 retry_s: float = CACHE_RETRY_S, api_endpoint: Optional[str] = API_ENDPOINT,
+                 prefixes: Iterable[PromptPrefix] = ()):
+        if genai is None:
+            raise ImportError("google-generativeai is required for GeminiPool")
+        if not api_keys:
+            raise ValueError("GeminiPool needs at least one API key")
+        self.api_keys = list(api_keys)
+        self.cache_enabled = cache_enabled
+        self.ttl_s = ttl_s
+        self.refresh_margin_s = min(refresh_margin_s, ttl_s / 2)
+        self.min_tokens = min_tokens
+        self.retry_s = retry_s
+        self.api_endpoint = api_endpoint
+
+        self.inline_models: Dict[Tuple[str, int], Any] = {}
+        self.cached: Dict[Tuple[str, int], _CacheEntry] = {}
+        self.unavailable: Dict[Tuple[str, int], float] = {}  # slot -> monotonic time to retry create
+        self.lock = threading.RLock()
+        self.calls = itertools.count()
+        self.counters: Counter = Counter()
+        self.counters_lock = threading.Lock()
+
+        prefixes = list(prefixes)
+        if prefixes:
+            self.report_caching(prefixes)
+
+    # --- public ---
+
+    def generate(self, prefix: PromptPrefix, contents: Any, **kwargs):
+        """generate_content() for `contents` after `prefix`, on the next key."""
+        key_index = next(self.calls) % len(self.api_keys)
+        model = self._cached_model(prefix, key_index)
+        if model is not None:
+            try:
+                response = model.generate_content(contents, **kwargs)
+                self._count(response, "cached_calls")
+                return response
+            except Exception as e:
+                if not is_cache_error(e):
+                    raise
+                self._invalidate(prefix, key_index, model, e)
+
+        response = self._inline_model(prefix, key_index).generate_content(contents, **kwargs)
+        self._count(response, "inline_calls")
+        return response
+
+    def report_caching(self, prefixes: Iterable[PromptPrefix]) -> List[str]:
+        """Log which prefixes can't be cached (caching off or below min_tokens). Returns the cacheable cache_ids."""
+        if not self.cache_enabled:
+            print("[ContextCache] Context caching is off (GEMINI_CONTEXT_CACHE=0): every prefix is sent inline")
+            return []
+        cacheable = []
+        for prefix in prefixes:
+            tokens = estimate_tokens(prefix.system_instruction)
+            if tokens < self.min_tokens:
+                print(f"[ContextCache] Caching inactive for {prefix.cache_id}: ~{tokens} tokens, below the "
+                      f"{self.min_tokens}-token minimum (GEMINI_CACHE_MIN_TOKENS); sent inline, no tokens saved")
+            else:
+                cacheable.append(prefix.cache_id)
+        return cacheable
+
+    def retain(self, keep: Callable[[str], bool]):
+        """Forget (and delete the caches of) every prefix whose cache_id fails `keep`."""
+        with self.lock:
+            for slot in [slot for slot in self.inline_models if not keep(slot[0])]:
+                del self.inline_models[slot]
+            for slot in [slot for slot in self.cached if not keep(slot[0])]:
+                self._delete(self.cached.pop(slot))
+            self.unavailable = {slot: t for slot, t in self.unavailable.items() if keep(slot[0])}
+
+    def close(self):
+        """Delete every cache this pool created (they would otherwise live until their TTL)."""
+        self.retain(lambda cache_id: False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.counters_lock:
+            stats = dict(self.counters)
+        stats["active_caches"] = len(self.cached)
+        return stats
+
+    # --- models ---
+
+    def _configure(self, key_index: int):
+        """Point genai's global config at one key. Callers hold self.lock."""
+        options: Dict[str, Any] = {"api_key": self.api_keys[key_index]}
+        if self.api_endpoint:
+            options.update(transport="rest", client_options={"api_endpoint": self.api_endpoint})
+        genai.configure(**options)
+
+    def _pin(self, model):
+        """
+        Bind the model to the key just configured; later configure() calls leave it alone.
+        google-generativeai has no public per-model client or key (configure() is
+        process-global), so this sets the client GenerativeModel would otherwise
+        create lazily on first use: the private `_client` of the 0.8.x line, which
+        requirements.txt pins for that reason.
+        """
+        model._client = genai_client.get_default_generative_client()
+        return model
+
+    def _inline_model(self, prefix: PromptPrefix, key_index: int):
+        slot = (prefix.cache_id, key_index)
+        model = self.inline_models.get(slot)
+        if model is None:
+            with self.lock:
+                model = self.inline_models.get(slot)
+                if model is None:
+                    self._configure(key_index)
+                    model = self._pin(genai.GenerativeModel(
+                        model_name=prefix.model,
+                        generation_config=dict(prefix.generation_config),
+                        system_instruction=prefix.system_instruction
+                    ))
+                    self.inline_models[slot] = model
+        return model
+
+    def _cached_model(self, prefix: PromptPrefix, key_index: int):
+        """Model bound to the prefix's cache on this key, creating or refreshing it as needed; None = go inline."""
+        if not self.cache_enabled or estimate_tokens(prefix.system_instruction) < self.min_tokens:
+            return None
+        slot = (prefix.cache_id, key_index)
+
+        # Fast path: a live cache that isn't due for refresh
+        entry = self.cached.get(slot)
+        if entry is not None and entry.expires_at - time.monotonic() > self.refresh_margin_s:
+            return entry.model
+        if self.unavailable.get(slot, 0) > time.monotonic():
+            return None
+
+        with self.lock:
+            now = time.monotonic()
+            entry = self.cached.get(slot)
+            if entry is not None:
+                if entry.expires_at - now > self.refresh_margin_s or self._refresh(entry):
+                    return entry.model
+                del self.cached[slot]
+            if self.unavailable.get(slot, 0) > now:
+                return None
+
+            entry = self._create(prefix, key_index)
+            if entry is None:
+                self.unavailable[slot] = now + self.retry_s
+                return None
+            self.unavailable.pop(slot, None)
+            self.cached[slot] = entry
+            return entry.model
+
+    # --- cache lifecycle (callers hold self.lock) ---
+
+    def _create(self, prefix: PromptPrefix, key_index: int) -> Optional[_CacheEntry]:
+        self._configure(key_index)
+        started = time.monotonic()
+        try:
+            cache = caching.CachedContent.create(
+                model=prefix.model,
+                display_name=f"orc-{prefix.cache_id}"[:128],
+                system_instruction=prefix.system_instruction,
+                ttl=self.ttl_s
+            )
+        except Exception as e:
+            self._bump("create_failed")
+            print(f"[ContextCache] Caching unavailable for {prefix.cache_id} (key {key_index + 1}), sending it inline: {e}")
+            return None
+        model = self._pin(genai.GenerativeModel.from_cached_content(cache, generation_config=dict(prefix.generation_config)))
+        self._bump("created")
+        return _CacheEntry(cache, model, key_index, started + self.ttl_s)
+
+    def _refresh(self, entry: _CacheEntry) -> bool:
+        self._configure(entry.key_index)
+        started = time.monotonic()
+        try:
+            entry.cache.update(ttl=self.ttl_s)
+        except Exception as e:
+            self._bump("refresh_failed")
+            print(f"[ContextCache] Refresh of {entry.cache.name} failed, recreating: {e}")
+            return False
+        entry.expires_at = started + self.ttl_s
+        self._bump("refreshed")
+        return True
+
+    def _delete(self, entry: _CacheEntry):
+        self._configure(entry.key_index)
+        try:
+            entry.cache.delete()
+            self._bump("deleted")
+        except Exception:
+            pass  # Already expired or evicted
+
+    def _invalidate(self, prefix: PromptPrefix, key_index: int, model, error: Exception):
+        with self.lock:
+            entry = self.cached.get((prefix.cache_id, key_index))
+            if entry is not None and entry.model is model:
+                del self.cached[(prefix.cache_id, key_index)]
+                self._bump("invalidated")
+                print(f"[ContextCache] {entry.cache.name} is gone ({type(error).__name__}), retrying inline")
+
+    # --- stats ---
+
+    def _bump(self, key: str, amount: int = 1):
+        with self.counters_lock:
+            self.counters[key] += amount
+
+    def _count(self, response, kind: str):
+        usage = getattr(response, "usage_metadata", None)
+        with self.counters_lock:
+            self.counters[kind] += 1
+            if usage is not None:
+                self.counters["prompt_tokens"] += usage.prompt_token_count
+                self.counters["cached_tokens"] += usage.cached_content_token_count
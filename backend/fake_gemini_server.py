@@ -0,0 +1,358 @@
+"""
+ORC Fake Gemini Server
+Local stand-in for the Gemini REST API (generativelanguage v1beta) used by
+main.py and api_server.py through context_cache.py, for testing the context
+cache lifecycle offline.
+
+Serves:
+- models/{model}:generateContent: answers with a JSON value matching the
+  request's responseSchema ({} without one) and Gemini-style usageMetadata
+- cachedContents create / get / patch (ttl) / delete. A cache belongs to the
+  API key that created it and disappears after its TTL; using a missing,
+  expired or foreign cache is a 403, as on the real service
+- GET /fake/stats: calls, cached vs inline calls, billed vs cached input
+  tokens, cache lifecycle counters
+- POST /fake/expire: expire every cache now (server-side eviction)
+
+Configurable latency (fixed + per 1k uncached input tokens, to model prefill),
+minimum cacheable size and caching on/off. Point the clients at it with:
+    GEMINI_API_ENDPOINT=http://localhost:8031 GEMINI_API_KEYS=fake-1,fake-2
+
+Run with: python fake_gemini_server.py [--min-cache-tokens 1024] [--no-caching]
+"""
+
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+GENERATE_PATH = re.compile(r"^/v1beta/(models/[^/:]+):generateContent$")
+CACHES_PATH = "/v1beta/cachedContents"
+CACHE_PATH = re.compile(r"^/v1beta/(cachedContents/[^/]+)$")
+IMAGE_TOKENS = 258  # Gemini's flat charge per inline image
+# The REST transport sends protos.Schema types as enum numbers
+SCHEMA_TYPES = {1: "STRING", 2: "NUMBER", 3: "INTEGER", 4: "BOOLEAN", 5: "ARRAY", 6: "OBJECT"}
+
+
+def estimate_tokens(content: Any) -> int:
+    """~4 chars/token over every text part; inline data at a flat rate."""
+    if isinstance(content, dict):
+        if "inlineData" in content:
+            return IMAGE_TOKENS
+        if "text" in content:
+            return len(content["text"]) // 4 + 1
+        return sum(estimate_tokens(value) for value in content.values())
+    if isinstance(content, list):
+        return sum(estimate_tokens(value) for value in content)
+    return 0
+
+
+def example_value(schema: Dict[str, Any]) -> Any:
+    """Smallest value that satisfies a Gemini schema (first enum option, one array item)."""
+    if schema.get("enum"):
+        return schema["enum"][0]
+    kind = schema.get("type", "STRING")
+    kind = SCHEMA_TYPES.get(kind, "STRING") if isinstance(kind, int) else str(kind).upper()
+    if kind == "OBJECT":
+        return {name: example_value(prop) for name, prop in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [example_value(schema.get("items") or {})]
+    if kind == "NUMBER":
+        return 1.0
+    if kind == "INTEGER":
+        return 1
+    if kind == "BOOLEAN":
+        return True
+    return "fake"
+
+
+def _rfc3339(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _parse_ttl(ttl: Optional[str], default: float = 3600.0) -> float:
+    return float(ttl.rstrip("s")) if ttl else default
+
+
+def _error(code: int, status: str, message: str) -> Tuple[int, Dict[str, Any]]:
+    return code, {"error": {"code": code, "message": message, "status": status}}
+
+
+class FakeGemini:
+    """
+    In-memory model + cachedContents store.
+    """
+
+    def __init__(self, min_cache_tokens: int = 0, caching: bool = True):
+        self.min_cache_tokens = min_cache_tokens
+        self.caching = caching
+        self.lock = threading.Lock()
+        self.caches: Dict[str, Dict[str, Any]] = {}
+        self.counters: Counter = Counter()
+
+    # --- cachedContents ---
+
+    def _live_cache(self, name: str, api_key: str) -> Optional[Dict[str, Any]]:
+        cache = self.caches.get(name)
+        if cache is None:
+            return None
+        if cache["expire_at"] <= time.time():
+            del self.caches[name]
+            self.counters["caches_expired"] += 1
+            return None
+        return cache if cache["api_key"] == api_key else None
+
+    def _resource(self, cache: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "name": cache["name"],
+            "model": cache["model"],
+            "displayName": cache["display_name"],
+            "createTime": _rfc3339(cache["created"]),
+            "updateTime": _rfc3339(cache["updated"]),
+            "expireTime": _rfc3339(cache["expire_at"]),
+            "usageMetadata": {"totalTokenCount": cache["tokens"]}
+        }
+
+    def create_cache(self, api_key: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if not self.caching:
+            return _error(400, "INVALID_ARGUMENT", f"Model {body.get('model')} does not support context caching.")
+        tokens = estimate_tokens(body.get("systemInstruction")) + estimate_tokens(body.get("contents"))
+        if tokens < self.min_cache_tokens:
+            return _error(400, "INVALID_ARGUMENT",
+                          f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.min_cache_tokens}")
+        now = time.time()
+        cache = {
+            "name": f"cachedContents/{uuid.uuid4().hex[:16]}",
+            "model": body.get("model"),
+            "display_name": body.get("displayName", ""),
+            "system_instruction": body.get("systemInstruction"),
+            "contents": body.get("contents") or [],
+            "tokens": tokens,
+            "api_key": api_key,
+            "created": now,
+            "updated": now,
+            "expire_at": now + _parse_ttl(body.get("ttl"))
+        }
+        with self.lock:
+            self.caches[cache["name"]] = cache
+            self.counters["caches_created"] += 1
+            return 200, self._resource(cache)
+
+    def get_cache(self, api_key: str, name: str) -> Tuple[int, Dict[str, Any]]:
+        with self.lock:
+            cache = self._live_cache(name, api_key)
+            if cache is None:
+                return _error(403, "PERMISSION_DENIED", "CachedContent not found (or permission denied)")
+            return 200, self._resource(cache)
+
+    def update_cache(self, api_key: str, name: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        with self.lock:
+            cache = self._live_cache(name, api_key)
+            if cache is None:
+                return _error(403, "PERMISSION_DENIED", "CachedContent not found (or permission denied)")
+            now = time.time()
+            cache["expire_at"] = now + _parse_ttl(body.get("ttl"))
+            cache["updated"] = now
+            self.counters["caches_refreshed"] += 1
+            return 200, self._resource(cache)
+
+    def delete_cache(self, api_key: str, name: str) -> Tuple[int, Dict[str, Any]]:
+        with self.lock:
+            if self._live_cache(name, api_key) is None:
+                return _error(403, "PERMISSION_DENIED", "CachedContent not found (or permission denied)")
+            del self.caches[name]
+            self.counters["caches_deleted"] += 1
+            return 200, {}
+
+    def expire_all(self) -> int:
+        with self.lock:
+            count = len(self.caches)
+            self.caches.clear()
+            self.counters["caches_expired"] += count
+            return count
+
+    # --- generateContent ---
+
+    def generate(self, api_key: str, model: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], float]:
+        """Returns (status, payload, uncached input tokens) for latency simulation."""
+        cached_tokens = 0
+        cache_name = body.get("cachedContent")
+        if cache_name:
+            with self.lock:
+                cache = self._live_cache(cache_name, api_key)
+            if cache is None:
+                self.counters["cache_misses"] += 1
+                return (*_error(403, "PERMISSION_DENIED", "CachedContent not found (or permission denied)"), 0)
+            if body.get("systemInstruction") or body.get("tools"):
+                return (*_error(400, "INVALID_ARGUMENT",
+                                "CachedContent can not be used with GenerateContent request setting system_instruction, tools or tool_config."), 0)
+            if cache["model"] != model:
+                return (*_error(400, "INVALID_ARGUMENT", f"Model {model} does not match cached content model {cache['model']}."), 0)
+            cached_tokens = cache["tokens"]
+
+        input_tokens = estimate_tokens(body.get("systemInstruction")) + estimate_tokens(body.get("contents"))
+        schema = (body.get("generationConfig") or {}).get("responseSchema")
+        text = json.dumps(example_value(schema) if schema else {})
+        output_tokens = len(text) // 4 + 1
+
+        with self.lock:
+            self.counters["calls"] += 1
+            self.counters["cached_calls" if cache_name else "inline_calls"] += 1
+            self.counters["billed_input_tokens"] += input_tokens
+            self.counters["cached_input_tokens"] += cached_tokens
+
+        return 200, {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {
+                "promptTokenCount": input_tokens + cached_tokens,
+                "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": input_tokens + cached_tokens + output_tokens
+            },
+            "modelVersion": model.split("/", 1)[-1]
+        }, input_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.time()
+            return {
+                **self.counters,
+                "active_caches": sum(1 for cache in self.caches.values() if cache["expire_at"] > now)
+            }
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """
+    Routes Gemini REST calls to FakeGemini. Configuration lives on the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes
+
+    def log_message(self, format, *args):
+        pass  # Keep load tests quiet
+
+    # --- plumbing ---
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _api_key(self) -> Optional[str]:
+        return self.headers.get("x-goog-api-key")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        if url.path == "/fake/stats" and method == "GET":
+            return self._send_json(200, self.server.stats())
+        if url.path == "/fake/expire" and method == "POST":
+            return self._send_json(200, {"expired": self.server.gemini.expire_all()})
+
+        api_key = self._api_key()
+        if not api_key:
+            return self._send_json(*_error(401, "UNAUTHENTICATED", "API key not valid. Please pass a valid API key."))
+        body = self._read_json() if method in ("POST", "PATCH") else {}
+        gemini = self.server.gemini
+
+        match = GENERATE_PATH.match(url.path)
+        if match and method == "POST":
+            status, payload, uncached_tokens = gemini.generate(api_key, match.group(1), body)
+            if status == 200:
+                time.sleep((self.server.latency_ms + self.server.ms_per_1k_tokens * uncached_tokens / 1000) / 1000)
+            return self._send_json(status, payload)
+
+        if url.path == CACHES_PATH and method == "POST":
+            return self._send_json(*gemini.create_cache(api_key, body))
+
+        match = CACHE_PATH.match(url.path)
+        if match:
+            if method == "GET":
+                return self._send_json(*gemini.get_cache(api_key, match.group(1)))
+            if method == "PATCH":
+                return self._send_json(*gemini.update_cache(api_key, match.group(1), body))
+            if method == "DELETE":
+                return self._send_json(*gemini.delete_cache(api_key, match.group(1)))
+
+        self._send_json(*_error(404, "NOT_FOUND", f"{method} {url.path} not found"))
+
+    # --- HTTP verbs ---
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, gemini: FakeGemini, latency_ms: float = 0, ms_per_1k_tokens: float = 0):
+        super().__init__(address, FakeGeminiHandler)
+        self.gemini = gemini
+        self.latency_ms = latency_ms
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self) -> Dict[str, Any]:
+        return self.gemini.stats()
+
+
+def start_server(port: int = 0, min_cache_tokens: int = 0, caching: bool = True, **options) -> FakeGeminiServer:
+    """
+    Start a fake Gemini API on a background thread. port=0 picks a free port.
+    """
+    server = FakeGeminiServer(("127.0.0.1", port), FakeGemini(min_cache_tokens, caching), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Fake Gemini Server")
+    parser.add_argument("--port", type=int, default=8031)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Fixed latency per generateContent call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=20, help="Extra latency per 1k uncached input tokens")
+    parser.add_argument("--min-cache-tokens", type=int, default=1024, help="Smallest cacheable content (tokens)")
+    parser.add_argument("--no-caching", action="store_true", help="Reject every cachedContents.create")
+    args = parser.parse_args()
+
+    server = start_server(
+        args.port, args.min_cache_tokens, not args.no_caching,
+        latency_ms=args.latency_ms, ms_per_1k_tokens=args.ms_per_1k_tokens
+    )
+    print(f"🤖 Fake Gemini API at {server.base_url} (caching {'off' if args.no_caching else 'on'}, min {args.min_cache_tokens} tokens)")
+    print(f"   export GEMINI_API_ENDPOINT={server.base_url} GEMINI_API_KEYS=fake-1,fake-2")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
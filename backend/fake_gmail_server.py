@@ -0,0 +1,467 @@
+"""
+ORC Fake Gmail Server
+Local stand-in for the Gmail REST endpoints used by gmail_watcher.py, for
+load and correctness testing without OAuth or network access.
+
+Serves messages generated from a directory of PDFs:
+- messages.list / get / modify / batchModify, messages.attachments.get
+- users.history.list, users.getProfile
+- the batch endpoint (multipart/mixed)
+- POST /extract: a fake ORC API sink that records every submission,
+  so exactly-once delivery can be checked via GET /fake/stats
+
+Configurable latency, 429 injection and page size. Point the watcher at it with:
+    GMAIL_API_BASE_URL=http://localhost:8025/ ORC_API_URL=http://localhost:8025/extract
+
+Run with: python fake_gmail_server.py --pdf-dir ../data/golden_dataset --messages 10000
+"""
+
+import re
+import json
+import time
+import email
+import base64
+import random
+import argparse
+import threading
+from pathlib import Path
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional, Tuple
+
+MESSAGE_PATH = re.compile(r"^/gmail/v1/users/me/messages/([^/]+)$")
+BATCH_MODIFY_PATH = "/gmail/v1/users/me/messages/batchModify"
+MODIFY_PATH = re.compile(r"^/gmail/v1/users/me/messages/([^/]+)/modify$")
+ATTACHMENT_PATH = re.compile(r"^/gmail/v1/users/me/messages/([^/]+)/attachments/([^/]+)$")
+
+
+class FakeMailbox:
+    """
+    In-memory mailbox with Gmail-style history ids.
+    """
+
+    def __init__(self, pdf_dir: Path, attachments_per_message: int = 1, history_retention: int = 100000):
+        self.pdfs = [p.read_bytes() for p in sorted(Path(pdf_dir).glob("*.pdf"))]
+        if not self.pdfs:
+            raise ValueError(f"No PDF files found in {pdf_dir}")
+        self.attachments_per_message = attachments_per_message
+        self.history_retention = history_retention
+
+        self.lock = threading.Lock()
+        self.messages: Dict[str, Dict[str, Any]] = {}
+        self.order: List[str] = []
+        self.history: List[Dict[str, Any]] = []  # [{"id": int, "message_id": str}]
+        self.history_id = 1000
+        self.fetch_counter = 0
+        self.submissions: Counter = Counter()
+        self.poisoned: Dict[str, int] = {}  # message id -> /extract status for its PDFs
+        self.rejections: Counter = Counter()  # filename -> /extract calls refused
+
+    def add_messages(self, count: int) -> List[str]:
+        """Deliver `count` new unread messages, each with PDF attachments."""
+        new_ids = []
+        with self.lock:
+            for _ in range(count):
+                index = len(self.order)
+                message_id = f"{index + 1:016x}"
+                self.history_id += 1
+                self.messages[message_id] = {
+                    "index": index,
+                    "labels": {"INBOX", "UNREAD"},
+                    "history_id": self.history_id
+                }
+                self.order.append(message_id)
+                self.history.append({"id": self.history_id, "message_id": message_id})
+                new_ids.append(message_id)
+            del self.history[:-self.history_retention]
+        return new_ids
+
+    def delete_messages(self, message_ids: List[str]):
+        """Delete messages (history keeps their ids; fetching them is a 404, as on Gmail)."""
+        with self.lock:
+            for message_id in message_ids:
+                self.messages.pop(message_id, None)
+
+    def poison_messages(self, message_ids: List[str], status: int):
+        """/extract answers `status` for these messages' PDFs (e.g. 400 for a malformed PDF)."""
+        with self.lock:
+            for message_id in message_ids:
+                self.poisoned[message_id] = status
+
+    def extract_status(self, filename: str) -> int:
+        """Status /extract answers for `filename`; refusals are counted."""
+        message_id = filename.split("-")[1]
+        with self.lock:
+            status = self.poisoned.get(message_id, 200)
+            if status != 200:
+                self.rejections[filename] += 1
+        return status
+
+    def expected_filenames(self) -> List[str]:
+        return [
+            self._filename(message_id, part)
+            for message_id in self.order if message_id in self.messages and message_id not in self.poisoned
+            for part in range(1, self.attachments_per_message + 1)
+        ]
+
+    def _filename(self, message_id: str, part: int) -> str:
+        return f"invoice-{message_id}-{part}.pdf"
+
+    def _pdf(self, message_id: str, part: int) -> bytes:
+        index = self.messages[message_id]["index"]
+        return self.pdfs[(index + part) % len(self.pdfs)]
+
+    # --- API resources ---
+
+    def list_messages(self, query: str, page_token: Optional[str], max_results: int) -> Dict[str, Any]:
+        with self.lock:
+            ids = [
+                m for m in self.order
+                if m in self.messages and ("is:unread" not in query or "UNREAD" in self.messages[m]["labels"])
+            ]
+        ids.reverse()  # Gmail lists newest first
+        start = int(page_token or 0)
+        page = ids[start:start + max_results]
+        result: Dict[str, Any] = {
+            "messages": [{"id": m, "threadId": m} for m in page],
+            "resultSizeEstimate": len(ids)
+        }
+        if start + max_results < len(ids):
+            result["nextPageToken"] = str(start + max_results)
+        return result
+
+    def get_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            message = self.messages.get(message_id)
+            if message is None:
+                return None
+            self.fetch_counter += 1
+            nonce = self.fetch_counter
+            labels = sorted(message["labels"])
+
+        parts = [{
+            "partId": "0",
+            "mimeType": "text/plain",
+            "filename": "",
+            "headers": [],
+            "body": {"size": 20, "data": base64.urlsafe_b64encode(b"Invoice attached.").decode()}
+        }]
+        for part in range(1, self.attachments_per_message + 1):
+            parts.append({
+                "partId": str(part),
+                "mimeType": "application/pdf",
+                "filename": self._filename(message_id, part),
+                "headers": [],
+                # Like Gmail, the attachmentId differs on every fetch
+                "body": {"attachmentId": f"{message_id}.{part}.{nonce}", "size": len(self._pdf(message_id, part))}
+            })
+
+        return {
+            "id": message_id,
+            "threadId": message_id,
+            "labelIds": labels,
+            "historyId": str(message["history_id"]),
+            "payload": {
+                "partId": "",
+                "mimeType": "multipart/mixed",
+                "filename": "",
+                "headers": [
+                    {"name": "Subject", "value": f"Invoice {message['index'] + 1}"},
+                    {"name": "From", "value": "billing@vendor.example"},
+                    {"name": "Date", "value": "Mon, 19 Oct 2026 09:00:00 +0000"}
+                ],
+                "body": {"size": 0},
+                "parts": parts
+            }
+        }
+
+    def get_attachment(self, message_id: str, attachment_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            owner, part, _ = attachment_id.split(".")
+            part = int(part)
+        except ValueError:
+            return None
+        if owner != message_id or message_id not in self.messages or not 1 <= part <= self.attachments_per_message:
+            return None
+        data = self._pdf(message_id, part)
+        return {"size": len(data), "data": base64.urlsafe_b64encode(data).decode()}
+
+    def modify(self, message_id: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            message = self.messages.get(message_id)
+            if message is None:
+                return None
+            message["labels"] -= set(body.get("removeLabelIds", []))
+            message["labels"] |= set(body.get("addLabelIds", []))
+            return {"id": message_id, "labelIds": sorted(message["labels"])}
+
+    def list_history(self, start_history_id: int, page_token: Optional[str], max_results: int) -> Tuple[int, Dict[str, Any]]:
+        with self.lock:
+            oldest = self.history[0]["id"] if self.history else self.history_id
+            if start_history_id < oldest - 1:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            records = [h for h in self.history if h["id"] > start_history_id]
+            current = self.history_id
+
+        start = int(page_token or 0)
+        page = records[start:start + max_results]
+        result: Dict[str, Any] = {
+            "history": [
+                {"id": str(h["id"]), "messagesAdded": [{"message": {"id": h["message_id"], "threadId": h["message_id"], "labelIds": ["INBOX", "UNREAD"]}}]}
+                for h in page
+            ],
+            "historyId": str(current)
+        }
+        if start + max_results < len(records):
+            result["nextPageToken"] = str(start + max_results)
+        return 200, result
+
+    def profile(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"emailAddress": "invoices@orc.example", "messagesTotal": len(self.order), "historyId": str(self.history_id)}
+
+    def record_submission(self, filename: str):
+        with self.lock:
+            self.submissions[filename] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            expected = set(self.expected_filenames())
+            submitted = set(self.submissions)
+            return {
+                "messages": len(self.order),
+                "unread": sum(1 for m in self.messages.values() if "UNREAD" in m["labels"]),
+                "expected_attachments": len(expected),
+                "submitted_unique": len(submitted),
+                "submitted_total": sum(self.submissions.values()),
+                "duplicates": sum(c - 1 for c in self.submissions.values() if c > 1),
+                "missing": len(expected - submitted),
+                "rejections": dict(self.rejections),
+                "history_id": self.history_id
+            }
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    """
+    Routes Gmail REST calls to the FakeMailbox. Configuration lives on the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes
+
+    def log_message(self, format, *args):
+        pass  # Keep load tests quiet
+
+    # --- plumbing ---
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _simulate_conditions(self) -> bool:
+        """Apply latency and maybe inject a 429. Returns True if a 429 was sent."""
+        server = self.server
+        if server.latency_ms:
+            time.sleep(server.latency_ms / 1000 * random.uniform(0.5, 1.5))
+        if server.error_rate and random.random() < server.error_rate:
+            with server.stats_lock:
+                server.injected_429s += 1
+            self._send_json(429, {"error": {"code": 429, "message": "Rate Limit Exceeded", "status": "RESOURCE_EXHAUSTED"}})
+            return True
+        return False
+
+    def _route(self, method: str, path: str, query: Dict[str, List[str]], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        """Dispatch one Gmail API call; shared by direct and batched requests."""
+        mailbox: FakeMailbox = self.server.mailbox
+        param = lambda name, default=None: query.get(name, [default])[0]
+        not_found = (404, {"error": {"code": 404, "message": "Requested entity was not found."}})
+
+        if method == "GET" and path == "/gmail/v1/users/me/profile":
+            return 200, mailbox.profile()
+
+        if method == "GET" and path == "/gmail/v1/users/me/messages":
+            max_results = min(int(param("maxResults", 100)), self.server.page_size)
+            return 200, mailbox.list_messages(param("q", ""), param("pageToken"), max_results)
+
+        if method == "GET" and path == "/gmail/v1/users/me/history":
+            max_results = min(int(param("maxResults", 100)), self.server.page_size)
+            return mailbox.list_history(int(param("startHistoryId", 0)), param("pageToken"), max_results)
+
+        match = ATTACHMENT_PATH.match(path)
+        if method == "GET" and match:
+            result = mailbox.get_attachment(match.group(1), match.group(2))
+            return (200, result) if result else not_found
+
+        if method == "POST" and path == BATCH_MODIFY_PATH:
+            request = json.loads(body or b"{}")
+            for message_id in request.get("ids", []):
+                mailbox.modify(message_id, request)
+            return 200, {}
+
+        match = MODIFY_PATH.match(path)
+        if method == "POST" and match:
+            result = mailbox.modify(match.group(1), json.loads(body or b"{}"))
+            return (200, result) if result else not_found
+
+        match = MESSAGE_PATH.match(path)
+        if method == "GET" and match:
+            result = mailbox.get_message(match.group(1))
+            return (200, result) if result else not_found
+
+        return not_found
+
+    # --- HTTP verbs ---
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/fake/stats":
+            return self._send_json(200, self.server.stats())
+        if self._simulate_conditions():
+            return
+        status, payload = self._route("GET", url.path, parse_qs(url.query), b"")
+        self._send_json(status, payload)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._read_body()
+
+        if url.path == "/extract":
+            return self._handle_extract(body)
+        if url.path == "/fake/messages":
+            count = int(parse_qs(url.query).get("count", ["1"])[0])
+            return self._send_json(200, {"added": len(self.server.mailbox.add_messages(count))})
+        if self._simulate_conditions():
+            return
+        if url.path.startswith("/batch"):
+            return self._handle_batch(body)
+
+        status, payload = self._route("POST", url.path, parse_qs(url.query), body)
+        self._send_json(status, payload)
+
+    def _handle_extract(self, body: bytes):
+        """Fake ORC /extract: record the uploaded filename and answer like the real API."""
+        if self.server.extract_latency_ms:
+            time.sleep(self.server.extract_latency_ms / 1000)
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + body
+        )
+        filenames = [part.get_filename() for part in message.walk() if part.get_filename()]
+        if not filenames:
+            return self._send_json(400, {"detail": "No file uploaded"})
+        status = max(self.server.mailbox.extract_status(filename) for filename in filenames)
+        if status != 200:
+            return self._send_json(status, {"detail": "Simulated /extract failure"})
+        for filename in filenames:
+            self.server.mailbox.record_submission(filename)
+        self._send_json(200, {
+            "gatekeeper": {"doc_type": "Invoice", "confidence_score": 1.0, "summary": "fake"},
+            "analyst": {"line_items": []},
+            "processing_time_ms": self.server.extract_latency_ms,
+            "extracted_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+
+    def _handle_batch(self, body: bytes):
+        """Gmail batch endpoint: multipart/mixed of application/http requests."""
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + body
+        )
+        boundary = "batch_fake_orc"
+        chunks = []
+        for part in message.get_payload():
+            content_id = (part.get("Content-ID") or "<none>").strip("<>")
+            raw = part.get_payload(decode=True) or part.get_payload().encode()
+            request_line, _, rest = raw.partition(b"\r\n" if b"\r\n" in raw else b"\n")
+            method, target, _ = request_line.decode().split(" ", 2)
+            _, _, inner_body = rest.partition(b"\r\n\r\n" if b"\r\n\r\n" in rest else b"\n\n")
+            url = urlparse(target)
+            status, payload = self._route(method, url.path, parse_qs(url.query), inner_body)
+            text = json.dumps(payload)
+            chunks.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(text.encode())}\r\n\r\n"
+                f"{text}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        self._send(200, "".join(chunks).encode("utf-8"), f"multipart/mixed; boundary={boundary}")
+
+
+class FakeGmailServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, mailbox: FakeMailbox, latency_ms: float = 0, error_rate: float = 0,
+                 page_size: int = 500, extract_latency_ms: int = 0):
+        super().__init__(address, FakeGmailHandler)
+        self.mailbox = mailbox
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.extract_latency_ms = extract_latency_ms
+        self.stats_lock = threading.Lock()
+        self.injected_429s = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.mailbox.stats()
+        stats["injected_429s"] = self.injected_429s
+        return stats
+
+
+def start_server(pdf_dir: Path, messages: int = 0, port: int = 0, **options) -> FakeGmailServer:
+    """
+    Start a FakeGmailServer on a background thread (port 0 = pick a free port).
+    `options` are passed to FakeMailbox/FakeGmailServer.
+    """
+    mailbox = FakeMailbox(pdf_dir, attachments_per_message=options.pop("attachments_per_message", 1))
+    mailbox.add_messages(messages)
+    server = FakeGmailServer(("127.0.0.1", port), mailbox, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- CLI ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Fake Gmail Server")
+    parser.add_argument("--pdf-dir", default=str(Path(__file__).parent.parent / "data" / "golden_dataset"), help="Directory of PDFs to attach")
+    parser.add_argument("--messages", type=int, default=1000, help="Initial number of unread messages")
+    parser.add_argument("--attachments", type=int, default=1, help="PDF attachments per message")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Mean latency added to each Gmail API call")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of Gmail API calls answered with 429")
+    parser.add_argument("--page-size", type=int, default=500, help="Max results per page")
+    parser.add_argument("--extract-latency-ms", type=int, default=0, help="Simulated /extract processing time")
+    args = parser.parse_args()
+
+    server = start_server(
+        Path(args.pdf_dir), args.messages, args.port,
+        attachments_per_message=args.attachments,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        page_size=args.page_size,
+        extract_latency_ms=args.extract_latency_ms
+    )
+    print(f"📮 Fake Gmail API serving {args.messages} messages at {server.base_url}")
+    print(f"   export GMAIL_API_BASE_URL={server.base_url} ORC_API_URL={server.base_url}extract")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
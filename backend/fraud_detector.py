@@ -14,7 +14,7 @@ Industry Benchmark:
 - Variance checks reduce 2% margin loss from pricing errors
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable
 from dataclasses import dataclass
 import math
 import statistics
@@ -50,6 +50,10 @@ class FraudDetector:
     QUANTITY_ANOMALY_THRESHOLD = 3.0  # Flag if >3 std deviations
     MIN_ITEMS_FOR_STATS = 3           # Minimum items for statistical analysis
     
+    # Rules whose flags each concern exactly one line item. These can be
+    # re-checked item by item; every other rule depends on the whole invoice.
+    PER_ITEM_RULES = {"LINE_TOTAL_MISMATCH"}
+    
     def __init__(self, historical_prices: Optional[Dict[str, float]] = None):
         """
         Args:
@@ -93,6 +97,56 @@ class FraudDetector:
             "summary": self._generate_summary(flags, risk_score)
         }
     
+    def reanalyze(
+        self,
+        line_items: List[Dict[str, Any]],
+        total_amount: float,
+        previous_flags: List[Dict[str, Any]],
+        changed_items: Iterable[int]
+    ) -> Dict[str, Any]:
+        """
+        Incrementally re-run detection after some line items were corrected.
+        
+        Per-item flags on untouched items are carried over from the previous
+        run and per-item rules only run on `changed_items`. Aggregate rules
+        (round numbers, quantity stats, totals, duplicates) are recomputed.
+        
+        Args:
+            line_items: Full, updated list of line item dicts
+            total_amount: Invoice total for math validation
+            previous_flags: `flags` from the previous analyze()/reanalyze() result
+            changed_items: Indices of line items that changed since then
+        
+        Returns:
+            Same shape as analyze()
+        """
+        if not line_items:
+            return self.analyze(line_items, total_amount)
+        
+        changed = sorted({idx for idx in changed_items if 0 <= idx < len(line_items)})
+        changed_set = set(changed)
+        
+        flags = [
+            FraudFlag(**f) for f in previous_flags
+            if f["rule"] in self.PER_ITEM_RULES
+            and not changed_set.intersection(f.get("affected_items") or [])
+        ]
+        flags.extend(self._detect_line_total_mismatches(line_items, changed))
+        
+        flags.extend(self._detect_round_number_bias(line_items))
+        flags.extend(self._detect_price_variance(line_items))
+        flags.extend(self._detect_quantity_anomalies(line_items))
+        flags.extend(self._detect_invoice_total_mismatch(line_items, total_amount))
+        flags.extend(self._detect_suspicious_patterns(line_items))
+        
+        risk_score = self._calculate_risk_score(flags)
+        
+        return {
+            "flags": [f.to_dict() for f in flags],
+            "risk_score": risk_score,
+            "summary": self._generate_summary(flags, risk_score)
+        }
+    
     def _detect_round_number_bias(self, line_items: List[Dict]) -> List[FraudFlag]:
         """
         Detect suspiciously round numbers (common in fabricated invoices).
@@ -212,10 +266,21 @@ class FraudDetector:
         """
         Detect mathematical inconsistencies.
         """
+        flags = self._detect_line_total_mismatches(line_items)
+        flags.extend(self._detect_invoice_total_mismatch(line_items, total_amount))
+        return flags
+    
+    def _detect_line_total_mismatches(self, line_items: List[Dict], indices: Optional[Iterable[int]] = None) -> List[FraudFlag]:
+        """
+        Check qty * unit_price == total for each line item (or only `indices`).
+        """
         flags = []
         
-        # Check line item totals
-        for idx, item in enumerate(line_items):
+        if indices is None:
+            indices = range(len(line_items))
+        
+        for idx in indices:
+            item = line_items[idx]
             qty = item.get("qty", 0)
             unit_price = item.get("unit_price", 0)
             total = item.get("total", 0)
@@ -231,7 +296,14 @@ class FraudDetector:
                         affected_items=[idx]
                     ))
         
-        # Check invoice total
+        return flags
+    
+    def _detect_invoice_total_mismatch(self, line_items: List[Dict], total_amount: float) -> List[FraudFlag]:
+        """
+        Check that line totals add up to the invoice total.
+        """
+        flags = []
+        
         line_sum = sum(item.get("total", 0) for item in line_items)
         if total_amount > 0 and abs(line_sum - total_amount) > 1.0:
             flags.append(FraudFlag(
@@ -5,13 +5,17 @@ OAuth2-based Gmail integration for automated invoice intake.
 Features:
 - OAuth2 authentication flow with token refresh
 - Inbox polling for unread emails with PDF attachments
+- Incremental sync via the History API with a persistent historyId cursor
+- Local sqlite store of processed messages/attachments (idempotent)
+- Optional Pub/Sub push notifications (users.watch)
 - Auto-submission to ORC extraction pipeline
 
 Setup:
 1. Create OAuth2 credentials in Google Cloud Console
 2. Download credentials.json to this directory
 3. Run: python gmail_watcher.py --auth (first time only)
-4. Run: python gmail_watcher.py --poll (production mode)
+4. Run: python gmail_watcher.py --watch (long-running, production mode)
+   or:  python gmail_watcher.py --poll (one-shot legacy search)
 
 Required scopes:
 - https://www.googleapis.com/auth/gmail.readonly
@@ -21,9 +25,15 @@ Required scopes:
 import os
 import sys
 import json
+import time
 import base64
+import sqlite3
+import queue
 import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any, Optional
@@ -34,6 +44,10 @@ try:
     from google_auth_oauthlib.flow import InstalledAppFlow
     from google.auth.transport.requests import Request
     from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import BatchHttpRequest
+    import httplib2
+    import google_auth_httplib2
     GOOGLE_LIBS_AVAILABLE = True
 except ImportError:
     GOOGLE_LIBS_AVAILABLE = False
@@ -46,7 +60,165 @@ SCOPES = [
 ]
 CREDENTIALS_FILE = Path(__file__).parent / "credentials.json"
 TOKEN_FILE = Path(__file__).parent / "token.json"
-ORC_API_URL = "http://localhost:8000/extract"
+STATE_DB_FILE = Path(__file__).parent / "gmail_state.db"
+ORC_API_URL = os.environ.get("ORC_API_URL", "http://localhost:8000/extract")
+ORC_API_TIMEOUT_S = int(os.environ.get("ORC_API_TIMEOUT_S", "300"))  # Per /extract call; extraction runs several LLM calls
+# Point the watcher at another Gmail API host (e.g. fake_gmail_server.py); skips OAuth
+GMAIL_API_BASE_URL = os.environ.get("GMAIL_API_BASE_URL")
+API_RETRIES = 3  # Retries (with backoff) on 429/5xx per Gmail API call
+
+INVOICE_QUERY = "is:unread has:attachment filename:pdf"
+POLL_INTERVAL_S = 60
+# Optional Pub/Sub topic for push notifications, e.g. projects/<id>/topics/<name>
+PUBSUB_TOPIC = os.environ.get("GMAIL_PUBSUB_TOPIC")
+WATCH_RENEW_MARGIN_S = 24 * 3600  # users.watch expires after 7 days
+
+# Pipeline limits: concurrent attachment downloads and in-flight /extract calls
+MAX_DOWNLOADS = int(os.environ.get("GMAIL_MAX_DOWNLOADS", "8"))
+MAX_INFLIGHT = int(os.environ.get("ORC_MAX_INFLIGHT", "4"))
+BATCH_SIZE = 50  # Gmail recommends <= 50 calls per batch request
+MAX_FETCH_ATTEMPTS = 5  # Syncs a message may fail (fetch, download or /extract) before it's given up on
+
+
+def _is_not_found(error: Exception) -> bool:
+    return GOOGLE_LIBS_AVAILABLE and isinstance(error, HttpError) and error.resp.status == 404
+
+
+class SyncStore:
+    """
+    Local sqlite store for the history cursor and processed message/attachment ids.
+    
+    Messages are recorded as 'pending' before the cursor moves past them and
+    flipped to 'done' once every PDF attachment has been submitted, so a crash
+    or API error never loses or double-submits an invoice. A message that no
+    longer exists (404) becomes 'gone'; one that keeps failing to fetch, download
+    or submit becomes 'failed' after MAX_FETCH_ATTEMPTS syncs, and one whose PDF
+    the ORC API rejects (4xx) becomes 'failed' at once, so none is re-requested
+    forever.
+    """
+    
+    def __init__(self, path: Path = STATE_DB_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS attachments (
+                    message_id TEXT NOT NULL,
+                    part_id TEXT NOT NULL,
+                    filename TEXT,
+                    processed_at TEXT NOT NULL,
+                    PRIMARY KEY (message_id, part_id)
+                );
+            """)
+            # Stores created before fetch attempts were tracked
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+            if "attempts" not in columns:
+                self._conn.execute("ALTER TABLE messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def set_meta(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+    
+    def get_cursor(self) -> Optional[str]:
+        return self.get_meta("history_id")
+    
+    def set_cursor(self, history_id: str):
+        self.set_meta("history_id", str(history_id))
+    
+    def add_pending(self, message_ids: List[str]):
+        """Record newly seen messages; already known ids keep their status."""
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO messages (id, status, updated_at) VALUES (?, 'pending', ?)",
+                [(mid, now) for mid in message_ids]
+            )
+    
+    def pending_messages(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM messages WHERE status = 'pending' ORDER BY updated_at"
+            ).fetchall()
+        return [r[0] for r in rows]
+    
+    def is_message_done(self, message_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM messages WHERE id = ?", (message_id,)).fetchone()
+        return bool(row) and row[0] == "done"
+    
+    def mark_message_done(self, message_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (id, status, updated_at) VALUES (?, 'done', ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = 'done', updated_at = excluded.updated_at",
+                (message_id, datetime.now().isoformat())
+            )
+    
+    def mark_message_gone(self, message_id: str):
+        """The message was deleted (404): nothing left to fetch."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE messages SET status = 'gone', updated_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), message_id)
+            )
+    
+    def mark_message_failed(self, message_id: str):
+        """Give up on the message (e.g. the ORC API rejected one of its PDFs)."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE messages SET status = 'failed', updated_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), message_id)
+            )
+    
+    def record_failure(self, message_id: str, max_attempts: int = MAX_FETCH_ATTEMPTS) -> bool:
+        """Count a failed fetch or submit. Returns True if the message was given up on ('failed')."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE messages SET attempts = attempts + 1, updated_at = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END WHERE id = ?",
+                (datetime.now().isoformat(), max_attempts, message_id)
+            )
+            row = self._conn.execute("SELECT status FROM messages WHERE id = ?", (message_id,)).fetchone()
+        return bool(row) and row[0] == "failed"
+    
+    def is_attachment_done(self, message_id: str, part_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM attachments WHERE message_id = ? AND part_id = ?",
+                (message_id, part_id)
+            ).fetchone()
+        return row is not None
+    
+    def mark_attachment_done(self, message_id: str, part_id: str, filename: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO attachments (message_id, part_id, filename, processed_at) VALUES (?, ?, ?, ?)",
+                (message_id, part_id, filename, datetime.now().isoformat())
+            )
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
 
 class GmailWatcher:
@@ -54,9 +226,26 @@ class GmailWatcher:
     Watches Gmail inbox for invoices and auto-processes them.
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        store: Optional[SyncStore] = None,
+        max_downloads: int = MAX_DOWNLOADS,
+        max_inflight: int = MAX_INFLIGHT
+    ):
         self.service = None
         self.creds = None
+        self.store = store
+        self.max_downloads = max(1, max_downloads)
+        self.max_inflight = max(1, max_inflight)
+        
+        # httplib2 is not thread-safe: each download thread gets its own client
+        self._local = threading.local()
+        
+        # Pooled keep-alive connections to the ORC API, shared by submit workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_inflight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
     
     def authenticate(self) -> bool:
         """
@@ -67,6 +256,16 @@ class GmailWatcher:
             print("❌ Google API libraries not available")
             return False
         
+        if GMAIL_API_BASE_URL:
+            self.service = build(
+                "gmail", "v1",
+                http=httplib2.Http(),
+                client_options={"api_endpoint": GMAIL_API_BASE_URL},
+                static_discovery=True
+            )
+            print(f"✅ Using Gmail API at {GMAIL_API_BASE_URL} (no OAuth)")
+            return True
+        
         if not CREDENTIALS_FILE.exists():
             print(f"❌ credentials.json not found at {CREDENTIALS_FILE}")
             print("   Download from Google Cloud Console > APIs & Services > Credentials")
@@ -109,31 +308,75 @@ class GmailWatcher:
             return []
         
         # Search for unread emails with attachments
-        query = "is:unread has:attachment filename:pdf"
+        query = INVOICE_QUERY
         
         try:
             results = self.service.users().messages().list(
                 userId="me",
                 q=query,
                 maxResults=max_results
-            ).execute()
-            
+            ).execute(num_retries=API_RETRIES)
+        
             messages = results.get("messages", [])
             print(f"📬 Found {len(messages)} unread emails with PDF attachments")
-            
-            emails = []
-            for msg in messages:
-                email_data = self._get_email_details(msg["id"])
-                if email_data:
-                    emails.append(email_data)
-            
-            return emails
-            
+        
+            return self.get_emails_batch([msg["id"] for msg in messages])
+        
         except Exception as e:
             print(f"❌ Error fetching emails: {e}")
             return []
     
-    def _get_email_details(self, message_id: str) -> Optional[Dict[str, Any]]:
+    def get_emails_batch(self, message_ids: List[str], gone: Optional[set] = None) -> List[Dict[str, Any]]:
+        """
+        Fetch many messages through the Gmail batch endpoint (BATCH_SIZE per
+        HTTP round trip). Messages that fail inside a batch are retried once
+        individually; anything still failing is left out. Ids that no longer
+        exist (404) are added to `gone` when given.
+        """
+        emails: Dict[str, Dict[str, Any]] = {}
+        failed: List[str] = []
+        gone = set() if gone is None else gone
+        
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                if _is_not_found(exception):
+                    gone.add(request_id)
+                else:
+                    failed.append(request_id)
+            else:
+                emails[request_id] = self._parse_email(response)
+        
+        for i in range(0, len(message_ids), BATCH_SIZE):
+            chunk = message_ids[i:i + BATCH_SIZE]
+            batch = self._new_batch(on_response)
+            for message_id in chunk:
+                batch.add(
+                    self.service.users().messages().get(userId="me", id=message_id, format="full"),
+                    request_id=message_id
+                )
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"❌ Batch request failed: {e}")
+                failed.extend(m for m in chunk if m not in emails)
+        
+        for message_id in dict.fromkeys(failed):
+            email_data = self._get_email_details(message_id, gone)
+            if email_data:
+                emails[message_id] = email_data
+        
+        return [emails[m] for m in message_ids if m in emails]
+    
+    def _new_batch(self, callback):
+        """
+        Batch request against the configured API host (the discovery
+        document's batch URI ignores api_endpoint overrides).
+        """
+        if GMAIL_API_BASE_URL:
+            return BatchHttpRequest(callback=callback, batch_uri=GMAIL_API_BASE_URL.rstrip("/") + "/batch")
+        return self.service.new_batch_http_request(callback=callback)
+    
+    def _get_email_details(self, message_id: str, gone: Optional[set] = None) -> Optional[Dict[str, Any]]:
         """
         Get full email details including attachments.
         """
@@ -142,28 +385,34 @@ class GmailWatcher:
                 userId="me",
                 id=message_id,
                 format="full"
-            ).execute()
-            
-            # Extract headers
-            headers = {h["name"]: h["value"] for h in message["payload"]["headers"]}
-            
-            # Find PDF attachments
-            attachments = []
-            self._find_attachments(message["payload"], attachments)
-            
-            return {
-                "id": message_id,
-                "threadId": message["threadId"],
-                "subject": headers.get("Subject", "(No Subject)"),
-                "from": headers.get("From", "Unknown"),
-                "date": headers.get("Date"),
-                "attachments": [a for a in attachments if a["filename"].lower().endswith(".pdf")]
-            }
-            
+            ).execute(num_retries=API_RETRIES)
+        
+            return self._parse_email(message)
+        
         except Exception as e:
+            if gone is not None and _is_not_found(e):
+                gone.add(message_id)
             print(f"❌ Error getting email {message_id}: {e}")
             return None
     
+    def _parse_email(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extract headers and PDF attachment info from a messages.get response.
+        """
+        headers = {h["name"]: h["value"] for h in message["payload"].get("headers", [])}
+        
+        attachments = []
+        self._find_attachments(message["payload"], attachments)
+        
+        return {
+            "id": message["id"],
+            "threadId": message["threadId"],
+            "subject": headers.get("Subject", "(No Subject)"),
+            "from": headers.get("From", "Unknown"),
+            "date": headers.get("Date"),
+            "attachments": [a for a in attachments if a["filename"].lower().endswith(".pdf")]
+        }
+    
     def _find_attachments(self, payload: dict, attachments: list):
         """
         Recursively find attachments in email payload.
@@ -174,71 +423,154 @@ class GmailWatcher:
         
         if payload.get("filename") and payload.get("body", {}).get("attachmentId"):
             attachments.append({
+                # attachmentId is not stable across fetches; partId is
+                "partId": payload.get("partId") or payload["filename"],
                 "filename": payload["filename"],
                 "attachmentId": payload["body"]["attachmentId"],
                 "mimeType": payload.get("mimeType", "application/pdf"),
                 "size": payload.get("body", {}).get("size", 0)
             })
     
+    def _thread_http(self):
+        """
+        Per-thread HTTP client for concurrent API calls.
+        """
+        http = getattr(self._local, "http", None)
+        if http is None:
+            if self.creds is not None:
+                http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            else:
+                http = httplib2.Http()
+            self._local.http = http
+        return http
+    
     def download_attachment(self, message_id: str, attachment_id: str) -> Optional[bytes]:
         """
-        Download attachment content.
+        Download attachment content. Safe to call from worker threads.
         """
         try:
             attachment = self.service.users().messages().attachments().get(
                 userId="me",
                 messageId=message_id,
                 id=attachment_id
-            ).execute()
-            
+            ).execute(http=self._thread_http(), num_retries=API_RETRIES)
+        
             data = attachment.get("data", "")
             return base64.urlsafe_b64decode(data)
-            
+        
         except Exception as e:
             print(f"❌ Error downloading attachment: {e}")
             return None
     
-    def process_email(self, email: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def submit_attachment(
+        self,
+        email: Dict[str, Any],
+        attachment: Dict[str, Any],
+        pdf_data: bytes,
+        rejected: Optional[set] = None
+    ) -> Optional[Dict[str, Any]]:
         """
-        Process an email: download attachments and submit to ORC.
+        Submit one PDF to the ORC API over the pooled session.
+        A 4xx answer (other than 408/429) won't change on retry: the message
+        id is added to `rejected`.
+        """
+        try:
+            response = self.session.post(
+                ORC_API_URL,
+                files={"file": (attachment["filename"], pdf_data, "application/pdf")},
+                timeout=ORC_API_TIMEOUT_S
+            )
+        
+            if response.status_code == 200:
+                result = response.json()
+                result["source"] = {
+                    "email_id": email["id"],
+                    "subject": email["subject"],
+                    "from": email["from"],
+                    "filename": attachment["filename"]
+                }
+                if self.store:
+                    self.store.mark_attachment_done(email["id"], attachment["partId"], attachment["filename"])
+                print(f"    ✅ {attachment['filename']}: {len((result.get('analyst') or {}).get('line_items', []))} line items")
+                return result
+        
+            print(f"    ❌ API error for {attachment['filename']}: {response.status_code}")
+            if 400 <= response.status_code < 500 and response.status_code not in (408, 429) and rejected is not None:
+                rejected.add(email["id"])
+        
+        except requests.exceptions.Timeout:
+            print(f"    ❌ ORC API timed out after {ORC_API_TIMEOUT_S}s on {attachment['filename']}")
+        except requests.exceptions.ConnectionError:
+            print(f"    ❌ ORC API not available at {ORC_API_URL}")
+        except Exception as e:
+            print(f"    ❌ Error: {e}")
+        
+        return None
+    
+    def process_emails(self, emails: List[Dict[str, Any]], rejected: Optional[set] = None) -> List[Dict[str, Any]]:
         """
+        Download and submit every pending PDF attachment of `emails`.
+        Ids of messages with a PDF the ORC API rejected are added to `rejected`.
+        
+        Bounded producer/consumer pipeline: `max_downloads` threads fetch
+        attachments into a queue of at most `max_inflight` PDFs, which
+        `max_inflight` submit workers drain. Memory stays bounded and drain
+        time is set by the ORC API's throughput rather than round trips.
+        """
+        jobs = [
+            (email, attachment)
+            for email in emails
+            for attachment in email.get("attachments", [])
+            if not (self.store and self.store.is_attachment_done(email["id"], attachment["partId"]))
+        ]
+        if not jobs:
+            return []
+        
+        downloaded = queue.Queue(maxsize=self.max_inflight)
         results = []
+        results_lock = threading.Lock()
         
-        for attachment in email.get("attachments", []):
-            print(f"  📎 Processing: {attachment['filename']}")
-            
-            # Download PDF
+        def download(job):
+            email, attachment = job
+            print(f"  📎 Downloading: {attachment['filename']}")
             pdf_data = self.download_attachment(email["id"], attachment["attachmentId"])
-            if not pdf_data:
-                continue
-            
-            # Submit to ORC API
-            try:
-                response = requests.post(
-                    ORC_API_URL,
-                    files={"file": (attachment["filename"], pdf_data, "application/pdf")}
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    result["source"] = {
-                        "email_id": email["id"],
-                        "subject": email["subject"],
-                        "from": email["from"],
-                        "filename": attachment["filename"]
-                    }
-                    results.append(result)
-                    print(f"    ✅ Extracted: {len(result.get('analyst', {}).get('line_items', []))} line items")
-                else:
-                    print(f"    ❌ API error: {response.status_code}")
-                    
-            except requests.exceptions.ConnectionError:
-                print(f"    ❌ ORC API not available at {ORC_API_URL}")
-            except Exception as e:
-                print(f"    ❌ Error: {e}")
+            if pdf_data:
+                downloaded.put((email, attachment, pdf_data))  # Blocks while submitters are busy
+        
+        def submit_worker():
+            while True:
+                item = downloaded.get()
+                if item is None:
+                    return
+                result = self.submit_attachment(*item, rejected=rejected)
+                if result:
+                    with results_lock:
+                        results.append(result)
+        
+        submitters = [
+            threading.Thread(target=submit_worker, daemon=True)
+            for _ in range(min(self.max_inflight, len(jobs)))
+        ]
+        for worker in submitters:
+            worker.start()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_downloads, len(jobs))) as pool:
+                list(pool.map(download, jobs))
+        finally:
+            for _ in submitters:
+                downloaded.put(None)
+            for worker in submitters:
+                worker.join()
         
         return results
     
+    def process_email(self, email: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Process an email: download attachments and submit to ORC.
+        """
+        return self.process_emails([email])
+    
     def mark_as_read(self, message_id: str):
         """
         Mark email as read after processing.
@@ -248,11 +580,26 @@ class GmailWatcher:
                 userId="me",
                 id=message_id,
                 body={"removeLabelIds": ["UNREAD"]}
-            ).execute()
+            ).execute(num_retries=API_RETRIES)
             print(f"    ✓ Marked as read")
         except Exception as e:
             print(f"    ⚠️ Could not mark as read: {e}")
     
+    def mark_many_as_read(self, message_ids: List[str]):
+        """
+        Mark many emails as read with batchModify (up to 1000 ids per call).
+        """
+        for i in range(0, len(message_ids), 1000):
+            chunk = message_ids[i:i + 1000]
+            try:
+                self.service.users().messages().batchModify(
+                    userId="me",
+                    body={"ids": chunk, "removeLabelIds": ["UNREAD"]}
+                ).execute(num_retries=API_RETRIES)
+                print(f"    ✓ Marked {len(chunk)} email(s) as read")
+            except Exception as e:
+                print(f"    ⚠️ Could not mark as read: {e}")
+    
     def poll_inbox(self, mark_read: bool = True):
         """
         Poll inbox and process all unread PDF emails.
@@ -265,19 +612,211 @@ class GmailWatcher:
             print("📭 No unread emails with PDF attachments")
             return []
         
-        all_results = []
         for email in emails:
-            print(f"\n📧 {email['subject']}")
-            print(f"   From: {email['from']}")
+            print(f"📧 {email['subject']} ({email['from']})")
+        
+        all_results = self.process_emails(emails)
+        
+        if mark_read:
+            self.mark_many_as_read(list(dict.fromkeys(r["source"]["email_id"] for r in all_results)))
+        
+        print(f"\n✅ Processed {len(all_results)} PDFs from {len(emails)} emails")
+        return all_results
+    
+    # --- INCREMENTAL SYNC (History API) ---
+    
+    def _list_all_message_ids(self, query: str) -> List[str]:
+        """
+        Run a messages.list search and follow every page.
+        """
+        message_ids = []
+        page_token = None
+        while True:
+            results = self.service.users().messages().list(
+                userId="me",
+                q=query,
+                maxResults=500,
+                pageToken=page_token
+            ).execute(num_retries=API_RETRIES)
+            message_ids.extend(m["id"] for m in results.get("messages", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return message_ids
+    
+    def _list_history(self, start_history_id: str) -> tuple:
+        """
+        Fetch ids of messages added to the inbox since `start_history_id`.
+        
+        Returns (message_ids, latest_history_id). Raises HttpError 404 if the
+        cursor is too old for Gmail to serve (caller falls back to a full sync).
+        """
+        message_ids = []
+        latest_history_id = start_history_id
+        page_token = None
+        while True:
+            results = self.service.users().history().list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                labelId="INBOX",
+                maxResults=500,
+                pageToken=page_token
+            ).execute(num_retries=API_RETRIES)
             
-            results = self.process_email(email)
-            all_results.extend(results)
+            for record in results.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    message_ids.append(added["message"]["id"])
             
-            if mark_read and results:
-                self.mark_as_read(email["id"])
+            latest_history_id = results.get("historyId", latest_history_id)
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return message_ids, latest_history_id
+    
+    def _full_sync_ids(self) -> tuple:
+        """
+        Bootstrap: capture the current historyId first, then search the inbox.
+        Anything arriving during the search shows up in the next history.list.
+        """
+        profile = self.service.users().getProfile(userId="me").execute(num_retries=API_RETRIES)
+        history_id = profile["historyId"]
+        message_ids = self._list_all_message_ids(INVOICE_QUERY)
+        print(f"📬 Full sync: {len(message_ids)} unread emails with PDF attachments")
+        return message_ids, history_id
+    
+    def sync(self, mark_read: bool = True) -> List[Dict[str, Any]]:
+        """
+        Process every new message since the stored historyId cursor.
         
-        print(f"\n✅ Processed {len(all_results)} PDFs from {len(emails)} emails")
+        Cost is proportional to the number of new messages, not to the size
+        of the mailbox. New message ids are recorded as pending before the
+        cursor advances, so nothing is missed if processing fails midway.
+        """
+        if not self.service:
+            print("❌ Not authenticated. Run authenticate() first.")
+            return []
+        if self.store is None:
+            self.store = SyncStore()
+        
+        print(f"\n🔍 Syncing inbox at {datetime.now().isoformat()}")
+        
+        cursor = self.store.get_cursor()
+        try:
+            if cursor is None:
+                new_ids, new_cursor = self._full_sync_ids()
+            else:
+                try:
+                    new_ids, new_cursor = self._list_history(cursor)
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+                    print("⚠️ History cursor expired, falling back to full sync")
+                    new_ids, new_cursor = self._full_sync_ids()
+        except Exception as e:
+            print(f"❌ Error listing new messages: {e}")
+            return []
+        
+        self.store.add_pending(new_ids)
+        self.store.set_cursor(new_cursor)
+        
+        pending = self.store.pending_messages()
+        if not pending:
+            print("📭 No new emails")
+            return []
+        
+        # Deleted messages are dropped; others that fail to fetch (or below, to
+        # download or submit) stay pending and are retried next sync, up to
+        # MAX_FETCH_ATTEMPTS
+        gone: set = set()
+        emails = self.get_emails_batch(pending, gone)
+        fetched = {email["id"] for email in emails}
+        for message_id in gone:
+            self.store.mark_message_gone(message_id)
+        for message_id in pending:
+            if message_id not in fetched and message_id not in gone:
+                if self.store.record_failure(message_id):
+                    print(f"⚠️ Giving up on message {message_id} after {MAX_FETCH_ATTEMPTS} failed fetches")
+        if gone:
+            print(f"🗑️ {len(gone)} pending message(s) no longer exist")
+        for email in emails:
+            if email["attachments"]:
+                print(f"📧 {email['subject']} ({email['from']})")
+        
+        rejected: set = set()
+        all_results = self.process_emails(emails, rejected)
+        
+        completed = []
+        for email in emails:
+            if all(self.store.is_attachment_done(email["id"], a["partId"]) for a in email["attachments"]):
+                self.store.mark_message_done(email["id"])
+                if email["attachments"]:
+                    completed.append(email["id"])
+            elif email["id"] in rejected:
+                # Left unread for a human
+                self.store.mark_message_failed(email["id"])
+                print(f"⚠️ Giving up on message {email['id']}: the ORC API rejected its PDF")
+            elif self.store.record_failure(email["id"]):
+                print(f"⚠️ Giving up on message {email['id']} after {MAX_FETCH_ATTEMPTS} failed attempts")
+        if mark_read and completed:
+            self.mark_many_as_read(completed)
+        
+        print(f"\n✅ Processed {len(all_results)} PDFs from {len(pending)} new emails (cursor {new_cursor})")
         return all_results
+    
+    # --- PUSH NOTIFICATIONS (optional) ---
+    
+    def start_watch(self, topic: str) -> bool:
+        """
+        Register (or renew) a users.watch Pub/Sub subscription for the inbox.
+        Gmail expires watches after 7 days, so this is re-called before then.
+        """
+        try:
+            response = self.service.users().watch(
+                userId="me",
+                body={"topicName": topic, "labelIds": ["INBOX"], "labelFilterBehavior": "INCLUDE"}
+            ).execute(num_retries=API_RETRIES)
+            if self.store is None:
+                self.store = SyncStore()
+            self.store.set_meta("watch_expiration", str(response.get("expiration", "0")))
+            print(f"📡 Push notifications active on {topic}")
+            return True
+        except Exception as e:
+            print(f"⚠️ Could not start watch ({e}); falling back to polling")
+            return False
+    
+    def _watch_needs_renewal(self) -> bool:
+        expiration_ms = int(self.store.get_meta("watch_expiration") or 0) if self.store else 0
+        return time.time() + WATCH_RENEW_MARGIN_S > expiration_ms / 1000
+    
+    def handle_push_notification(self, envelope: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Handle a Pub/Sub push envelope ({"message": {"data": base64(json)}}).
+        The notification only carries a historyId, so we just run a sync.
+        """
+        try:
+            data = json.loads(base64.b64decode(envelope["message"]["data"]))
+            print(f"📨 Push notification for {data.get('emailAddress')} (historyId {data.get('historyId')})")
+        except Exception as e:
+            print(f"⚠️ Malformed push notification: {e}")
+        return self.sync()
+    
+    def run_forever(self, interval: int = POLL_INTERVAL_S, topic: Optional[str] = PUBSUB_TOPIC):
+        """
+        Long-running watcher: incremental sync every `interval` seconds.
+        With a Pub/Sub topic, the watch is kept renewed and the loop acts as
+        a safety net behind push-triggered syncs.
+        """
+        print(f"👀 Watching inbox (interval {interval}s{', push: ' + topic if topic else ''})")
+        try:
+            while True:
+                if topic and self._watch_needs_renewal():
+                    self.start_watch(topic)
+                self.sync()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("\n👋 Watcher stopped")
+        finally:
+            if self.store:
+                self.store.close()
 
 
 def check_oauth_status() -> Dict[str, Any]:
@@ -296,8 +835,14 @@ def check_oauth_status() -> Dict[str, Any]:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="ORC Gmail Watcher")
     parser.add_argument("--auth", action="store_true", help="Run OAuth2 authentication flow")
-    parser.add_argument("--poll", action="store_true", help="Poll inbox for PDFs")
+    parser.add_argument("--poll", action="store_true", help="Poll inbox for PDFs (one-shot search)")
+    parser.add_argument("--sync", action="store_true", help="Run one incremental history sync")
+    parser.add_argument("--watch", action="store_true", help="Run the long-running incremental watcher")
+    parser.add_argument("--interval", type=int, default=POLL_INTERVAL_S, help="Seconds between syncs in --watch mode")
+    parser.add_argument("--topic", default=PUBSUB_TOPIC, help="Pub/Sub topic for push notifications (optional)")
     parser.add_argument("--status", action="store_true", help="Check OAuth status")
+    parser.add_argument("--downloads", type=int, default=MAX_DOWNLOADS, help="Concurrent attachment downloads")
+    parser.add_argument("--inflight", type=int, default=MAX_INFLIGHT, help="Max in-flight submissions to the ORC API")
     args = parser.parse_args()
     
     if args.status:
@@ -305,7 +850,7 @@ if __name__ == "__main__":
         print(json.dumps(status, indent=2))
         sys.exit(0)
     
-    watcher = GmailWatcher()
+    watcher = GmailWatcher(max_downloads=args.downloads, max_inflight=args.inflight)
     
     if args.auth:
         if watcher.authenticate():
@@ -317,5 +862,13 @@ if __name__ == "__main__":
         if watcher.authenticate():
             watcher.poll_inbox()
     
+    elif args.sync:
+        if watcher.authenticate():
+            watcher.sync()
+    
+    elif args.watch:
+        if watcher.authenticate():
+            watcher.run_forever(interval=args.interval, topic=args.topic)
+    
     else:
         parser.print_help()
@@ -2,13 +2,26 @@ import os
 import json
 import base64
 import time
+import queue
+import hashlib
+import argparse
+import importlib.util
+import mimetypes
+import threading
 from pathlib import Path
+from datetime import datetime
+from collections import Counter
 import textwrap
 
-# Try importing the Gemini SDK
+from prompt_engine import PromptEngineWatcher
+from context_cache import GeminiPool, PromptPrefix
+
+# Check for the Gemini SDK (used through context_cache.GeminiPool)
 try:
-    import google.generativeai as genai
-except ImportError:
+    SDK_FOUND = importlib.util.find_spec("google.generativeai") is not None
+except ModuleNotFoundError:  # No google namespace package at all
+    SDK_FOUND = False
+if not SDK_FOUND:
     print("CRITICAL: google-generativeai library not found.")
     print("Please run: pip install google-generativeai")
     exit(1)
@@ -17,17 +30,22 @@ except ImportError:
 DATASET_DIR = Path("golden_dataset")
 PROMPT_ENGINE_PATH = Path("orc_prompt_engine.json")
 OUTPUT_LOG_DIR = Path("agent_logs")
+SUMMARY_FILE_NAME = "_summary.jsonl"  # Consolidated results + resume journal, inside the log dir
+WORKERS = int(os.environ.get("ORC_WORKERS", "4"))
+TEXT_SUFFIXES = ['.json', '.txt', '.csv', '.xml']
+BINARY_SUFFIXES = ['.pdf', '.jpg', '.png']
+# Summary rows are fsync'd in batches: a crash loses at most this many rows / seconds
+JOURNAL_SYNC_EVERY = 20
+JOURNAL_SYNC_INTERVAL_S = 2.0
 os.makedirs(OUTPUT_LOG_DIR, exist_ok=True)
 
-# Load Prompt Engine
+# Load Prompt Engine (compiled once; hot-reloaded by the watcher while the orchestrator runs)
 try:
-    with open(PROMPT_ENGINE_PATH, "r") as f:
-        PROMPT_ENGINE = json.load(f)
+    PROMPTS = PromptEngineWatcher(PROMPT_ENGINE_PATH)
 except FileNotFoundError:
     print(f"CRITICAL: {PROMPT_ENGINE_PATH} not found.")
     exit(1)
 
-# --- API SETUP ---
 # --- API SETUP ---
 API_KEYS_RAW = os.environ.get("GEMINI_API_KEYS") or os.environ.get("GEMINI_API_KEY") or ""
 API_KEYS = [k.strip() for k in API_KEYS_RAW.split(",") if k.strip()]
@@ -36,85 +54,65 @@ if not API_KEYS:
     print("WARNING: GEMINI_API_KEYS environment variable not set.")
     print("The agents will run in MOCK MODE unless you set the key.")
 
-# Global Key Index
-_key_index = 0
+# --- MODEL INITIALIZATION ---
+# Each agent's preamble is the static prefix of every call: it is registered
+# once per prompt version and key as Gemini cached content and referenced by
+# name, so documents only send (and pay full price for) their own part.
+# Falls back to the inline system instruction when caching isn't available.
+def agent_prefix(engine, agent):
+    return PromptPrefix(
+        cache_id=f"{engine.version}-{agent.name}",
+        model=engine.model,
+        system_instruction=agent.preamble,
+        generation_config=agent.generation_config
+    )
 
-def rotate_key():
-    global _key_index
-    if not API_KEYS: return None
-    key = API_KEYS[_key_index]
-    _key_index = (_key_index + 1) % len(API_KEYS)
-    genai.configure(api_key=key)
-    return key
 
-# Initial config
-if API_KEYS:
-    rotate_key()
+def engine_prefixes(engine):
+    return [agent_prefix(engine, agent) for agent in engine.agents.values()]
 
-# --- MODEL INITIALIZATION ---
-MODEL_NAME = PROMPT_ENGINE["system_meta"]["model"]
-GENERATION_CONFIG = {
-    "temperature": PROMPT_ENGINE["system_meta"]["temperature"],
-    "top_p": PROMPT_ENGINE["system_meta"]["top_p"],
-    "response_mime_type": "application/json"
-}
-
-def get_model():
-    if not API_KEYS:
-        return None
-    # Rotate key for every new model instance request (or per call if we rebuilt)
-    # For robust rotation, we call rotate_key() here.
-    rotate_key()
-    return genai.GenerativeModel(
-        model_name=MODEL_NAME,
-        generation_config=GENERATION_CONFIG
-    )
+
+GEMINI = GeminiPool(API_KEYS, prefixes=engine_prefixes(PROMPTS.current)) if API_KEYS else None
+
+
+def retain_engine(engine):
+    """Drop models and delete caches built for other prompt versions (after a reload)."""
+    GEMINI.retain(lambda cache_id: cache_id.startswith(f"{engine.version}-"))
+    GEMINI.report_caching(engine_prefixes(engine))
+
+
+if GEMINI:
+    PROMPTS.on_reload(retain_engine)
 
 # --- AGENT CLASSES ---
 
 class BaseAgent:
     def __init__(self, agent_name):
         self.name = agent_name
-        self.config = PROMPT_ENGINE["agents"].get(agent_name)
-        if not self.config:
+        if agent_name not in PROMPTS.current.agents:
             raise ValueError(f"Agent {agent_name} not defined in prompt engine.")
-        self.model = get_model()
-
-    def _build_prompt(self, context_text, additional_instructions=""):
-        return f"""
-        ROLE: {self.config['role']}
-        INSTRUCTION: {self.config['instruction']}
-        
-        {additional_instructions}
-
-        INPUT CONTEXT:
-        {context_text}
-        
-        OUTPUT SCHEMA:
-        {json.dumps(self.config.get('output_schema') or self.config.get('fields_to_extract'), indent=2)}
-        """
 
-    def process(self, content, mime_type="text/plain"):
-        print(f"[{self.name}] Processing...")
-        
-        prompt = self._build_prompt(
+    def process(self, content, mime_type="text/plain", engine=None):
+        """
+        Run this agent on one input. `engine` pins the compiled prompt version
+        (the orchestrator passes one snapshot for all three agents of a document).
+        """
+        engine = engine or PROMPTS.current
+        agent = engine.agents[self.name]
+        prompt = agent.render(
             context_text="[See attached content]" if mime_type != "text/plain" else content
         )
 
-        if not self.model:
+        if GEMINI is None:
             # MOCK RESPONSE for testing without API Key
-            print(f"[{self.name}] ** MOCK RESPONSE (No API Key) **")
             return self._mock_response()
 
         try:
             # Handle Multimodal (Images/PDFs) vs Text
-            if mime_type == "text/plain":
-                response = self.model.generate_content(prompt)
-            else:
-                # For simplicity in scaffolding, we assume content is already prepared/loaded
-                # In a real implementation, we pass the data blob.
-                response = self.model.generate_content([prompt, content])
-                
+            contents = prompt if mime_type == "text/plain" else [prompt, content]
+            response = GEMINI.generate(agent_prefix(engine, agent), contents)
+
+            # Output is constrained to the agent's response_schema server-side
             return json.loads(response.text)
         except Exception as e:
             print(f"[{self.name}] ERROR: {e}")
@@ -143,104 +141,289 @@ class Guardian(BaseAgent):
     def __init__(self):
         super().__init__("GUARDIAN")
 
+# --- RESULT JOURNAL ---
+
+class ResultJournal:
+    """
+    Append-only JSONL of orchestrator results (agent_logs/_summary.jsonl).
+    One row per processed file with its content hash, size/mtime and the
+    prompt-engine version; rows are appended as files finish and fsync'd in
+    batches. Opening the journal rebuilds the resume index, so a restarted run
+    skips every file already processed with the same content and prompts.
+    Rows with an agent error are kept but not treated as done.
+    """
+
+    def __init__(self, path, sync_every=JOURNAL_SYNC_EVERY, sync_interval=JOURNAL_SYNC_INTERVAL_S):
+        self.path = Path(path)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.done = set()  # (sha256, prompt_version)
+        self.by_name = {}  # file name -> (size, mtime_ns, sha256, prompt_version), for skipping without a read
+        self.rows = 0
+        self.lock = threading.Lock()
+        self._load()
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn last row from a crash mid-write
+                valid_size += len(line)
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                self.rows += 1
+                if not row.get("ok"):
+                    continue
+                self.done.add((row["sha256"], row["prompt_version"]))
+                self.by_name[row["file"]] = (row["size"], row["mtime_ns"], row["sha256"], row["prompt_version"])
+        if valid_size < self.path.stat().st_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+
+    def is_done_by_stat(self, file_path, stat, prompt_version):
+        known = self.by_name.get(file_path.name)
+        return known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns) and known[3] == prompt_version
+
+    def is_done(self, sha256, prompt_version):
+        return (sha256, prompt_version) in self.done
+
+    def append(self, row):
+        with self.lock:
+            if row.get("ok"):
+                self.done.add((row["sha256"], row["prompt_version"]))
+                self.by_name[row["file"]] = (row["size"], row["mtime_ns"], row["sha256"], row["prompt_version"])
+            self.file.write(json.dumps(row) + "\n")
+            self.rows += 1
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self.file.close()
+
 # --- ORCHESTRATOR ---
 
-def run_orchestrator():
-    print("--- ORC INITIATED ---")
-    print(f"Scanning directory: {DATASET_DIR}")
-    
-    files = list(DATASET_DIR.glob("*"))
-    print(f"Found {len(files)} files.")
-
-    gatekeeper = Gatekeeper()
-    analyst = Analyst()
-    guardian = Guardian()
-
-    results_summary = []
-
-    for file_path in files:
-        if file_path.name.startswith("."): continue # Skip hidden
-        
-        print(f"\n>>> PROCESSING: {file_path.name}")
-        
-        # 1. READ FILE
-        mime_type = "text/plain"
-        content = ""
-        
-        try:
-            if file_path.suffix.lower() in ['.json', '.txt', '.csv', '.xml']:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-            elif file_path.suffix.lower() in ['.pdf', '.jpg', '.png']:
-                # For PDF/Images, we would technically load bytes.
-                # For this scaffolding, we'll implement a simple text placeholder or 
-                # use the actual part creation if we were fully implementing.
-                # Let's load bytes for the 'content' to pass to Gemini (if supported in this simplified script)
-                import mimetypes
-                mime_type, _ = mimetypes.guess_type(file_path)
-                with open(file_path, "rb") as f:
-                    # Construct a Part object if using genai, but for now let's keep it simple
-                    # We will pass the raw data object if using the SDK usually requires specific object wrapper
-                    # For this scaffold, we'll placeholder the binary handling.
-                    content = {
-                        "mime_type": mime_type,
-                        "data": f.read()
-                    }
+def iter_documents(dataset_dir):
+    """Lazily yield supported files (no directory-sized list in memory)."""
+    with os.scandir(dataset_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file(): continue # Skip hidden
+            suffix = Path(entry.name).suffix.lower()
+            if suffix in TEXT_SUFFIXES or suffix in BINARY_SUFFIXES:
+                yield Path(entry.path)
             else:
-                print(f"Skipping unsupported file type: {file_path.suffix}")
+                print(f"Skipping unsupported file type: {suffix} ({entry.name})")
+
+def read_document(file_path):
+    """Returns (content, mime_type, sha256 of the raw bytes)."""
+    data = file_path.read_bytes()
+    sha256 = hashlib.sha256(data).hexdigest()
+    if file_path.suffix.lower() in TEXT_SUFFIXES:
+        return data.decode("utf-8"), "text/plain", sha256
+    mime_type, _ = mimetypes.guess_type(file_path)
+    return {"mime_type": mime_type, "data": data}, mime_type, sha256
+
+def process_document(content, mime_type, gatekeeper, analyst, guardian, engine):
+    """Gatekeeper -> Analyst -> Guardian for one document, all on one prompt version. Returns their results."""
+    # 1. GATEKEEPER (Classify)
+    gk_result = gatekeeper.process(content, mime_type=mime_type, engine=engine)
+
+    # 2. ANALYST (Extract)
+    # Only proceed if it's an Invoice or PO (skip chat logs for deep extraction unless configured)
+    doc_type = str(gk_result.get('doc_type', 'Unknown')).lower()
+    if "invoice" in doc_type or "purchase" in doc_type or "order" in doc_type:
+        analyst_result = analyst.process(content, mime_type=mime_type, engine=engine)
+    else:
+        analyst_result = {"skipped": True, "reason": "Not an Invoice/PO"}
+
+    # 3. GUARDIAN (Validate)
+    if not analyst_result.get("skipped"):
+        # Combine context for Guardian: Metadata + Extracted Data
+        guardian_input = json.dumps({
+            "meta": gk_result,
+            "data": analyst_result
+        }, indent=2)
+        guardian_result = guardian.process(guardian_input, mime_type="text/plain", engine=engine)
+    else:
+        guardian_result = {"status": "SKIPPED"}
+
+    return gk_result, analyst_result, guardian_result
+
+def run_orchestrator(dataset_dir=DATASET_DIR, log_dir=OUTPUT_LOG_DIR, workers=WORKERS, resume=True, limit=None):
+    """
+    Process every document in dataset_dir with `workers` parallel pipelines.
+    Files stream through a bounded queue, so memory stays flat however large
+    the directory; each result is written to its own log and to the summary
+    journal as soon as it finishes.
+    """
+    print("--- ORC INITIATED ---")
+    print(f"Scanning directory: {dataset_dir}")
+    print(f"Workers: {workers} | Prompt engine version: {PROMPTS.current.version}")
+
+    log_dir = Path(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+    summary_path = log_dir / SUMMARY_FILE_NAME
+    if not resume and summary_path.exists():
+        backup = summary_path.with_name(f"{summary_path.name}.{datetime.now():%Y%m%d-%H%M%S}.bak")
+        summary_path.rename(backup)
+        print(f"Previous summary moved to {backup.name}")
+    journal = ResultJournal(summary_path)
+    already_done = sum(1 for _, version in journal.done if version == PROMPTS.current.version)
+    if already_done:
+        print(f"Resuming: {already_done} documents already processed with this prompt engine")
+
+    # Pick up prompt edits without restarting the run
+    PROMPTS.start()
+
+    # One agent set per worker; GEMINI spreads their calls round-robin over the API keys
+    pipelines = [(Gatekeeper(), Analyst(), Guardian()) for _ in range(workers)]
+
+    work = queue.Queue(maxsize=2 * workers)
+    stats = Counter()
+    stats_lock = threading.Lock()
+    stop = threading.Event()
+    start = time.perf_counter()
+
+    def count(key):
+        with stats_lock:
+            stats[key] += 1
+            done = stats["processed"] + stats["skipped"]
+            if key in ("processed", "skipped") and done % 100 == 0:
+                elapsed = time.perf_counter() - start
+                print(f"... {done} files ({stats['processed'] / elapsed:.2f} processed/s)")
+
+    def worker(gatekeeper, analyst, guardian):
+        while True:
+            file_path = work.get()
+            if file_path is None or stop.is_set():
+                return
+
+            # 1. READ FILE (skip unchanged files without reading them)
+            try:
+                # One prompt-engine snapshot per document (hot reloads apply from the next one)
+                engine = PROMPTS.current
+                stat = file_path.stat()
+                if resume and journal.is_done_by_stat(file_path, stat, engine.version):
+                    count("skipped")
+                    continue
+                content, mime_type, sha256 = read_document(file_path)
+            except Exception as e:
+                print(f"Error reading file {file_path.name}: {e}")
+                count("read_errors")
                 continue
-                
-        except Exception as e:
-            print(f"Error reading file: {e}")
-            continue
-
-        # 2. GATEKEEPER (Classify)
-        gk_result = gatekeeper.process(content, mime_type=mime_type)
-        print(f"   [Gate] Identified: {gk_result.get('doc_type')} ({gk_result.get('confidence_score')})")
-
-        # 3. ANALYST (Extract)
-        # Only proceed if it's an Invoice or PO (skip chat logs for deep extraction unless configured)
-        doc_type = gk_result.get('doc_type', 'Unknown').lower()
-        if "invoice" in doc_type or "purchase" in doc_type or "order" in doc_type:
-            analyst_result = analyst.process(content, mime_type=mime_type)
-            print(f"   [Analyst] Extracted: {analyst_result.get('total_amount')} {analyst_result.get('currency')}")
-        else:
-            analyst_result = {"skipped": True, "reason": "Not an Invoice/PO"}
-            print("   [Analyst] Skipped (Doc Type not relevant for full extraction)")
-
-        # 4. GUARDIAN (Validate)
-        if not analyst_result.get("skipped"):
-            # Combine context for Guardian: Metadata + Extracted Data
-            guardian_input = json.dumps({
-                "meta": gk_result,
-                "data": analyst_result
-            }, indent=2)
-            
-            guardian_result = guardian.process(guardian_input, mime_type="text/plain")
-            status = guardian_result.get('status', 'UNKNOWN')
-            color = "\033[92m" if status == "PASS" else "\033[91m"
-            reset = "\033[0m"
-            print(f"   [Guardian] Verdict: {color}{status}{reset} | Reason: {guardian_result.get('reasoning')}")
-        else:
-            guardian_result = {"status": "SKIPPED"}
-
-        # 5. LOG RESULT
-        log_entry = {
-            "file": file_path.name,
-            "gatekeeper": gk_result,
-            "analyst": analyst_result,
-            "guardian": guardian_result
-        }
-        results_summary.append(log_entry)
-        
-        # Save individual log
-        with open(OUTPUT_LOG_DIR / f"{file_path.name}.json", "w") as f:
-            json.dump(log_entry, f, indent=2)
+            if resume and journal.is_done(sha256, engine.version):
+                count("skipped")
+                continue
+
+            # A failure here must not kill the worker: the main thread would block on work.put
+            try:
+                file_start = time.perf_counter()
+                gk_result, analyst_result, guardian_result = process_document(content, mime_type, gatekeeper, analyst, guardian, engine)
+                elapsed_ms = (time.perf_counter() - file_start) * 1000
+
+                status = guardian_result.get('status', 'UNKNOWN')
+                color = "\033[92m" if status == "PASS" else "\033[91m"
+                reset = "\033[0m"
+                print(f">>> {file_path.name}: {gk_result.get('doc_type')} ({gk_result.get('confidence_score')}) | "
+                      f"{analyst_result.get('total_amount')} {analyst_result.get('currency')} | "
+                      f"{color}{status}{reset} ({elapsed_ms:.0f}ms)")
+
+                # 2. LOG RESULT
+                log_entry = {
+                    "file": file_path.name,
+                    "gatekeeper": gk_result,
+                    "analyst": analyst_result,
+                    "guardian": guardian_result
+                }
+
+                # Save individual log
+                with open(log_dir / f"{file_path.name}.json", "w") as f:
+                    json.dump(log_entry, f, indent=2)
+
+                ok = not any("error" in result for result in (gk_result, analyst_result, guardian_result))
+                journal.append({
+                    **log_entry,
+                    "sha256": sha256,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "prompt_version": engine.version,
+                    "ok": ok,
+                    "elapsed_ms": round(elapsed_ms, 1),
+                    "processed_at": datetime.now().isoformat()
+                })
+                count("processed")
+                count(status if ok else "errors")
+            except Exception as e:
+                print(f"Error processing file {file_path.name}: {e}")
+                count("errors")
+
+    threads = [threading.Thread(target=worker, args=pipeline, daemon=True) for pipeline in pipelines]
+    for thread in threads:
+        thread.start()
+
+    try:
+        queued = 0
+        for file_path in iter_documents(dataset_dir):
+            if limit and queued >= limit:
+                break
+            work.put(file_path)  # Blocks while the queue is full
+            queued += 1
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print("\nInterrupted: finishing in-flight files...")
+        stop.set()
+        for _ in threads:
+            try:
+                work.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in threads:
+            thread.join(timeout=60)
+    finally:
+        PROMPTS.stop()
+        journal.close()
+        if GEMINI:
+            GEMINI.close()
 
     # FINAL REPORT
+    elapsed = time.perf_counter() - start
     print("\n--- RUN COMPLETE ---")
-    print(f"Processed {len(files)} files.")
-    print(f"Logs saved to {OUTPUT_LOG_DIR}")
+    print(f"Processed {stats['processed']} files in {elapsed:.1f}s ({stats['processed'] / max(elapsed, 1e-9):.2f} files/s)")
+    print(f"Skipped (already processed): {stats['skipped']} | Agent errors: {stats['errors']} | Read errors: {stats['read_errors']}")
+    print("Verdicts: " + (", ".join(f"{k}={stats[k]}" for k in ("PASS", "REVIEW", "REJECT", "SKIPPED") if stats[k]) or "none"))
+    print(f"Logs saved to {log_dir}")
+    print(f"Summary: {summary_path} ({journal.rows} rows)")
+    if GEMINI:
+        cache = GEMINI.stats()
+        print(f"Context cache: {cache.get('cached_calls', 0)} cached / {cache.get('inline_calls', 0)} inline calls | "
+              f"{cache.get('cached_tokens', 0)} of {cache.get('prompt_tokens', 0)} prompt tokens from cache")
 
 if __name__ == "__main__":
-    run_orchestrator()
+    parser = argparse.ArgumentParser(description="ORC Agent Orchestrator")
+    parser.add_argument("--input-dir", default=str(DATASET_DIR))
+    parser.add_argument("--log-dir", default=str(OUTPUT_LOG_DIR))
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Parallel document pipelines")
+    parser.add_argument("--limit", type=int, help="Max files to queue")
+    parser.add_argument("--no-resume", action="store_true", help="Reprocess everything (previous summary kept as .bak)")
+    args = parser.parse_args()
+
+    run_orchestrator(Path(args.input_dir), Path(args.log_dir), args.workers, resume=not args.no_resume, limit=args.limit)
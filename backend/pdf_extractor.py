@@ -3,6 +3,7 @@ ORC PDF Table Extractor
 Uses pdfplumber for reliable table extraction from invoices/POs.
 """
 
+import re
 import pdfplumber
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Union
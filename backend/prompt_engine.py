@@ -0,0 +1,241 @@
+"""
+ORC Prompt Engine
+Compiles orc_prompt_engine.json once into immutable per-agent prompts:
+- preamble: role, instruction, logic/checks and output schema; static, so it
+  is sent as the model's system instruction
+- template: the per-document part (extra instructions + input context)
+- response_schema: the agent's output shape as a Gemini schema, so the
+  response is constrained to valid JSON of that shape server-side
+
+The compiled engine carries a version hash (prompt file + compiler version),
+used as the cache/resume key for anything produced with these prompts.
+PromptEngineWatcher polls the file and swaps in a recompiled engine when it
+changes; running workers pick it up on their next document.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+try:
+    from google.generativeai import protos
+except ImportError:
+    protos = None
+
+# Bump when compilation changes what is sent for the same prompt file
+COMPILER_VERSION = 1
+WATCH_INTERVAL_S = 2.0
+
+FIELD_PATTERN = re.compile(r"^\s*(\w+)\s*\((.*)\)\s*$")  # "po_number (String)"
+
+PROMPT_TEMPLATE = """{additional_instructions}
+INPUT CONTEXT:
+{context_text}
+"""
+
+
+@dataclass(frozen=True)
+class CompiledAgent:
+    name: str
+    preamble: str
+    response_schema: Mapping[str, Any]  # OpenAPI-style dict (Gemini subset)
+    generation_config: Mapping[str, Any]  # Base config + response_schema (as protos.Schema when available)
+
+    def render(self, context_text: str, additional_instructions: str = "") -> str:
+        return PROMPT_TEMPLATE.format(
+            additional_instructions=additional_instructions + "\n" if additional_instructions else "",
+            context_text=context_text
+        )
+
+
+@dataclass(frozen=True)
+class CompiledPromptEngine:
+    version: str
+    model: str
+    agents: Mapping[str, CompiledAgent]
+    compiled_at: float
+
+
+# --- SCHEMA COMPILATION ---
+
+def _field_schema(description: Any) -> Dict[str, Any]:
+    """
+    Gemini schema for one field from its prompt-engine description, e.g.
+    "Float (0.0-1.0)", "PASS | REVIEW | REJECT", "Object: name, address",
+    "Array of Objects: sku, qty: Float", ["Array of warning strings"].
+    Anything unrecognized is a nullable string carrying the description.
+    """
+    if isinstance(description, list):
+        text = description[0] if description else ""
+        return {"type": "ARRAY", "items": {"type": "STRING"}, "description": str(text)}
+
+    text = str(description).strip()
+    lowered = text.lower()
+    if " | " in text:
+        return {"type": "STRING", "enum": [option.strip() for option in text.split("|")]}
+    if lowered.startswith("array of objects:"):
+        return {"type": "ARRAY", "items": _object_schema(text.split(":", 1)[1])}
+    if lowered.startswith("object:"):
+        return _object_schema(text.split(":", 1)[1], nullable=True)
+    if lowered.startswith("array"):
+        return {"type": "ARRAY", "items": {"type": "STRING"}, "description": text}
+    if lowered.startswith(("float", "number")):
+        return {"type": "NUMBER", "nullable": True, "description": text}
+    if lowered.startswith(("int", "integer")):
+        return {"type": "INTEGER", "nullable": True, "description": text}
+    if lowered.startswith(("bool", "boolean")):
+        return {"type": "BOOLEAN", "nullable": True, "description": text}
+    return {"type": "STRING", "nullable": True, "description": text}
+
+
+def _object_schema(fields: str, nullable: bool = False) -> Dict[str, Any]:
+    """"name, address" or "sku, qty: Float" -> OBJECT; untyped fields are strings."""
+    properties = {}
+    for field in fields.split(","):
+        name, _, type_name = field.partition(":")
+        properties[name.strip()] = _field_schema(type_name.strip() or "String")
+    schema = {"type": "OBJECT", "properties": properties, "required": list(properties)}
+    if nullable:
+        schema["nullable"] = True
+    return schema
+
+
+def compile_response_schema(agent_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Top-level OBJECT schema from `output_schema` (name -> description) or `fields_to_extract` ("name (description)")."""
+    if agent_config.get("output_schema"):
+        fields = dict(agent_config["output_schema"])
+    else:
+        fields = {}
+        for entry in agent_config.get("fields_to_extract", []):
+            match = FIELD_PATTERN.match(entry)
+            if not match:
+                raise ValueError(f"Cannot parse field description: {entry!r}")
+            fields[match.group(1)] = match.group(2)
+
+    properties = {name: _field_schema(description) for name, description in fields.items()}
+    # Every key present (possibly null), so consumers never have to guess
+    return {"type": "OBJECT", "properties": properties, "required": list(properties)}
+
+
+def _build_preamble(agent_config: Dict[str, Any]) -> str:
+    parts = [
+        f"ROLE: {agent_config['role']}",
+        f"INSTRUCTION: {agent_config['instruction']}"
+    ]
+    if agent_config.get("logic"):
+        parts.append(f"LOGIC: {agent_config['logic']}")
+    if agent_config.get("checks"):
+        parts.append("CHECKS:\n" + "\n".join(f"- {check}" for check in agent_config["checks"]))
+    schema = agent_config.get("output_schema") or agent_config.get("fields_to_extract")
+    parts.append(f"OUTPUT SCHEMA:\n{json.dumps(schema, indent=2)}")
+    return "\n\n".join(parts)
+
+
+def engine_version(raw: Dict[str, Any]) -> str:
+    canonical = json.dumps(raw, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{COMPILER_VERSION}:{canonical}".encode("utf-8")).hexdigest()[:12]
+
+
+def compile_prompt_engine(raw: Dict[str, Any]) -> CompiledPromptEngine:
+    """Compile the parsed prompt-engine JSON. Raises ValueError/KeyError on malformed input."""
+    meta = raw["system_meta"]
+    base_config = {
+        "temperature": meta["temperature"],
+        "top_p": meta["top_p"],
+        "response_mime_type": "application/json"
+    }
+
+    agents = {}
+    for name, agent_config in raw["agents"].items():
+        response_schema = compile_response_schema(agent_config)
+        generation_config = dict(base_config)
+        generation_config["response_schema"] = protos.Schema(response_schema) if protos else response_schema
+        agents[name] = CompiledAgent(
+            name=name,
+            preamble=_build_preamble(agent_config),
+            response_schema=MappingProxyType(response_schema),
+            generation_config=MappingProxyType(generation_config)
+        )
+
+    return CompiledPromptEngine(
+        version=engine_version(raw),
+        model=meta["model"],
+        agents=MappingProxyType(agents),
+        compiled_at=time.time()
+    )
+
+
+def load_prompt_engine(path: Path) -> CompiledPromptEngine:
+    with open(path, "r", encoding="utf-8") as f:
+        return compile_prompt_engine(json.load(f))
+
+
+# --- HOT RELOAD ---
+
+class PromptEngineWatcher:
+    """
+    Holds the current compiled engine and recompiles it when the file changes
+    (polled by (mtime, size); no extra dependency). Readers take
+    `watcher.current` once per unit of work, so one document is never
+    processed with a mix of two prompt versions. A file that fails to compile
+    is reported and the previous engine stays active.
+    """
+
+    def __init__(self, path: Path, interval: float = WATCH_INTERVAL_S):
+        self.path = Path(path)
+        self.interval = interval
+        self.listeners: List[Callable[[CompiledPromptEngine], None]] = []
+        self._signature = self._stat()
+        self.current = load_prompt_engine(self.path)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def on_reload(self, listener: Callable[[CompiledPromptEngine], None]):
+        self.listeners.append(listener)
+
+    def check(self) -> bool:
+        """Recompile if the file changed. Returns True if a new version was activated."""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            engine = load_prompt_engine(self.path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[PromptEngine] Reload failed, keeping {self.current.version}: {e}")
+            return False
+        if engine.version == self.current.version:
+            return False
+
+        previous, self.current = self.current, engine
+        print(f"[PromptEngine] Reloaded {self.path.name}: {previous.version} -> {engine.version}")
+        for listener in self.listeners:
+            listener(engine)
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prompt-engine-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
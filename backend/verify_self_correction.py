@@ -0,0 +1,125 @@
+"""
+ORC Self-Correction Check
+Exercises /extract's self-correction loop (run_self_correction) offline, with
+a scripted model in place of Gemini:
+1. Flagged line item + totals mismatch: corrected to PASS in one attempt
+2. A correction that changes nothing: stops after one attempt
+3. Corrections that change but don't fix: stop at MAX_CORRECTION_RETRIES
+4. Malformed answers (incl. booleans as numbers): previous result kept, no exception
+5. REVIEW with nothing correctable (low confidence): no model call
+6. Exhausted token budget: no model call
+
+Run with: python verify_self_correction.py
+"""
+
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+# A key makes api_server build its prompt prefixes; the pool is replaced below
+os.environ.setdefault("GEMINI_API_KEYS", "verify-key")
+import api_server
+from api_server import (
+    AnalystResult, GatekeeperResult, LineItem, CorrectionBudget,
+    MAX_CORRECTION_RETRIES, run_guardian, run_self_correction
+)
+
+DOCUMENT_TEXT = "INVOICE 7\nA1 Widget 2 x 10.00 = 20.00\nB2 Bolt 4 x 2.50 = 10.00\nTOTAL 30.00"
+
+
+class ScriptedGemini:
+    """Answers generate() calls from a list of response texts (the last one repeats)."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def generate(self, prefix, contents, **kwargs):
+        self.calls += 1
+        text = self.answers[min(self.calls, len(self.answers)) - 1]
+        return SimpleNamespace(text=text, usage_metadata=None)
+
+
+def extraction():
+    # Widget's total was misread as 0: zero-total flag + totals mismatch
+    return AnalystResult(
+        line_items=[
+            LineItem(sku="A1", desc="Widget", qty=2, unit_price=10.0, total=0.0),
+            LineItem(sku="B2", desc="Bolt", qty=4, unit_price=2.5, total=10.0)
+        ],
+        subtotal=30.0, tax_amount=0.0, total_amount=30.0, currency="USD", extraction_method="pdfplumber"
+    )
+
+
+def run_case(label, gemini, gatekeeper=None, budget=None):
+    gatekeeper = gatekeeper or GatekeeperResult(doc_type="Invoice", vendor_name="ACME", confidence_score=0.99, summary="Invoice")
+    analyst = extraction()
+    guardian, fraud = run_guardian(gatekeeper, analyst)
+    api_server.GEMINI = gemini
+    analyst, guardian, fraud = run_self_correction(DOCUMENT_TEXT, gatekeeper, analyst, guardian, fraud, budget)
+    print(f"   {label}: {guardian.status} after {gemini.calls} model call(s), "
+          f"totals {[item.total for item in analyst.line_items]}, method {analyst.extraction_method}")
+    return analyst, guardian
+
+
+def check(results, ok, message):
+    results.append(ok)
+    print(f"{'✅' if ok else '❌'} {message}")
+
+
+def verify() -> bool:
+    results = []
+    fixed = json.dumps({"line_items": [{"index": 0, "sku": "A1", "desc": "Widget", "qty": 2, "unit_price": 10.0, "total": 20.0}]})
+    unchanged = json.dumps({"line_items": [{"index": 0, "sku": "A1", "desc": "Widget", "qty": 2, "unit_price": 10.0, "total": 0.0}]})
+
+    print("🚀 Self-correction loop")
+    gemini = ScriptedGemini(fixed)
+    analyst, guardian = run_case("fixable", gemini)
+    check(results, guardian.status == "PASS" and gemini.calls == 1 and analyst.line_items[0].total == 20.0,
+          "Flagged item corrected to PASS")
+
+    gemini = ScriptedGemini(unchanged)
+    analyst, guardian = run_case("unchanged", gemini)
+    check(results, guardian.status == "REVIEW" and gemini.calls == 1 and analyst.extraction_method == "pdfplumber",
+          "Unchanged correction stops after 1 attempt")
+
+    wrong = [
+        json.dumps({"line_items": [{"index": 0, "sku": "A1", "desc": "Widget", "qty": 2, "unit_price": 10.0, "total": float(i)}]})
+        for i in range(1, MAX_CORRECTION_RETRIES + 2)
+    ]
+    gemini = ScriptedGemini(*wrong)
+    analyst, guardian = run_case("unfixable", gemini)
+    check(results, guardian.status == "REVIEW" and gemini.calls == MAX_CORRECTION_RETRIES,
+          f"Unfixable item stops after {MAX_CORRECTION_RETRIES} attempts")
+
+    for answer in ("[1, 2]", '{"line_items": 5}', '{"line_items": [{"index": 0, "qty": "two"}]}', "not json",
+                   '{"line_items": [{"index": 0, "qty": true, "unit_price": 10.0, "total": 20.0}]}',
+                   '{"line_items": [{"index": true, "qty": 2, "unit_price": 10.0, "total": 20.0}], "total": true}'):
+        gemini = ScriptedGemini(answer)
+        analyst, guardian = run_case(f"malformed {answer[:20]!r}", gemini)
+        check(results, guardian.status == "REVIEW" and analyst.extraction_method == "pdfplumber",
+              "Malformed answer keeps the previous result")
+
+    gemini = ScriptedGemini(fixed)
+    low_confidence = GatekeeperResult(doc_type="Invoice", vendor_name="ACME", confidence_score=0.5, summary="Invoice")
+    api_server.GEMINI = gemini
+    analyst = AnalystResult(
+        line_items=[LineItem(sku="A1", desc="Widget", qty=2, unit_price=10.0, total=20.0)],
+        subtotal=20.0, tax_amount=0.0, total_amount=20.0, currency="USD", extraction_method="pdfplumber"
+    )
+    guardian, fraud = run_guardian(low_confidence, analyst)
+    run_self_correction(DOCUMENT_TEXT, low_confidence, analyst, guardian, fraud)
+    check(results, guardian.status == "REVIEW" and gemini.calls == 0, "Nothing correctable: no model call")
+
+    gemini = ScriptedGemini(fixed)
+    run_case("no budget", gemini, budget=CorrectionBudget(max_tokens=10))
+    check(results, gemini.calls == 0, "Exhausted budget: no model call")
+
+    ok = all(results)
+    print("✅ Self-correction verified" if ok else "❌ Self-correction check failed")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if verify() else 1)
@@ -1,10 +1,12 @@
 import os
+import io
 import sys
 import json
 import time
+import asyncio
 import argparse
-import base64
 import random
+import hashlib
 from pathlib import Path
 from datetime import datetime
 
@@ -13,23 +15,56 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 try:
     import google.generativeai as genai
+    from google.generativeai import client as genai_client
+    from google.api_core.exceptions import ResourceExhausted
 except ImportError:
     print("ERROR: google-generativeai not installed.")
     print("Run: pip install google-generativeai")
     sys.exit(1)
 
+from PIL import Image, ImageOps
+
 try:
     from tqdm import tqdm
 except ImportError:
     # Fallback if tqdm not installed
-    def tqdm(iterable, **kwargs):
-        return iterable
+    class tqdm:
+        def __init__(self, *args, **kwargs): pass
+        def update(self, n=1): pass
+        def close(self): pass
 
 # --- CONFIGURATION ---
 KAGGLE_DATA_DIR = Path(r"c:\Users\delat\Downloads\kaggle_datasets\batch_1")
 OUTPUT_DIR = Path(__file__).parent / "ground_truth"
-CHECKPOINT_FILE = OUTPUT_DIR / "_checkpoint.json"
-DATASET_FILE = OUTPUT_DIR / "dataset.jsonl"
+DATASET_FILE = OUTPUT_DIR / "dataset.jsonl"  # Append-only journal, one result per line
+LEGACY_CHECKPOINT_FILE = OUTPUT_DIR / "_checkpoint.json"  # v1 resume state, still honoured (by name)
+
+# Journal rows are fsync'd in batches: a crash loses at most this many rows / seconds
+JOURNAL_SYNC_EVERY = 50
+JOURNAL_SYNC_INTERVAL_S = 2.0
+
+MODEL_NAME = "gemini-2.5-flash"
+GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "top_p": 0.95,
+    "response_mime_type": "application/json"
+}
+
+# --- RATE CONTROL ---
+# Each key gets its own token bucket (requests per minute, small burst) and its
+# own AIMD concurrency limit: +1 in-flight slot per window of successes, halved
+# on a 429. Throughput therefore scales with the number of keys, and a key that
+# hits its quota slows down on its own without stalling the others.
+REQUESTS_PER_MINUTE = float(os.environ.get("LABELER_RPM", "10"))  # Per key (free tier flash)
+BURST = int(os.environ.get("LABELER_BURST", "2"))
+MAX_IN_FLIGHT = int(os.environ.get("LABELER_MAX_IN_FLIGHT", "8"))  # Per key, AIMD ceiling
+INITIAL_IN_FLIGHT = 2
+MAX_BACKOFF_S = 60.0
+
+# Images are shrunk and re-encoded as JPEG before upload: a phone photo of an
+# invoice is several MB, but the model tiles images at ~768px anyway.
+MAX_IMAGE_SIDE = int(os.environ.get("LABELER_MAX_SIDE", "1600"))
+JPEG_QUALITY = 85
 
 # Load API keys from .env
 ENV_PATH = Path(__file__).parent.parent / ".env"
@@ -48,19 +83,9 @@ def load_api_keys():
         env_keys = os.environ.get("GEMINI_API_KEYS", "")
         if env_keys:
             keys = env_keys.split(",")
-    return keys
+    return [k.strip() for k in keys if k.strip()]
 
 API_KEYS = load_api_keys()
-current_key_index = 0
-
-def get_next_api_key():
-    """Rotate to next API key."""
-    global current_key_index
-    if not API_KEYS:
-        raise ValueError("No API keys found! Check .env file.")
-    key = API_KEYS[current_key_index]
-    current_key_index = (current_key_index + 1) % len(API_KEYS)
-    return key
 
 # --- EXTRACTION SCHEMA ---
 EXTRACTION_PROMPT = """You are an expert invoice data extractor. Analyze this invoice image and extract ALL information.
@@ -97,24 +122,124 @@ IMPORTANT:
 - All monetary values as numbers, not strings
 """
 
-def encode_image(image_path: Path) -> tuple[str, str]:
-    """Encode image to base64 with MIME type."""
-    suffix = image_path.suffix.lower()
-    mime_types = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".gif": "image/gif",
-        ".webp": "image/webp"
-    }
-    mime_type = mime_types.get(suffix, "image/jpeg")
-    
-    with open(image_path, "rb") as f:
-        data = base64.standard_b64encode(f.read()).decode("utf-8")
-    
-    return data, mime_type
+class TokenBucket:
+    """Request budget for one key: `rate` tokens/s refilled continuously, at most `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()  # Waiters are served in arrival order
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Issue no tokens for `seconds`, then refill from empty (after a 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+class AdaptiveLimit:
+    """
+    AIMD in-flight limit for one key. Each success adds 1/limit (about +1 per
+    window), a 429 halves it. Requests that were already in flight when the
+    limit was cut don't cut it again, so one burst of 429s counts once.
+    """
+
+    def __init__(self, initial: int, maximum: int):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.in_flight = 0
+        self.generation = 0
+        self.condition = asyncio.Condition()
 
-def extract_invoice_data(image_path: Path, dry_run: bool = False, max_retries: int = 5) -> dict:
+    async def acquire(self) -> int:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            return self.generation
+
+    async def release(self, generation: int, throttled: bool):
+        async with self.condition:
+            self.in_flight -= 1
+            if not throttled:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif generation == self.generation:
+                self.limit = max(1.0, self.limit / 2)
+                self.generation += 1
+            self.condition.notify_all()
+
+
+class KeySlot:
+    """One API key: its model, token bucket, AIMD limit and counters."""
+
+    def __init__(self, index: int, model, rpm: float, burst: int, max_in_flight: int):
+        self.index = index
+        self.model = model
+        self.bucket = TokenBucket(rpm / 60.0, burst)
+        self.limit = AdaptiveLimit(INITIAL_IN_FLIGHT, max_in_flight)
+        self.requests = 0
+        self.throttled = 0
+
+
+def build_model(api_key: str):
+    """
+    GenerativeModel bound to one key. genai.configure() is process-global, so
+    the model's async client is created right after configuring its key and
+    later configure() calls for other keys leave it alone.
+    google-generativeai has no public per-model client or key: this sets the
+    private `_async_client` GenerativeModel would otherwise create lazily on
+    first use, which is why requirements.txt pins the 0.8.x line.
+    """
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(model_name=MODEL_NAME, generation_config=GENERATION_CONFIG)
+    model._async_client = genai_client.get_default_generative_async_client()
+    return model
+
+
+def prepare_image(image_path: Path, max_side: int = MAX_IMAGE_SIDE) -> tuple[str, bytes, str]:
+    """
+    Read the file once: content hash of the original bytes, then downscale
+    (longest side <= max_side) and re-encode as JPEG. Returns (sha256, bytes, MIME type).
+    """
+    raw = image_path.read_bytes()
+    sha256 = hashlib.sha256(raw).hexdigest()
+    with Image.open(io.BytesIO(raw)) as img:
+        # JPEGs decode straight at a reduced scale (1/2, 1/4, 1/8) >= the target size
+        scale = max_side / max(img.size)
+        if scale < 1:
+            img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return sha256, buf.getvalue(), "image/jpeg"
+
+
+def is_rate_limited(error: Exception) -> bool:
+    error_str = str(error)
+    return isinstance(error, ResourceExhausted) or "429" in error_str or "quota" in error_str.lower()
+
+
+async def extract_invoice_data(slot: KeySlot, image_path: Path, image_data: bytes, mime_type: str,
+                               dry_run: bool = False, max_retries: int = 5) -> dict:
     """Extract structured data from invoice image using Gemini with retry logic."""
     if dry_run:
         return {
@@ -122,60 +247,47 @@ def extract_invoice_data(image_path: Path, dry_run: bool = False, max_retries: i
             "invoice_number": "DRY-001",
             "total_amount": 100.00,
             "confidence": 1.0,
-            "_dry_run": True
+            "_dry_run": True,
+            "_source_file": image_path.name
         }
-    
-    # Encode image once
-    image_data, mime_type = encode_image(image_path)
-    
+
+    content = [
+        EXTRACTION_PROMPT,
+        {
+            "mime_type": mime_type,
+            "data": image_data
+        }
+    ]
+
     for attempt in range(max_retries):
+        generation = await slot.limit.acquire()
+        throttled = False
         try:
-            # Get next API key (rotation)
-            api_key = get_next_api_key()
-            genai.configure(api_key=api_key)
-            
-            model = genai.GenerativeModel(
-                model_name="gemini-2.5-flash",
-                generation_config={
-                    "temperature": 0.1,
-                    "top_p": 0.95,
-                    "response_mime_type": "application/json"
-                }
-            )
-            
-            # Create content with image
-            content = [
-                EXTRACTION_PROMPT,
-                {
-                    "mime_type": mime_type,
-                    "data": image_data
-                }
-            ]
-            
-            response = model.generate_content(content)
+            await slot.bucket.acquire()
+            slot.requests += 1
+            response = await slot.model.generate_content_async(content)
             result = json.loads(response.text)
             result["_source_file"] = image_path.name
             result["_extracted_at"] = datetime.now().isoformat()
             return result
-            
+
         except Exception as e:
-            error_str = str(e)
-            
-            # Check if rate limited (429)
-            if "429" in error_str or "quota" in error_str.lower():
-                # Exponential backoff with jitter
-                wait_time = (2 ** attempt) + random.uniform(0, 1)
-                print(f"\n  Rate limited, waiting {wait_time:.1f}s (attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
+            if is_rate_limited(e):
+                # Back off this key only (exponential, with jitter); the other keys keep going
+                throttled = True
+                slot.throttled += 1
+                slot.bucket.pause(min(MAX_BACKOFF_S, 2 ** attempt + random.uniform(0, 1)))
                 continue
-            
+
             # Other errors - return error result
             return {
-                "error": error_str,
+                "error": str(e),
                 "_source_file": image_path.name,
                 "_extracted_at": datetime.now().isoformat()
             }
-    
+        finally:
+            await slot.limit.release(generation, throttled)
+
     # All retries exhausted
     return {
         "error": f"Max retries ({max_retries}) exhausted due to rate limiting",
@@ -197,30 +309,156 @@ def get_all_images() -> list[Path]:
     
     return sorted(images)
 
-def load_checkpoint() -> set:
-    """Load set of already processed files."""
-    if CHECKPOINT_FILE.exists():
-        with open(CHECKPOINT_FILE, "r") as f:
-            data = json.load(f)
-            return set(data.get("processed", []))
-    return set()
+class LabelJournal:
+    """
+    Append-only JSONL journal of labeling results (DATASET_FILE).
+
+    Each result is appended as soon as it arrives, tagged with the sha256 of
+    the source image, and fsync'd in batches. Resume state is rebuilt from the
+    journal when it is opened, so recording a result costs the same at row 10
+    and at row 500k. Error and dry-run rows are kept but don't count as done,
+    so a resumed run retries them.
+    """
+
+    def __init__(self, path: Path, sync_every: int = JOURNAL_SYNC_EVERY, sync_interval: float = JOURNAL_SYNC_INTERVAL_S):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.done_hashes = {}  # sha256 -> source file name
+        self.done_names = set()
+        self.in_flight = set()
+        self.rows = 0
+        self._load()
+        self.file = open(path, "a", encoding="utf-8")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn last row from a crash mid-write
+                valid_size += len(line)
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                self.rows += 1
+                if "error" in row or row.get("_dry_run"):
+                    continue
+                self.done_names.add(row.get("_source_file"))
+                if row.get("_sha256"):
+                    self.done_hashes[row["_sha256"]] = row.get("_source_file")
+        if valid_size < self.path.stat().st_size:
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+
+    def import_legacy_checkpoint(self, checkpoint_file: Path) -> int:
+        """Names processed by the v1 labeler (no hashes: skipped by name only)."""
+        if not checkpoint_file.exists():
+            return 0
+        with open(checkpoint_file, "r") as f:
+            names = set(json.load(f).get("processed", []))
+        self.done_names |= names
+        return len(names)
+
+    def claim(self, sha256: str) -> str | None:
+        """
+        Reserve an image for labeling by content hash. Returns None if it's
+        claimed, else the name of the file already labeled (or in flight)
+        with identical content.
+        """
+        if sha256 in self.done_hashes:
+            return self.done_hashes[sha256]
+        if sha256 in self.in_flight:
+            return "(in flight)"
+        self.in_flight.add(sha256)
+        return None
+
+    def append(self, result: dict):
+        sha256 = result.get("_sha256")
+        self.in_flight.discard(sha256)
+        if sha256 and "error" not in result and not result.get("_dry_run"):
+            self.done_hashes[sha256] = result.get("_source_file")
+            self.done_names.add(result.get("_source_file"))
+
+        self.file.write(json.dumps(result) + "\n")
+        self.rows += 1
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+async def label_images(images: list[Path], slots: list[KeySlot], journal: LabelJournal, on_result, on_duplicate,
+                       dry_run: bool = False, max_side: int = MAX_IMAGE_SIDE):
+    """
+    Label `images` with up to max_in_flight workers per key. Workers pull paths
+    from one bounded queue, so a fast key takes more of the batch than a
+    throttled one and only a few images are in memory at a time. An image whose
+    content hash is already in the journal (or in flight) is never sent.
+    """
+    queue = asyncio.Queue(maxsize=2 * sum(slot.limit.maximum for slot in slots))
+
+    async def worker(slot):
+        while True:
+            img_path = await queue.get()
+            if img_path is None:
+                return
+            try:
+                # Hash + shrink + encode once, off the event loop
+                sha256, image_data, mime_type = await asyncio.to_thread(prepare_image, img_path, max_side)
+            except Exception as e:
+                on_result(img_path, {"error": f"Unreadable image: {e}", "_source_file": img_path.name,
+                                     "_extracted_at": datetime.now().isoformat()})
+                continue
+
+            duplicate_of = journal.claim(sha256)
+            if duplicate_of is not None:
+                on_duplicate(img_path, duplicate_of)
+                continue
 
-def save_checkpoint(processed: set):
-    """Save checkpoint of processed files."""
-    with open(CHECKPOINT_FILE, "w") as f:
-        json.dump({"processed": list(processed), "updated": datetime.now().isoformat()}, f)
+            try:
+                result = await extract_invoice_data(slot, img_path, image_data, mime_type, dry_run=dry_run)
+            except Exception as e:
+                result = {"error": str(e), "_source_file": img_path.name, "_extracted_at": datetime.now().isoformat()}
+            result["_sha256"] = sha256
+            on_result(img_path, result)
 
-def run_labeler(limit: int = None, dry_run: bool = False, resume: bool = True):
+    workers = [asyncio.create_task(worker(slot)) for slot in slots for _ in range(slot.limit.maximum)]
+    for img_path in images:
+        await queue.put(img_path)
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+
+def run_labeler(limit: int = None, dry_run: bool = False, resume: bool = True,
+                rpm: float = REQUESTS_PER_MINUTE, max_in_flight: int = MAX_IN_FLIGHT, max_side: int = MAX_IMAGE_SIDE):
     """Main labeling loop."""
     print("=" * 60)
-    print("ORC Auto-Labeler v1.0")
+    print("ORC Auto-Labeler v2.0")
     print("=" * 60)
     print(f"API Keys loaded: {len(API_KEYS)}")
+    print(f"Rate per key: {rpm:g} RPM, up to {max_in_flight} in flight")
     print(f"Output directory: {OUTPUT_DIR}")
     print(f"Dry run: {dry_run}")
     print(f"Limit: {limit or 'None'}")
     print()
     
+    if not dry_run and not API_KEYS:
+        raise ValueError("No API keys found! Check .env file.")
+
     # Ensure output directory exists
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     
@@ -228,13 +466,23 @@ def run_labeler(limit: int = None, dry_run: bool = False, resume: bool = True):
     all_images = get_all_images()
     print(f"Found {len(all_images)} invoice images")
     
-    # Load checkpoint if resuming
-    processed = load_checkpoint() if resume else set()
-    if processed:
-        print(f"Resuming: {len(processed)} already processed")
+    # Starting fresh keeps the old journal as a backup instead of appending to it
+    if not resume and DATASET_FILE.exists():
+        backup = DATASET_FILE.with_name(f"{DATASET_FILE.name}.{datetime.now():%Y%m%d-%H%M%S}.bak")
+        DATASET_FILE.rename(backup)
+        print(f"Previous journal moved to {backup.name}")
+
+    # Resume state comes from the journal itself
+    journal = LabelJournal(DATASET_FILE)
+    if resume:
+        legacy = journal.import_legacy_checkpoint(LEGACY_CHECKPOINT_FILE)
+        if legacy:
+            print(f"Imported {legacy} names from {LEGACY_CHECKPOINT_FILE.name}")
+    if journal.done_names:
+        print(f"Resuming: {len(journal.done_names)} already labeled ({journal.rows} journal rows)")
     
-    # Filter out already processed
-    images_to_process = [img for img in all_images if img.name not in processed]
+    # Filter out already labeled (by name here; by content hash in the workers)
+    images_to_process = [img for img in all_images if img.name not in journal.done_names]
     
     # Apply limit
     if limit:
@@ -243,66 +491,78 @@ def run_labeler(limit: int = None, dry_run: bool = False, resume: bool = True):
     print(f"Processing: {len(images_to_process)} images")
     print("-" * 60)
     
-    results = []
+    labeled = 0
     errors = 0
-    
-    for img_path in tqdm(images_to_process, desc="Labeling"):
-        try:
-            # Extract data
-            result = extract_invoice_data(img_path, dry_run=dry_run)
-            
-            # Save individual JSON
-            output_file = OUTPUT_DIR / f"{img_path.stem}.json"
-            with open(output_file, "w") as f:
-                json.dump(result, f, indent=2)
-            
-            # Track for JSONL
-            results.append(result)
-            
-            # Update checkpoint
-            processed.add(img_path.name)
-            
-            # Rate limiting (be nice to API)
-            if not dry_run:
-                time.sleep(0.5)  # 500ms between calls
-                
-        except Exception as e:
-            print(f"\nError processing {img_path.name}: {e}")
+    duplicates = 0
+    progress = tqdm(total=len(images_to_process), desc="Labeling")
+
+    def on_result(img_path, result):
+        nonlocal labeled, errors
+        # Save individual JSON
+        output_file = OUTPUT_DIR / f"{img_path.stem}.json"
+        with open(output_file, "w") as f:
+            json.dump(result, f, indent=2)
+
+        # Journal last: once a row is in, the image counts as done
+        journal.append(result)
+        labeled += 1
+        if "error" in result:
             errors += 1
-            
-        # Periodic checkpoint save
-        if len(results) % 10 == 0:
-            save_checkpoint(processed)
-    
-    # Final checkpoint save
-    save_checkpoint(processed)
-    
-    # Generate JSONL dataset
-    with open(DATASET_FILE, "w") as f:
-        for result in results:
-            f.write(json.dumps(result) + "\n")
+        progress.update(1)
+
+    def on_duplicate(img_path, duplicate_of):
+        nonlocal duplicates
+        duplicates += 1
+        progress.update(1)
+
+    async def run():
+        # Models are built inside the loop: their async clients bind to it
+        if dry_run:
+            slots = [KeySlot(0, None, float("inf"), max_in_flight, max_in_flight)]
+        else:
+            slots = [KeySlot(i, build_model(key), rpm, BURST, max_in_flight) for i, key in enumerate(API_KEYS)]
+        await label_images(images_to_process, slots, journal, on_result, on_duplicate, dry_run=dry_run, max_side=max_side)
+        return slots
+
+    start = time.perf_counter()
+    try:
+        slots = asyncio.run(run())
+    finally:
+        journal.close()
+        progress.close()
+    elapsed = time.perf_counter() - start
     
     print()
     print("=" * 60)
     print("COMPLETE")
-    print(f"Processed: {len(results)} images")
-    print(f"Errors: {errors}")
+    print(f"Processed: {labeled} images in {elapsed:.1f}s ({labeled / max(elapsed, 1e-9):.2f} images/s)")
+    print(f"Errors: {errors} (retried on the next run)")
+    print(f"Duplicates skipped: {duplicates}")
+    if not dry_run:
+        for slot in slots:
+            print(f"Key {slot.index + 1}: {slot.requests} requests, {slot.throttled} rate limited, final limit {slot.limit.limit:.1f}")
     print(f"Output: {OUTPUT_DIR}")
-    print(f"Dataset: {DATASET_FILE}")
+    print(f"Dataset: {DATASET_FILE} ({journal.rows} rows)")
     print("=" * 60)
 
 def main():
     parser = argparse.ArgumentParser(description="ORC Auto-Labeler")
     parser.add_argument("--limit", type=int, help="Max images to process")
     parser.add_argument("--dry-run", action="store_true", help="Test without API calls")
-    parser.add_argument("--no-resume", action="store_true", help="Start fresh, ignore checkpoint")
+    parser.add_argument("--no-resume", action="store_true", help="Start fresh (previous journal is kept as a .bak)")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Requests per minute per API key")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT, help="Concurrent requests per API key (AIMD ceiling)")
+    parser.add_argument("--max-side", type=int, default=MAX_IMAGE_SIDE, help="Downscale images to this longest side before upload")
     
     args = parser.parse_args()
     
     run_labeler(
         limit=args.limit,
         dry_run=args.dry_run,
-        resume=not args.no_resume
+        resume=not args.no_resume,
+        rpm=args.rpm,
+        max_in_flight=args.max_in_flight,
+        max_side=args.max_side
     )
 
 if __name__ == "__main__":
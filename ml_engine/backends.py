@@ -0,0 +1,180 @@
+import os
+import json
+import platform
+import importlib.util
+import numpy as np
+
+# Inference backends for serve.py / benchmark.py.
+# All backends take a batch of numpy arrays (as produced by the processor with
+# return_tensors="np") and return numpy logits [batch, seq_len, num_labels],
+# so the decoding in serve.py is identical whichever one is active.
+
+BACKENDS = ["torch", "onnx", "onnx-opt", "onnx-int8", "onnx-int8-static"]
+
+# Fallback order when an artifact is missing (fastest -> always available)
+FALLBACK_ORDER = ["onnx-int8-static", "onnx-int8", "onnx-opt", "onnx", "torch"]
+
+# Written by quantize.py (see its manifest.json for what was actually built)
+ONNX_FILES = {
+    "onnx": "model.onnx",
+    "onnx-opt": "model_optimized.onnx",  # Graph fusions
+    "onnx-int8": "model_quantized.onnx",  # Dynamic int8
+    "onnx-int8-static": "model_static_quantized.onnx",  # Calibrated static int8
+}
+MANIFEST_FILE = "manifest.json"
+
+# ONNX Runtime threading: one op at a time, all cores inside each op.
+# (Transformer graphs are a chain of big matmuls; inter-op parallelism only adds contention.)
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", str(os.cpu_count() or 1)))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model_path):
+        import torch
+        from transformers import LayoutLMv3ForTokenClassification
+
+        self.torch = torch
+        self.model_path = model_path
+        self.model = LayoutLMv3ForTokenClassification.from_pretrained(model_path, **fast_load_kwargs(model_path))
+        self.model.eval()
+        self.id2label = self.model.config.id2label
+
+    def run(self, batch):
+        inputs = {key: self.torch.from_numpy(value) for key, value in batch.items()}
+        with self.torch.inference_mode():
+            return self.model(**inputs).logits.numpy()
+
+
+class OnnxBackend:
+    def __init__(self, onnx_dir, name="onnx", threads=None):
+        import onnxruntime as ort
+
+        model_file = os.path.join(onnx_dir, ONNX_FILES[name])
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(f"{model_file} not found (run quantize.py)")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or ORT_INTRA_OP_THREADS
+        options.inter_op_num_threads = ORT_INTER_OP_THREADS
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.name = name
+        self.model_path = onnx_dir
+        self.session = ort.InferenceSession(model_file, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_types = {i.name: _NUMPY_TYPES.get(i.type, np.int64) for i in self.session.get_inputs()}
+        self.output_name = self.session.get_outputs()[0].name
+
+        # quantize.py saves config.json next to the ONNX graph
+        with open(os.path.join(onnx_dir, "config.json")) as f:
+            config = json.load(f)
+        self.id2label = {int(k): v for k, v in config.get("id2label", {}).items()}
+
+    def run(self, batch):
+        # IO binding: ORT reads the numpy buffers in place and allocates the
+        # output once, instead of copying through run()'s feed dict.
+        binding = self.session.io_binding()
+        for key, dtype in self.input_types.items():
+            binding.bind_cpu_input(key, np.ascontiguousarray(batch[key], dtype=dtype))
+        binding.bind_output(self.output_name)
+        self.session.run_with_iobinding(binding)
+        return binding.copy_outputs_to_cpu()[0]
+
+
+_NUMPY_TYPES = {
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+    "tensor(float)": np.float32,
+}
+
+
+def fast_load_kwargs(model_path):
+    """
+    from_pretrained() options for a fast cold start: read weights from the
+    memory-mapped safetensors file and, with accelerate installed, skip the
+    random initialization that the checkpoint overwrites anyway.
+    """
+    kwargs = {}
+    if os.path.isfile(os.path.join(model_path, "model.safetensors")):
+        kwargs["use_safetensors"] = True
+    if importlib.util.find_spec("accelerate") is not None:
+        kwargs["low_cpu_mem_usage"] = True
+    return kwargs
+
+
+def detect_isa():
+    """
+    The int8 kernel family this CPU runs best: "avx512_vnni", "avx512",
+    "avx2" (x86) or "arm64". Matches optimum's AutoQuantizationConfig names.
+    """
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    flags = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags.update(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass  # Not Linux: assume the AVX2 baseline
+    if "avx512_vnni" in flags or "avx512vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def resolve_backend(name, onnx_dir):
+    """
+    Resolve "auto" to a concrete backend from quantize.py's manifest: its
+    recommended variant, unless that is int8 built for another CPU ISA
+    (int8 kernels are ISA-specific), in which case the best fp32 variant built.
+    Without a manifest, "auto" means torch. Other names pass through.
+    """
+    if name != "auto":
+        return name
+
+    try:
+        with open(os.path.join(onnx_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return "torch"
+
+    isa = detect_isa()
+    usable = [
+        variant for variant in FALLBACK_ORDER
+        if variant in manifest.get("variants", {}) and manifest["variants"][variant].get("isa") in (None, isa)
+    ]
+    recommended = manifest.get("recommended")
+    if recommended in usable:
+        return recommended
+    if recommended:
+        print(f"⚠️ Manifest recommends '{recommended}' (built for {manifest['variants'].get(recommended, {}).get('isa')}), host is {isa}.")
+    return usable[0] if usable else "torch"
+
+
+def load_backend(name, model_path, onnx_dir, threads=None):
+    """
+    Load the requested backend ("auto" picks from quantize.py's manifest),
+    falling back to the next one in FALLBACK_ORDER if its artifact (or
+    onnxruntime) is missing.
+    `threads` caps ONNX Runtime's intra-op pool (torch threads are process-wide
+    and set by the caller).
+    """
+    name = resolve_backend(name, onnx_dir)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Choose from {BACKENDS + ['auto']}")
+
+    for candidate in FALLBACK_ORDER[FALLBACK_ORDER.index(name):]:
+        try:
+            if candidate == "torch":
+                return TorchBackend(model_path)
+            return OnnxBackend(onnx_dir, candidate, threads=threads)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"⚠️ Backend '{candidate}' unavailable ({e}). Falling back...")
+
+    raise RuntimeError("No inference backend could be loaded")
@@ -0,0 +1,121 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+
+# Dynamic micro-batching for the inference API.
+# Concurrent /predict requests are queued from the event loop; a dedicated
+# worker thread collects up to `max_batch_size` of them (or whatever arrived
+# within `max_wait_ms` of the first), runs ONE batched forward pass and
+# resolves each caller's future. The event loop never blocks on the model.
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=10.0, name="inference-batcher"):
+        """
+        Args:
+            run_batch (callable): list of items -> list of results (same order)
+            max_batch_size (int): Max requests per forward pass
+            max_wait_ms (float): Max time to wait for a batch to fill after its first request
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+
+        # Metrics
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._queue_wait_s = 0.0
+        self._compute_s = 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    async def submit(self, item):
+        """Queue one item and wait for its result without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((item, future, loop, time.perf_counter()))
+        return await future
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)  # Finish this batch, stop on the next loop
+                break
+            batch.append(entry)
+        return batch
+
+    def _worker(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            batch = self._collect(first)
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([entry[0] for entry in batch])
+                error = None
+            except Exception as e:
+                results, error = [None] * len(batch), e
+            finished = time.perf_counter()
+
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._compute_s += finished - started
+                self._queue_wait_s += sum(started - entry[3] for entry in batch)
+                if error is not None:
+                    self._errors += 1
+
+            for (_, future, loop, _), result in zip(batch, results):
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def metrics(self):
+        with self._lock:
+            batches = self._batches or 1
+            requests = self._requests or 1
+            return {
+                "queue_depth": self._queue.qsize(),
+                "requests_total": self._requests,
+                "batches_total": self._batches,
+                "batch_errors_total": self._errors,
+                "avg_batch_size": round(self._requests / batches, 2),
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": round(1000 * self._queue_wait_s / requests, 2),
+                "avg_batch_compute_ms": round(1000 * self._compute_s / batches, 2),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_s * 1000,
+            }
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return  # Client went away
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
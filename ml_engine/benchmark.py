@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import numpy as np
+from PIL import Image
+
+# Model variant benchmark: fp32 torch vs ONNX vs int8 ONNX.
+# Every (variant, thread count) runs in its own subprocess so memory numbers
+# don't bleed into each other and thread pools are set from a clean start.
+# Inputs are real documents from the OCR feature store (see preprocess.py),
+# prepared once before timing; without one, a synthetic page is used and
+# accuracy is skipped. Per variant it reports:
+#   - p50/p95/p99 batch latency and docs/s at each batch size and thread count
+#   - peak RSS and model file size
+#   - per-entity F1 on the documents, and its delta against the first variant (fp32)
+# and writes everything to a JSON report; --strict turns the promotion gate
+# (F1 drop <= --max-f1-drop) into the exit code. A variant that crashes fails
+# the gate; if the reference itself fails there is nothing to gate against and
+# the run aborts. --synthetic has no accuracy, so --strict never passes with it.
+# Run with: python ml_engine/benchmark.py [--backends torch,onnx,onnx-int8] [--batch-sizes 1,8] [--threads 1,4]
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import BACKENDS, ONNX_FILES, load_backend
+
+# Configuration
+MODEL_DIR = "./ml_engine/models/layoutlmv3-finetuned"
+ONNX_DIR = "./ml_engine/models/onnx"
+GROUND_TRUTH_DIR = "./ml_engine/ground_truth"
+REPORT_PATH = "./ml_engine/models/benchmark_report.json"
+MODEL_INPUTS = ("input_ids", "attention_mask", "bbox", "pixel_values")
+
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1e6
+    except ImportError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3  # Linux: KB
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3  # Linux: KB
+
+
+def model_size_mb(backend):
+    if backend.name in ONNX_FILES:
+        files = [os.path.join(backend.model_path, ONNX_FILES[backend.name])]
+    else:
+        files = [
+            os.path.join(backend.model_path, f) for f in os.listdir(backend.model_path)
+            if f.endswith((".safetensors", ".bin"))
+        ]
+    return sum(os.path.getsize(f) for f in files if os.path.exists(f)) / 1e6
+
+
+def synthetic_batch(processor, batch_size, num_words):
+    """A full page of fake OCR words so the sequence is realistically long."""
+    image = Image.new("RGB", (1000, 1400), "white")
+    words = [f"item{i} ${i * 3.5:.2f}" for i in range(num_words)]
+    boxes = [[(i % 4) * 250, (i // 4) * 10 % 1000, (i % 4) * 250 + 200, (i // 4) * 10 % 1000 + 8] for i in range(num_words)]
+    encoding = processor(
+        [image] * batch_size,
+        [words] * batch_size,
+        boxes=[boxes] * batch_size,
+        return_tensors="np",
+        truncation=True,
+        padding="max_length"
+    )
+    return {key: encoding[key] for key in MODEL_INPUTS}
+
+
+def document_batches(dataset, window_indices, batch_size):
+    """Length-sorted batches over the given windows: [(window indices, numpy inputs)]."""
+    from dataset import PaddingCollator
+
+    collator = PaddingCollator(dataset.processor.tokenizer.pad_token_id)
+    items = {i: dataset[i] for i in window_indices}  # Image processing happens here, not in the timed loop
+    order = sorted(window_indices, key=lambda i: len(items[i]["input_ids"]))
+    batches = []
+    for start in range(0, len(order), batch_size):
+        indices = order[start:start + batch_size]
+        batch = collator([items[i] for i in indices])
+        batches.append((indices, {key: batch[key].numpy() for key in MODEL_INPUTS}))
+    return batches
+
+
+def time_batches(backend, batches, iterations, warmup):
+    """Run the batch list until at least `iterations` batches are timed. Returns (latencies ms, seconds per pass)."""
+    for _, inputs in batches[:warmup]:
+        backend.run(inputs)
+
+    latencies = []
+    passes = []
+    while len(latencies) < iterations:
+        pass_start = time.perf_counter()
+        for _, inputs in batches:
+            start = time.perf_counter()
+            backend.run(inputs)
+            latencies.append((time.perf_counter() - start) * 1000)
+        passes.append(time.perf_counter() - pass_start)
+    return latencies, float(np.mean(passes))
+
+
+def run_single(args):
+    """Benchmark one variant at one thread count in this process and print a JSON result line."""
+    from transformers import LayoutLMv3Processor
+
+    rss_before = rss_mb()
+    load_start = time.perf_counter()
+    backend = load_backend(args.single, args.model_dir, args.onnx_dir, threads=args.single_threads)
+    if backend.name == "torch":
+        backend.torch.set_num_threads(args.single_threads)
+    load_s = time.perf_counter() - load_start
+    rss_loaded = rss_mb()
+
+    processor = LayoutLMv3Processor.from_pretrained(backend.model_path, apply_ocr=False)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    dataset = None
+    if not args.synthetic:
+        from dataset import InvoiceDataset
+        dataset = InvoiceDataset(args.data_dir, processor)
+        docs = range(min(args.limit, len(dataset.files)) if args.limit else len(dataset.files))
+        windows = dataset.window_indices(docs)
+        num_docs = len(docs)
+
+    result = {
+        "requested": args.single,
+        "backend": backend.name,
+        "threads": args.single_threads,
+        "load_s": round(load_s, 2),
+        "model_size_mb": round(model_size_mb(backend), 1),
+        "model_rss_mb": round(rss_loaded - rss_before, 1),
+        "latency": {}
+    }
+
+    for batch_size in batch_sizes:
+        if dataset is not None:
+            batches = document_batches(dataset, windows, batch_size)
+        else:
+            batches = [(None, synthetic_batch(processor, batch_size, args.words))]
+            num_docs = batch_size
+        latencies, pass_s = time_batches(backend, batches, args.iterations, args.warmup)
+        result["latency"][str(batch_size)] = {
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+            "docs_per_s": round(num_docs / pass_s, 2)
+        }
+
+    # Accuracy doesn't depend on threads or batch size: score once per variant
+    if dataset is not None and args.accuracy:
+        from metrics import entity_metrics
+
+        window_logits = {}
+        for indices, inputs in document_batches(dataset, windows, max(batch_sizes)):
+            for i, row in zip(indices, backend.run(inputs)):
+                window_logits[i] = row
+        stitched = dataset.stitch_predictions(list(window_logits), list(window_logits.values()))
+        metrics = entity_metrics(
+            [predicted for predicted, _ in stitched.values()],
+            [gold for _, gold in stitched.values()],
+            dataset.id2label
+        )
+        result["f1"] = {"overall": round(metrics["overall_f1"], 4)}
+        result["f1"].update({k: round(v["f1"], 4) for k, v in metrics.items() if isinstance(v, dict)})
+        result["predictions"] = [predicted for predicted, _ in stitched.values()]
+
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    print("RESULT " + json.dumps(result))
+
+
+def run_all(args):
+    results = []
+    crashed = []
+    names = args.backends.split(",")
+    thread_counts = [int(t) for t in args.threads.split(",")]
+    for name in names:
+        for i, threads in enumerate(thread_counts):
+            print(f"⏱️  Benchmarking {name} ({threads} threads)...")
+            cmd = [
+                sys.executable, os.path.abspath(__file__), "--single", name, "--single-threads", str(threads),
+                "--model-dir", args.model_dir, "--onnx-dir", args.onnx_dir, "--data-dir", args.data_dir,
+                "--limit", str(args.limit), "--batch-sizes", args.batch_sizes, "--iterations", str(args.iterations),
+                "--warmup", str(args.warmup), "--words", str(args.words)
+            ]
+            if args.synthetic:
+                cmd.append("--synthetic")
+            if i == 0:
+                cmd.append("--accuracy")
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            lines = [l for l in proc.stdout.splitlines() if l.startswith("RESULT ")]
+            if not lines:
+                print(f"❌ {name} failed:\n{proc.stderr[-2000:]}")
+                if name == names[0] and i == 0:
+                    print(f"❌ Reference variant {name} failed; nothing to compare against")
+                    return 1
+                if name not in crashed:
+                    crashed.append(name)
+                continue
+            results.append(json.loads(lines[-1][len("RESULT "):]))
+
+    # Reference = first variant (fp32 torch by default), at its first thread count
+    reference = results[0]
+    if not args.synthetic and "f1" not in reference:
+        print(f"❌ Reference variant {reference['requested']} produced no F1; nothing to compare against")
+        return 1
+    ref_p50 = {b: l["p50_ms"] for b, l in reference["latency"].items()}
+
+    print(f"\n=== MODEL BENCHMARK ({len(results)} runs, batch sizes {args.batch_sizes}) ===")
+    print(f"{'variant':<18} {'thr':>4} {'batch':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'docs/s':>8} {'size MB':>8} {'peak MB':>8}")
+    for r in results:
+        label = r["backend"] if r["backend"] == r["requested"] else f"{r['requested']}->{r['backend']}"
+        for batch_size, l in r["latency"].items():
+            print(f"{label:<18} {r['threads']:>4} {batch_size:>6} {l['p50_ms']:>9} {l['p95_ms']:>9} {l['p99_ms']:>9} "
+                  f"{l['docs_per_s']:>8} {r['model_size_mb']:>8} {r['peak_rss_mb']:>8}")
+
+    # Accuracy vs the reference + promotion gate
+    promotion = {}
+    if "f1" in reference:
+        print(f"\n{'variant':<18} " + " ".join(f"{k:>10}" for k in reference["f1"]) + f" {'agree':>7} {'gate':>6}")
+        for r in results:
+            if "f1" not in r:
+                continue
+            delta = {k: round(r["f1"].get(k, 0.0) - v, 4) for k, v in reference["f1"].items()}
+            agree = np.mean([
+                np.mean(np.array(a) == np.array(b)) if len(a) else 1.0
+                for a, b in zip(r["predictions"], reference["predictions"])
+            ]) * 100
+            fallback = r["backend"] != r["requested"]
+            speedup = {
+                b: round(ref_p50[b] / l["p50_ms"], 2)
+                for b, l in r["latency"].items() if b in ref_p50 and l["p50_ms"]
+            }
+            passed = not fallback and -delta["overall"] <= args.max_f1_drop
+            r["f1_delta"] = delta
+            r["agreement_pct"] = round(float(agree), 2)
+            promotion[r["requested"]] = {
+                "backend": r["backend"],
+                "f1_drop": round(-delta["overall"], 4) or 0.0,  # No "-0.0" in the report
+                "speedup_p50": speedup,
+                "passed": passed
+            }
+            print(f"{r['requested']:<18} " + " ".join(f"{d:>+10.4f}" for d in delta.values()) +
+                  f" {agree:>6.1f}% {'PASS' if passed else 'FAIL':>6}")
+
+    # A variant with a crashed run can't be promoted
+    for name in names:
+        if name in crashed:
+            promotion[name] = {"backend": None, "f1_drop": None, "speedup_p50": {}, "passed": False, "crashed": True}
+            print(f"{name:<18} crashed, FAIL")
+
+    for r in results:
+        r.pop("predictions", None)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "backends": args.backends, "threads": args.threads, "batch_sizes": args.batch_sizes,
+            "iterations": args.iterations, "data_dir": None if args.synthetic else args.data_dir,
+            "limit": args.limit, "max_f1_drop": args.max_f1_drop
+        },
+        "reference": reference["requested"],
+        "results": results,
+        "promotion": promotion
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Report written to {args.report}")
+
+    if args.strict and not promotion:
+        print("❌ Promotion gate failed: no accuracy to gate on (--synthetic)")
+        return 1
+    if args.strict and not all(p["passed"] for p in promotion.values()):
+        print("❌ Promotion gate failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Model Variant Benchmark")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated variants; the first is the reference")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--onnx-dir", default=ONNX_DIR)
+    parser.add_argument("--data-dir", default=GROUND_TRUTH_DIR)
+    parser.add_argument("--limit", type=int, default=50, help="Documents to run (0 = all)")
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--threads", default=",".join(sorted({"1", str(os.cpu_count() or 1)}, key=int)))
+    parser.add_argument("--iterations", type=int, default=50, help="Minimum timed batches per batch size")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--synthetic", action="store_true", help="Synthetic page instead of the feature store (no accuracy)")
+    parser.add_argument("--words", type=int, default=300, help="Synthetic OCR words per page")
+    parser.add_argument("--report", default=REPORT_PATH)
+    parser.add_argument("--max-f1-drop", type=float, default=0.01, help="Allowed overall F1 drop vs the reference")
+    parser.add_argument("--strict", action="store_true", help="Exit non-zero if any variant fails the gate")
+    parser.add_argument("--single", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--single-threads", type=int, default=os.cpu_count() or 1, help=argparse.SUPPRESS)
+    parser.add_argument("--accuracy", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(args)
+    else:
+        sys.exit(run_all(args))
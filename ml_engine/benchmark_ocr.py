@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+# OCR preprocessing benchmark on the ground-truth set.
+# Compares plain full-resolution reader.readtext() with ocr.read_page()
+# (DPI/long-edge downscale, optional deskew, ROI recognition) on:
+#   - OCR latency per page
+#   - entity match rate: how often each labeled field is found as an OCR word,
+#     using the same exact-match rule dataset.py uses to create training tags
+# Run with: python ml_engine/benchmark_ocr.py [--limit 25] [--deskew]
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import ocr
+
+# Configuration
+GROUND_TRUTH_DIR = "./ml_engine/ground_truth"
+FIELDS = ["total_amount", "invoice_number", "invoice_date", "vendor_name"]
+
+
+def normalize(s):
+    return str(s).lower().replace("$", "").replace(",", "").strip()
+
+
+def load_pages(data_dir, limit):
+    pages = []
+    for f in sorted(os.listdir(data_dir)):
+        if f.endswith(".json") and not f.startswith("_"):
+            base_name = os.path.splitext(f)[0]
+            for ext in (".jpg", ".png"):
+                if os.path.exists(os.path.join(data_dir, base_name + ext)):
+                    with open(os.path.join(data_dir, f)) as fh:
+                        pages.append((os.path.join(data_dir, base_name + ext), json.load(fh)))
+                    break
+        if limit and len(pages) >= limit:
+            break
+    return pages
+
+
+def field_hits(words, labels):
+    found = {normalize(w) for w in words}
+    return {
+        field: normalize(labels[field]) in found
+        for field in FIELDS
+        if labels.get(field) not in (None, "")
+    }
+
+
+def run_benchmark(args):
+    import easyocr
+
+    reader = easyocr.Reader(["en"], verbose=False)
+    pages = load_pages(args.data_dir, args.limit)
+    print(f"📂 {len(pages)} pages from {args.data_dir}")
+
+    stats = {"baseline": {"ms": [], "hits": [], "words": 0}, "preprocessed": {"ms": [], "hits": [], "words": 0}}
+
+    for path, labels in pages:
+        image = Image.open(path).convert("RGB")
+
+        start = time.perf_counter()
+        baseline = [text for (_, text, _) in reader.readtext(np.array(image))]
+        stats["baseline"]["ms"].append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        preprocessed = [text for (text, _, _) in ocr.read_page(reader, image)]
+        stats["preprocessed"]["ms"].append((time.perf_counter() - start) * 1000)
+
+        for name, words in (("baseline", baseline), ("preprocessed", preprocessed)):
+            stats[name]["hits"].append(field_hits(words, labels))
+            stats[name]["words"] += len(words)
+
+        print(f"  {os.path.basename(path)} {image.size}: {stats['baseline']['ms'][-1]:.0f}ms -> {stats['preprocessed']['ms'][-1]:.0f}ms")
+
+    print(f"\n=== OCR BENCHMARK ({len(pages)} pages, max_side={ocr.OCR_MAX_SIDE}, detect={ocr.OCR_DETECT_MAX_SIDE}, deskew={ocr.OCR_DESKEW}, roi={ocr.OCR_ROI}) ===")
+    print(f"{'':<14} {'p50 ms':>8} {'mean ms':>8} {'words':>7}  " + " ".join(f"{f:>15}" for f in FIELDS) + f" {'all':>7}")
+    for name, s in stats.items():
+        rates = []
+        for field in FIELDS:
+            values = [h[field] for h in s["hits"] if field in h]
+            rates.append(100 * sum(values) / len(values) if values else 0.0)
+        total = [v for h in s["hits"] for v in h.values()]
+        overall = 100 * sum(total) / len(total) if total else 0.0
+        print(f"{name:<14} {np.percentile(s['ms'], 50):>8.0f} {np.mean(s['ms']):>8.0f} {s['words']:>7}  "
+              + " ".join(f"{r:>14.1f}%" for r in rates) + f" {overall:>6.1f}%")
+
+    speedup = np.mean(stats["baseline"]["ms"]) / np.mean(stats["preprocessed"]["ms"])
+    print(f"\n📈 OCR speedup: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC OCR Preprocessing Benchmark")
+    parser.add_argument("--data-dir", default=GROUND_TRUTH_DIR)
+    parser.add_argument("--limit", type=int, default=25, help="Pages to evaluate (0 = all)")
+    parser.add_argument("--max-side", type=int, help="Override OCR_MAX_SIDE")
+    parser.add_argument("--detect-max-side", type=int, help="Override OCR_DETECT_MAX_SIDE")
+    parser.add_argument("--deskew", action="store_true", help="Enable deskew")
+    parser.add_argument("--no-roi", action="store_true", help="Preprocess only; plain readtext on the downscaled page")
+    args = parser.parse_args()
+
+    # ocr.py reads its settings at import time; overrides must patch the module
+    if args.max_side:
+        ocr.OCR_MAX_SIDE = args.max_side
+    if args.detect_max_side:
+        ocr.OCR_DETECT_MAX_SIDE = args.detect_max_side
+    ocr.OCR_DESKEW = ocr.OCR_DESKEW or args.deskew
+    ocr.OCR_ROI = ocr.OCR_ROI and not args.no_roi
+
+    run_benchmark(args)
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import statistics
+import requests
+
+# Cold-start benchmark for serve.py.
+# Starts `uvicorn serve:app` fresh N times and measures:
+#   - import: time to `import serve` alone (lazy imports keep this small)
+#   - live:   first 200 from /health (process can accept traffic)
+#   - ready:  first 200 from /ready (OCR + model loaded, warm-up done)
+# plus the per-phase timings the server reports on /ready.
+# Run with: python ml_engine/benchmark_startup.py [--runs 3] [--no-warmup]
+
+ML_ENGINE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import(env):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", f"import sys; sys.path.insert(0, {ML_ENGINE_DIR!r}); import serve"],
+        env=env, check=True, capture_output=True
+    )
+    return time.perf_counter() - start
+
+
+def time_startup(env, timeout):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "serve:app", "--app-dir", ML_ENGINE_DIR, "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    live = ready = None
+    timings = {}
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"serve.py exited with code {proc.returncode}")
+            try:
+                if live is None and requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    live = time.perf_counter() - start
+                if live is not None:
+                    response = requests.get(f"{base_url}/ready", timeout=1)
+                    if response.status_code == 200:
+                        ready = time.perf_counter() - start
+                        timings = response.json().get("startup_timings_s", {})
+                        break
+                    if response.json().get("error"):
+                        raise RuntimeError(response.json()["error"])
+            except requests.exceptions.ConnectionError:
+                pass
+            time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+    if ready is None:
+        raise RuntimeError(f"Not ready after {timeout}s")
+    return live, ready, timings
+
+
+def run_benchmark(args):
+    env = dict(os.environ)
+    if args.no_warmup:
+        env["WARMUP"] = "0"
+
+    rows = []
+    for run in range(1, args.runs + 1):
+        import_s = time_import(env)
+        live, ready, timings = time_startup(env, args.timeout)
+        rows.append((import_s, live, ready))
+        phases = " ".join(f"{k}={v}s" for k, v in timings.items())
+        print(f"  run {run}: import {import_s:.2f}s | live {live:.2f}s | ready {ready:.2f}s | {phases}")
+
+    print(f"\n=== STARTUP ({args.runs} runs, median) ===")
+    for i, label in enumerate(["import serve", "live (/health)", "ready (/ready)"]):
+        print(f"  {label:<16} {statistics.median(r[i] for r in rows):6.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Inference Server Startup Benchmark")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--no-warmup", action="store_true", help="Start with WARMUP=0")
+    args = parser.parse_args()
+
+    run_benchmark(args)
@@ -0,0 +1,126 @@
+import os
+import io
+import sys
+import time
+import socket
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+import requests
+from PIL import Image, ImageDraw
+
+# Memory benchmark for pre-fork serving (serve.py --workers N).
+# Compares N pre-forked workers sharing one copy of the weights against N
+# independent single-process servers (estimated as N x one server's RSS).
+# Reports RSS, USS (private memory) and PSS (shared pages split fairly) per
+# process after a short load so activations are included.
+# Run with: python ml_engine/benchmark_workers.py [--workers 4] [--requests 40]
+
+SERVE_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def sample_image():
+    image = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(40):
+        draw.text((100, 100 + i * 40), f"Item {i}   Qty {i % 7 + 1}   ${i * 12.5:.2f}", fill="black")
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def start_server(workers, timeout):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(
+        [sys.executable, SERVE_PY, "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    # Every worker reports its own readiness; wait until we've seen all of them
+    ready_pids = set()
+    start = time.perf_counter()
+    while len(ready_pids) < workers:
+        if proc.poll() is not None:
+            raise RuntimeError(f"serve.py exited with code {proc.returncode}")
+        if time.perf_counter() - start > timeout:
+            raise RuntimeError(f"Only {len(ready_pids)}/{workers} workers ready after {timeout}s")
+        try:
+            response = requests.get(f"{base_url}/ready", timeout=1)
+            if response.status_code == 200:
+                ready_pids.add(response.json()["pid"])
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.02)
+    return proc, base_url
+
+
+def apply_load(base_url, n_requests, concurrency):
+    payload = sample_image()
+
+    def post(i):
+        # Distinct bytes per request so the OCR cache doesn't short-circuit everything
+        data = payload + i.to_bytes(4, "big")
+        return requests.post(f"{base_url}/predict", files={"file": (f"{i}.png", data, "image/png")}).status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        codes = list(pool.map(post, range(n_requests)))
+    return sum(code == 200 for code in codes)
+
+
+def measure(proc):
+    parent = psutil.Process(proc.pid)
+    rows = []
+    for p in [parent] + parent.children():
+        info = p.memory_full_info()
+        role = "server" if p.pid == proc.pid else "worker"
+        rows.append((role, p.pid, info.rss / 1e6, info.uss / 1e6, getattr(info, "pss", 0) / 1e6))
+    return rows
+
+
+def run_benchmark(args):
+    results = {}
+    for workers in (1, args.workers):
+        print(f"⏱️  Starting serve.py with {workers} worker(s)...")
+        proc, base_url = start_server(workers, args.timeout)
+        try:
+            ok = apply_load(base_url, args.requests, args.concurrency)
+            rows = measure(proc)
+        finally:
+            proc.terminate()
+            proc.wait(30)
+        results[workers] = rows
+
+        print(f"   {ok}/{args.requests} requests OK")
+        print(f"   {'role':<8} {'pid':>8} {'RSS MB':>9} {'USS MB':>9} {'PSS MB':>9}")
+        for role, pid, rss, uss, pss in rows:
+            print(f"   {role:<8} {pid:>8} {rss:>9.1f} {uss:>9.1f} {pss:>9.1f}")
+
+    single_rss = results[1][0][2]
+    prefork_pss = sum(r[4] for r in results[args.workers])
+    workers_rows = [r for r in results[args.workers] if r[0] == "worker"]
+    avg_worker_uss = sum(r[3] for r in workers_rows) / max(1, len(workers_rows))
+
+    print(f"\n=== PRE-FORK MEMORY ({args.workers} workers) ===")
+    print(f"  {args.workers} independent servers (est.):  {single_rss * args.workers:9.1f} MB")
+    print(f"  pre-fork total (PSS):            {prefork_pss:9.1f} MB")
+    print(f"  private memory per worker (USS): {avg_worker_uss:9.1f} MB  ({100 * avg_worker_uss / single_rss:.0f}% of one server's RSS)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC Pre-fork Serving Memory Benchmark")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    run_benchmark(args)
@@ -1,42 +1,130 @@
 import json
 import os
+import numpy as np
 from PIL import Image
 import torch
 from torch.utils.data import Dataset
 from transformers import LayoutLMv3Processor
 
+from ocr import read_page
+from decoding import stitch_windows
+from preprocess import FEATURE_STORE_NAME, open_store, file_hash
+
 # Schema Definition (BIO Scheme)
 LABELS = [
-    "O", 
-    "B-TOTAL", "I-TOTAL", 
-    "B-ID", "I-ID", 
-    "B-DATE", "I-DATE", 
+    "O",
+    "B-TOTAL", "I-TOTAL",
+    "B-ID", "I-ID",
+    "B-DATE", "I-DATE",
     "B-VENDOR", "I-VENDOR"
 ]
 
+# Overlap between consecutive windows of a long document
+WINDOW_STRIDE = 128
+
+# Schema: total_amount, invoice_id, invoice_date, vendor_name
+TARGET_MAP = {
+    "total_amount": "TOTAL",
+    "invoice_id": "ID",
+    "invoice_date": "DATE",
+    "vendor_name": "VENDOR"
+}
+
+
+def find_pairs(data_dir):
+    """Returns [(base_name, image_file)] for every .json label with a matching image."""
+    pairs = []
+    all_files = os.listdir(data_dir)
+    for f in all_files:
+        if f.endswith(".json") and not f.startswith("_"):
+            base_name = os.path.splitext(f)[0]
+            # check for corresponding image (jpg or png)
+            if f"{base_name}.jpg" in all_files:
+                pairs.append((base_name, f"{base_name}.jpg"))
+            elif f"{base_name}.png" in all_files:
+                pairs.append((base_name, f"{base_name}.png"))
+    return pairs
+
+
+def ocr_words(reader, image, base_name=""):
+    """
+    Run OCR on a page image.
+    Returns (words, boxes) with boxes normalized to 0-1000.
+    """
+    try:
+         # Same preprocessing as serving (downscale / ROI OCR, see ocr.py)
+         # Returns [(text, [x1, y1, x2, y2], prob), ...] in original pixels
+         results = read_page(reader, image)
+
+         words = []
+         boxes = []
+         width, height = image.size
+
+         for (text, bbox, prob) in results:
+             x1, y1, x2, y2 = [int(v) for v in bbox]
+
+             # Normalize 0-1000
+             x1 = max(0, min(1000, int((x1 / width) * 1000)))
+             y1 = max(0, min(1000, int((y1 / height) * 1000)))
+             x2 = max(0, min(1000, int((x2 / width) * 1000)))
+             y2 = max(0, min(1000, int((y2 / height) * 1000)))
+
+             words.append(text)
+             boxes.append([x1, y1, x2, y2])
+
+    except Exception as e:
+        print(f"OCR Failed for {base_name}: {e}")
+        words = ["Empty"]
+        boxes = [[0,0,0,0]]
+
+    return words, boxes
+
+
+def align_labels(words, label_data):
+    """
+    Heuristic alignment of the JSON labels to OCR words.
+    We try to find exact string matches in `words`.
+    Returns one BIO tag per word.
+    """
+    ner_tags = ["O"] * len(words)
+
+    # Helper to normalize for matching
+    def normalize(s):
+        return str(s).lower().replace("$", "").replace(",", "").strip()
+
+    for key, tag in TARGET_MAP.items():
+        if key in label_data:
+            target_val = normalize(label_data[key])
+            if not target_val: continue
+
+            # Search in words (Exact Match)
+            for i, w in enumerate(words):
+                if normalize(w) == target_val:
+                    ner_tags[i] = f"B-{tag}" # Mark start of entity
+                    # TODO: Multi-word entities (e.g. "Vendor Name Inc") not handled here yet.
+                    # This logic assumes entity is contained in one OCR block.
+
+    return ner_tags
+
+
 class InvoiceDataset(Dataset):
-    def __init__(self, data_dir, processor=None, max_length=512):
+    def __init__(self, data_dir, processor=None, max_length=512, feature_store=None):
         """
         Args:
             data_dir (str): Path to directory containing images and .json labels
             processor (LayoutLMv3Processor): Hugging Face processor
             max_length (int): Max token length
+            feature_store (str): Precomputed OCR features (see preprocess.py).
+                Defaults to <data_dir>/_features; items missing from it, or whose
+                image changed since it was built, are OCR'd on load.
         """
         self.data_dir = data_dir
         self.processor = processor or LayoutLMv3Processor.from_pretrained("microsoft/layoutlmv3-base")
         self.max_length = max_length
-        
+
         # Filter for valid pairs (image + json)
-        self.files = []
-        all_files = os.listdir(data_dir)
-        for f in all_files:
-            if f.endswith(".json") and not f.startswith("_"):
-                base_name = os.path.splitext(f)[0]
-                # check for corresponding image (jpg or png)
-                if f"{base_name}.jpg" in all_files:
-                    self.files.append(base_name)
-                elif f"{base_name}.png" in all_files:
-                    self.files.append(base_name)
+        pairs = find_pairs(data_dir)
+        self.files = [base_name for base_name, _ in pairs]
 
         self.label_list = LABELS
         self.label2id = {l: i for i, l in enumerate(self.label_list)}
@@ -44,128 +132,175 @@ class InvoiceDataset(Dataset):
 
         print(f"Indices found: {len(self.files)} valid pairs in {data_dir}")
 
+        # Words / boxes per document: from the feature store when its entry was
+        # built from the same image (by content hash), otherwise OCR'd here, once
+        # (slow, see preprocess.py). Labels are always aligned to the current
+        # JSON, as preprocess.py does, so relabeling never reads stale labels.
+        self.store = open_store(feature_store or os.path.join(data_dir, FEATURE_STORE_NAME), self.label_list)
+        features = []
+        missing = 0
+        for base_name, image_file in pairs:
+            if (self.store is not None and base_name in self.store
+                    and self.store.index[base_name]["sha256"] == file_hash(os.path.join(data_dir, image_file))):
+                words, boxes, _ = self.store.get(base_name)
+                features.append((words, boxes, self.align_word_labels(base_name, words)))
+            else:
+                features.append(self.ocr_features(self.load_image(base_name), base_name))
+                missing += 1
+        if missing:
+            print(f"⚠️ OCR'd {missing}/{len(self.files)} items missing from or stale in the feature store "
+                  f"(run preprocess.py to skip this)")
+
+        # Gold label per word, for document-level evaluation
+        self.word_labels = [labels for _, _, labels in features]
+
+        # Items are (document, window) pairs: every overflow window is used
+        self.windows, self.doc_windows = self.build_windows(features)
+        print(f"Windows: {len(self.windows)} from {len(self.files)} documents (max_length={max_length}, stride={WINDOW_STRIDE})")
+
+    def build_windows(self, features):
+        """
+        Tokenize every document once into overlapping max_length windows.
+        Returns (windows, doc_windows): window token data, and each document's window indices.
+        """
+        encoding = self.processor.tokenizer(
+            [words for words, _, _ in features],
+            boxes=[boxes for _, boxes, _ in features],
+            word_labels=[labels for _, _, labels in features],
+            truncation=True,
+            max_length=self.max_length,
+            stride=WINDOW_STRIDE,
+            return_overflowing_tokens=True
+        )
+
+        windows = []
+        doc_windows = [[] for _ in features]
+        for i, doc in enumerate(encoding["overflow_to_sample_mapping"]):
+            labels = encoding["labels"][i]
+            doc_windows[doc].append(len(windows))
+            windows.append({
+                "doc": doc,
+                "input_ids": encoding["input_ids"][i],
+                "bbox": encoding["bbox"][i],
+                "labels": labels,
+                # Word of each labeled (first-subword) token, -1 elsewhere: for stitching
+                "word_index": [w if l != -100 else -1 for w, l in zip(encoding.word_ids(i), labels)]
+            })
+        return windows, doc_windows
+
     def __len__(self):
-        return len(self.files)
+        return len(self.windows)
 
     def __getitem__(self, idx):
-        base_name = self.files[idx]
-        
-        # Load Image
+        window = self.windows[idx]
+
+        # Only the image is processed per item; tokens were prepared in build_windows.
+        # No padding here: PaddingCollator pads each batch to its own longest item
+        image = self.load_image(self.files[window["doc"]])
+        pixel_values = self.processor.image_processor(image, apply_ocr=False, return_tensors="pt")["pixel_values"][0]
+
+        return {
+            "input_ids": torch.tensor(window["input_ids"]),
+            "attention_mask": torch.ones(len(window["input_ids"]), dtype=torch.long),
+            "bbox": torch.tensor(window["bbox"]),
+            "pixel_values": pixel_values,
+            "labels": torch.tensor(window["labels"])
+        }
+
+    def load_image(self, base_name):
         img_path = os.path.join(self.data_dir, f"{base_name}.jpg")
         if not os.path.exists(img_path):
              img_path = os.path.join(self.data_dir, f"{base_name}.png")
-        
-        image = Image.open(img_path).convert("RGB")
-        
-        # Load Labels
+        return Image.open(img_path).convert("RGB")
+
+    def lengths(self):
+        """Token length of every item (window), for length-grouped batching."""
+        return [len(window["input_ids"]) for window in self.windows]
+
+    def window_indices(self, docs):
+        """All window indices of the given documents (e.g. a train/eval split by document)."""
+        return [i for doc in docs for i in self.doc_windows[doc]]
+
+    def stitch_predictions(self, window_indices, window_logits):
+        """
+        Stitch window logits back into word-level predictions per document.
+        Overlapping windows are averaged (see decoding.stitch_windows).
+
+        Args:
+            window_indices (list[int]): dataset indices of the predicted windows
+            window_logits (list[np.ndarray]): matching [seq_len, num_labels] logits (may be right-padded)
+        Returns:
+            {doc: (predicted label ids, gold label ids)} for every document with predictions
+        """
+        by_doc = {}
+        for idx, logits in zip(window_indices, window_logits):
+            by_doc.setdefault(self.windows[idx]["doc"], []).append((self.windows[idx]["word_index"], logits))
+
+        results = {}
+        for doc, pairs in by_doc.items():
+            probs = stitch_windows([w for w, _ in pairs], [l for _, l in pairs], len(self.word_labels[doc]))
+            # Words no window reached (e.g. tokenized to nothing) count as O
+            predicted = np.where(probs.sum(-1) > 0, probs.argmax(-1), 0)
+            results[doc] = (predicted.tolist(), list(self.word_labels[doc]))
+        return results
+
+    def get_reader(self):
+        # One EasyOCR reader per process, keyed on the pid: a reader created
+        # before a fork (e.g. DataLoader workers) must not be reused in the
+        # child, since torch thread pools don't survive fork.
+        if getattr(self, "_reader_pid", None) != os.getpid():
+            import easyocr
+            self.reader = easyocr.Reader(['en'], verbose=False) # GPU if available
+            self._reader_pid = os.getpid()
+        return self.reader
+
+    def __getstate__(self):
+        # Spawned workers get a pickled copy: never ship the reader, rebuild it there
+        state = self.__dict__.copy()
+        state.pop("reader", None)
+        state.pop("_reader_pid", None)
+        return state
+
+    def ocr_features(self, image, base_name):
+        """Live OCR + label alignment for one item. Returns (words, boxes, word_labels)."""
+        # We MUST run OCR manually: the processor doesn't return the raw words
+        # we need to match labels against. EasyOCR since Tesseract might be missing.
+        words, boxes = ocr_words(self.get_reader(), image, base_name)
+        return words, boxes, self.align_word_labels(base_name, words)
+
+    def align_word_labels(self, base_name, words):
+        """Label id per word, from the item's JSON labels."""
         json_path = os.path.join(self.data_dir, f"{base_name}.json")
         with open(json_path, "r") as f:
             label_data = json.load(f)
+        return [self.label2id.get(tag, 0) for tag in align_labels(words, label_data)]
 
-        # 1. Run OCR via Processor (apply_ocr=True is default for images if words not provided)
-        # We process image first to get words/boxes, then align tags.
-        # Note: This is inefficient (double processing) but easiest for implementation.
-        # Better: use pytesseract directly, but let's stick to processor API if possible.
-        
-        # Actually, `processor` with image returns `encoding` which matches `words` internally?
-        # LayoutLMv3Processor returns `input_ids`, `bbox`, `attention_mask`, `pixel_values`.
-        # It does NOT return the raw `words` unless we ask or inspect it.
-        # We need the words to match labels.
-        
-        # So we MUST run OCR manually.
-        # We use EasyOCR since Tesseract might be missing.
-        import easyocr
-        import numpy as np
-
-        # Initialize reader once (or cache it nicely? For now, re-init per call is slow but safe)
-        # Better: Initialize in __init__
-        if not hasattr(self, 'reader'):
-             self.reader = easyocr.Reader(['en'], verbose=False) # GPU if available
-
-        try:
-             # EasyOCR returns [(bbox, text, prob), ...]
-             # bbox is [[x1,y1], [x2,y1], [x2,y2], [x1,y2]]
-             results = self.reader.readtext(np.array(image))
-             
-             words = []
-             boxes = []
-             width, height = image.size
-             
-             for (bbox, text, prob) in results:
-                 # Convert polygon to xyxy
-                 # bbox is list of 4 points
-                 xs = [p[0] for p in bbox]
-                 ys = [p[1] for p in bbox]
-                 x1 = int(min(xs))
-                 y1 = int(min(ys))
-                 x2 = int(max(xs))
-                 y2 = int(max(ys))
-                 
-                 # Normalize 0-1000
-                 x1 = max(0, min(1000, int((x1 / width) * 1000)))
-                 y1 = max(0, min(1000, int((y1 / height) * 1000)))
-                 x2 = max(0, min(1000, int((x2 / width) * 1000)))
-                 y2 = max(0, min(1000, int((y2 / height) * 1000)))
-                 
-                 words.append(text)
-                 boxes.append([x1, y1, x2, y2])
-                 
-        except Exception as e:
-            print(f"OCR Failed for {base_name}: {e}")
-            words = ["Empty"]
-            boxes = [[0,0,0,0]]
-
-        # 2. Align Labels (Heuristic)
-        # Schema: total_amount, invoice_id, invoice_date, vendor_name
-        # We try to find exact string matches in `words`.
-        
-        ner_tags = ["O"] * len(words)
-        
-        # Helper to normalize for matching
-        def normalize(s):
-            return str(s).lower().replace("$", "").replace(",", "").strip()
-
-        target_map = {
-            "total_amount": "TOTAL",
-            "invoice_id": "ID",
-            "invoice_date": "DATE",
-            "vendor_name": "VENDOR"
-        }
 
-        for key, tag in target_map.items():
-            if key in label_data:
-                target_val = normalize(label_data[key])
-                if not target_val: continue
-                
-                # Search in words (Exact Match)
-                for i, w in enumerate(words):
-                    if normalize(w) == target_val:
-                        ner_tags[i] = f"B-{tag}" # Mark start of entity
-                        # TODO: Multi-word entities (e.g. "Vendor Name Inc") not handled here yet.
-                        # This logic assumes entity is contained in one OCR block.
-
-        # 3. Process (Auto-Alignment via Processor)
-        word_labels = [self.label2id.get(tag, 0) for tag in ner_tags]
-        
-        encoding = self.processor(
-            image,
-            words,
-            boxes=boxes,
-            word_labels=word_labels,
-            truncation=True,
-            padding="max_length",
-            max_length=self.max_length,
-            stride=128,
-            return_overflowing_tokens=True,
-            return_offsets_mapping=True,
-            return_tensors="pt"
-        )
-        
-        # 4. Extract first window (LayoutLMv3 is usually handled this way for simple training)
-        return {
-            "input_ids": encoding["input_ids"][0],
-            "attention_mask": encoding["attention_mask"][0],
-            "bbox": encoding["bbox"][0],
-            "pixel_values": encoding["pixel_values"][0], 
-            "labels": encoding["labels"][0]
+class PaddingCollator:
+    """
+    Pads a batch to its longest sequence (rounded up to pad_to_multiple_of)
+    instead of every item to max_length: labels with -100, boxes with [0,0,0,0].
+    A class rather than a closure so DataLoader workers can pickle it.
+    """
+
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        length = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch = {
+            "input_ids": torch.full((len(features), length), self.pad_token_id, dtype=torch.long),
+            "attention_mask": torch.zeros((len(features), length), dtype=torch.long),
+            "bbox": torch.zeros((len(features), length, 4), dtype=torch.long),
+            "labels": torch.full((len(features), length), -100, dtype=torch.long),
         }
+        for i, f in enumerate(features):
+            n = len(f["input_ids"])
+            for key in batch:
+                batch[key][i, :n] = f[key]
+        batch["pixel_values"] = torch.stack([f["pixel_values"] for f in features])
+        return batch
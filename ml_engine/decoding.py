@@ -0,0 +1,130 @@
+import numpy as np
+
+# Entity decoding from model logits.
+# Works at the OCR-word level: each word takes the softmax of its FIRST
+# subword token (the only token labeled during training, see dataset.py),
+# averaged over every window that saw it. BIO spans are then extracted with
+# NumPy over the word labels, so nothing loops over padding or subwords.
+
+
+def softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def stitch_windows(window_word_index, window_logits, num_words):
+    """
+    Average the first-subword softmax of every word over the windows that saw it.
+
+    Args:
+        window_word_index (list[np.ndarray]): per window, the word index of each
+            first-subword token and -1 for every other token
+        window_logits (list[np.ndarray]): [seq_len_i, num_labels] per window
+            (may be right-padded beyond the window's length)
+        num_words (int): total number of words
+    Returns:
+        np.ndarray [num_words, num_labels]; words never seen get all zeros
+    """
+    num_labels = window_logits[0].shape[-1] if len(window_logits) else 0
+    sums = np.zeros((num_words, num_labels), dtype=np.float32)
+    counts = np.zeros(num_words, dtype=np.float32)
+
+    for word_index, logits in zip(window_word_index, window_logits):
+        word_index = np.asarray(word_index, dtype=np.int64)
+        first_subword = word_index >= 0
+        index = word_index[first_subword]
+        np.add.at(sums, index, softmax(logits[:len(word_index)][first_subword]))
+        np.add.at(counts, index, 1)
+
+    return sums / np.maximum(counts, 1)[:, None]
+
+
+def word_probabilities(encoding, window_logits, words_per_page):
+    """
+    Aggregate per-window token logits into per-word label probabilities.
+
+    Args:
+        encoding: processor output with overflow windows + offset mapping
+        window_logits (list[np.ndarray]): [seq_len_i, num_labels] per window
+        words_per_page (list[int]): OCR word count of each encoded page
+    Returns:
+        np.ndarray [total_words, num_labels]; words never seen get all zeros
+    """
+    page_offsets = np.concatenate([[0], np.cumsum(words_per_page)[:-1]]).astype(np.int64)
+
+    window_word_index = []
+    for i in range(len(window_logits)):
+        word_ids = np.array([-1 if w is None else w for w in encoding.word_ids(i)], dtype=np.int64)
+        starts = np.array([start for start, _ in encoding["offset_mapping"][i]], dtype=np.int64)
+        first_subword = (word_ids >= 0) & (starts == 0)
+        offset = page_offsets[encoding["overflow_to_sample_mapping"][i]]
+        window_word_index.append(np.where(first_subword, word_ids + offset, -1))
+
+    return stitch_windows(window_word_index, window_logits, int(sum(words_per_page)))
+
+
+def bio_spans(labels, id2label, orphan_i_starts_span=False):
+    """
+    Vectorized BIO span extraction over word label ids (-1 = O).
+    A span starts at a B- word and continues over I- words of the same type.
+    An I- word that doesn't continue a span is dropped, or starts a new span
+    with orphan_i_starts_span (seqeval's default, non-strict IOB2 mode).
+
+    Returns (types, span_type, starts, ends): the sorted entity type names, and
+    per span its index into `types`, start word and end word (exclusive).
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    num_labels = max(int(k) for k in id2label) + 1 if id2label else 0
+
+    # Per-label lookup tables: prefix (0 = O, 1 = B, 2 = I) and entity type
+    names = [id2label.get(i, id2label.get(str(i), "O")) for i in range(num_labels)]
+    types = sorted({n[2:] for n in names if n[:2] in ("B-", "I-")})
+    prefix_of = np.array([{"B-": 1, "I-": 2}.get(n[:2], 0) for n in names] + [0])
+    type_of = np.array([types.index(n[2:]) if n[:2] in ("B-", "I-") else -1 for n in names] + [-1])
+
+    prefix = prefix_of[labels]  # labels == -1 hits the trailing O entry
+    etype = type_of[labels]
+
+    prev_prefix = np.concatenate([[0], prefix[:-1]])
+    prev_type = np.concatenate([[-1], etype[:-1]])
+    is_begin = prefix == 1
+    is_continue = (prefix == 2) & (prev_prefix != 0) & (etype == prev_type)
+
+    # Every B- word or non-continuing word opens a segment; everything up to the
+    # next boundary continues it. Segments opened by a B- word (or an orphan I-)
+    # are the spans.
+    bounds = np.flatnonzero(is_begin | ~is_continue)
+    ends = np.append(bounds[1:], len(labels))
+    keep = is_begin[bounds]
+    if orphan_i_starts_span:
+        keep |= prefix[bounds] == 2
+    starts, ends = bounds[keep], ends[keep]
+
+    return types, etype[starts], starts, ends
+
+
+def extract_spans(probs, id2label):
+    """
+    BIO span extraction over word-level probabilities (see bio_spans).
+
+    Returns a list of (entity_type, start_word, end_word_exclusive, confidence),
+    where confidence is the mean probability of the predicted label over the span.
+    """
+    if len(probs) == 0 or not id2label:
+        return []
+
+    labels = probs.argmax(-1)
+    word_conf = probs[np.arange(len(probs)), labels]
+    seen = probs.sum(-1) > 0
+    labels = np.where(seen, labels, -1)  # Unseen words act as O
+
+    types, span_type, starts, ends = bio_spans(labels, id2label)
+
+    conf_sum = np.concatenate([[0.0], np.cumsum(word_conf)])
+    confidence = (conf_sum[ends] - conf_sum[starts]) / (ends - starts)
+
+    return [
+        (types[t], int(start), int(end), float(conf))
+        for t, start, end, conf in zip(span_type, starts, ends, confidence)
+    ]
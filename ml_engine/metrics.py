@@ -0,0 +1,58 @@
+import numpy as np
+
+from decoding import bio_spans
+
+# Entity-level metrics (seqeval-style P/R/F1 + accuracy), computed locally.
+# The whole evaluation set is scored in one vectorized pass: documents are
+# concatenated with an O separator, spans are extracted with decoding.bio_spans
+# and matched as integer keys. No evaluate.load(), no network.
+# Spans follow seqeval's default mode: an I- tag that doesn't continue a span
+# starts one (serving drops those instead), so the numbers match seqeval's.
+
+
+def entity_metrics(predictions, references, id2label):
+    """
+    Args:
+        predictions (list[list[int]]): predicted label ids per document
+        references (list[list[int]]): gold label ids per document
+        id2label (dict): label id -> BIO label name
+    Returns:
+        dict with overall_precision / overall_recall / overall_f1 / overall_accuracy,
+        plus {precision, recall, f1, number} per entity type (same keys as seqeval)
+    """
+    # One O (-1) after every document so no span crosses a document boundary
+    pred = np.concatenate([np.append(np.asarray(p, dtype=np.int64), -1) for p in predictions]) if predictions else np.zeros(0, np.int64)
+    gold = np.concatenate([np.append(np.asarray(r, dtype=np.int64), -1) for r in references]) if references else np.zeros(0, np.int64)
+
+    types, pred_type, pred_start, pred_end = bio_spans(pred, id2label, orphan_i_starts_span=True)
+    _, gold_type, gold_start, gold_end = bio_spans(gold, id2label, orphan_i_starts_span=True)
+
+    # A predicted span is correct iff (type, start, end) matches a gold span exactly
+    n = len(pred) + 1
+    pred_keys = (pred_type * n + pred_start) * n + pred_end
+    gold_keys = (gold_type * n + gold_start) * n + gold_end
+    correct = np.isin(pred_keys, gold_keys)
+
+    true_positives = np.bincount(pred_type[correct], minlength=len(types))
+    num_pred = np.bincount(pred_type, minlength=len(types))
+    num_gold = np.bincount(gold_type, minlength=len(types))
+
+    words = gold >= 0
+    results = {}
+    for i, name in enumerate(types):
+        results[name] = _prf(true_positives[i], num_pred[i], num_gold[i])
+        results[name]["number"] = int(num_gold[i])
+
+    overall = _prf(true_positives.sum(), num_pred.sum(), num_gold.sum())
+    results["overall_precision"] = overall["precision"]
+    results["overall_recall"] = overall["recall"]
+    results["overall_f1"] = overall["f1"]
+    results["overall_accuracy"] = float((pred[words] == gold[words]).mean()) if words.any() else 0.0
+    return results
+
+
+def _prf(true_positives, num_pred, num_gold):
+    precision = true_positives / num_pred if num_pred else 0.0
+    recall = true_positives / num_gold if num_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": float(precision), "recall": float(recall), "f1": float(f1)}
@@ -0,0 +1,266 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+# Page preprocessing (shared by serve.py and dataset.py)
+# OCR cost grows with pixel count, and 3000+ px phone photos carry far more
+# pixels than EasyOCR needs. Pages are resampled to OCR_TARGET_DPI (when the
+# file records its DPI), capped at OCR_MAX_SIDE on the long edge, optionally
+# deskewed, then OCR'd region-by-region: text regions are detected on an even
+# smaller copy (OCR_DETECT_MAX_SIDE) and only those regions are recognized.
+# Boxes are mapped back to the ORIGINAL image's pixel coordinates.
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2000"))
+OCR_DETECT_MAX_SIDE = int(os.getenv("OCR_DETECT_MAX_SIDE", "1280"))
+OCR_DESKEW = os.getenv("OCR_DESKEW", "0") == "1"
+OCR_ROI = os.getenv("OCR_ROI", "1") == "1"
+DESKEW_MAX_ANGLE = 5.0  # Degrees searched either way
+DESKEW_STEP = 0.5
+
+# Bump when anything that changes OCR output changes (languages, preprocessing...)
+OCR_VERSION = f"easyocr-en-v2-dpi{OCR_TARGET_DPI}-{OCR_MAX_SIDE}-{OCR_DETECT_MAX_SIDE}-deskew{int(OCR_DESKEW)}-roi{int(OCR_ROI)}"
+
+
+class PageTransform:
+    """Maps points on the preprocessed page back to the original image."""
+
+    def __init__(self, scale=1.0, angle=0.0, scaled_size=None, rotated_size=None):
+        self.scale = scale
+        self.angle = angle
+        self.scaled_size = scaled_size
+        self.rotated_size = rotated_size
+
+    def to_original(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.angle:
+            # Inverse of PIL's counter-clockwise rotate(expand=True) about the centre
+            theta = np.deg2rad(self.angle)
+            cos, sin = np.cos(theta), np.sin(theta)
+            dx = points[:, 0] - self.rotated_size[0] / 2
+            dy = points[:, 1] - self.rotated_size[1] / 2
+            points = np.stack([
+                self.scaled_size[0] / 2 + dx * cos - dy * sin,
+                self.scaled_size[1] / 2 + dx * sin + dy * cos
+            ], axis=1)
+        return points / self.scale
+
+
+def estimate_skew(image, max_angle=DESKEW_MAX_ANGLE, step=DESKEW_STEP):
+    """
+    Projection-profile skew estimate: the rotation that makes text rows
+    sharpest (highest variance of per-row ink counts). Returns degrees to
+    rotate counter-clockwise.
+    """
+    thumb = image.convert("L")
+    thumb.thumbnail((800, 800))
+    gray = np.asarray(thumb, dtype=np.uint8)
+    ink = Image.fromarray(((gray < gray.mean() * 0.75) * 255).astype(np.uint8))
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rows = np.asarray(ink.rotate(angle, resample=Image.NEAREST), dtype=np.float32).sum(axis=1)
+        score = float(np.var(rows))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_page(image, max_side=None, target_dpi=None, deskew=None):
+    """
+    Downscale (DPI normalization + long-edge cap) and optionally deskew a page.
+    Unset arguments use the OCR_* settings. Returns (page image, PageTransform
+    back to `image` coordinates).
+    """
+    max_side = OCR_MAX_SIDE if max_side is None else max_side
+    target_dpi = OCR_TARGET_DPI if target_dpi is None else target_dpi
+    deskew = OCR_DESKEW if deskew is None else deskew
+    width, height = image.size
+    scale = 1.0
+
+    dpi = image.info.get("dpi")
+    if target_dpi and dpi and dpi[0] and dpi[0] > target_dpi:
+        scale = target_dpi / float(dpi[0])
+    if max_side and max(width, height) * scale > max_side:
+        scale = max_side / float(max(width, height))
+
+    page = image
+    if scale < 1.0:
+        page = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+    else:
+        scale = 1.0
+    scaled_size = page.size
+
+    angle = estimate_skew(page) if deskew else 0.0
+    if angle:
+        page = page.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=(255, 255, 255))
+
+    return page, PageTransform(scale, angle, scaled_size, page.size)
+
+
+def _scale_regions(horizontal_list, free_list, factor):
+    horizontal = [[int(v * factor) for v in box] for box in horizontal_list]
+    free = [[[int(x * factor), int(y * factor)] for x, y in box] for box in free_list]
+    return horizontal, free
+
+
+def read_page(reader, image, roi=None, detect_max_side=None):
+    """
+    OCR a PIL page with EasyOCR after preprocess_page().
+    Returns [(text, [x1, y1, x2, y2], confidence)] in `image` pixel coordinates.
+    """
+    roi = OCR_ROI if roi is None else roi
+    detect_max_side = OCR_DETECT_MAX_SIDE if detect_max_side is None else detect_max_side
+    page, transform = preprocess_page(image.convert("RGB"))
+    page_array = np.array(page)
+
+    if roi:
+        # Detection (CRAFT over the whole page) is the expensive half; run it
+        # on a smaller copy and recognize only the detected regions at full
+        # preprocessing resolution.
+        detect_scale = min(1.0, detect_max_side / float(max(page.size)))
+        detect_page = page
+        if detect_scale < 1.0:
+            detect_page = page.resize((round(page.width * detect_scale), round(page.height * detect_scale)), Image.BILINEAR)
+        horizontal_list, free_list = reader.detect(np.array(detect_page))
+        horizontal_list, free_list = _scale_regions(horizontal_list[0], free_list[0], 1.0 / detect_scale)
+        results = reader.recognize(np.array(page.convert("L")), horizontal_list, free_list) if (horizontal_list or free_list) else []
+    else:
+        results = reader.readtext(page_array)
+
+    words = []
+    for (bbox, text, prob) in results:
+        points = transform.to_original(bbox)
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        words.append((text, [float(x1), float(y1), float(x2), float(y2)], float(prob)))
+    return words
+
+
+# OCR result cache.
+# OCR is usually slower than the model, and retries / duplicate uploads send
+# byte-identical images. Results (words + boxes in original image pixels, as
+# read_page returns them) are keyed by a hash of the image bytes and the OCR
+# settings, kept in an in-memory LRU, and optionally mirrored to disk so they
+# survive restarts.
+
+
+class OCRCache:
+    def __init__(self, max_entries=1024, disk_dir=None):
+        """
+        Args:
+            max_entries (int): In-memory LRU size (0 disables the memory tier)
+            disk_dir (str): Optional directory for the on-disk tier
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._pending = {}  # key -> Future, so concurrent duplicates OCR once
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(content, version=OCR_VERSION):
+        return hashlib.sha256(version.encode() + b"\0" + content).hexdigest()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached (words, boxes) for `key`, or call compute() once and
+        cache its result. Concurrent callers with the same key wait for the
+        first one instead of running OCR again.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = Future()
+
+        if not owner:
+            with self._lock:
+                self.hits += 1
+            return pending.result()
+
+        try:
+            result = self._read_disk(key)
+            if result is not None:
+                with self._lock:
+                    self.disk_hits += 1
+            else:
+                with self._lock:
+                    self.misses += 1
+                result = compute()
+                self._write_disk(key, result)
+
+            self._remember(key, result)
+            pending.set_result(result)
+            return result
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _remember(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key)) as f:
+                data = json.load(f)
+            return data["words"], data["boxes"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, result):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"words": result[0], "boxes": result[1]}, f)
+            os.replace(tmp_path, path)  # Atomic: readers never see a partial file
+        except OSError as e:
+            print(f"⚠️ Could not write OCR cache entry: {e}")
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk_dir": self.disk_dir,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
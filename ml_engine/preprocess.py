@@ -0,0 +1,212 @@
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+
+# Offline OCR feature store for InvoiceDataset.
+# OCR is by far the most expensive part of loading a training item, and its
+# output never changes between epochs. This script OCRs ground_truth once,
+# aligns the labels and writes everything to <data_dir>/_features as flat,
+# memory-mapped NumPy arrays:
+#   manifest.json      OCR_VERSION, label list, per-item name / image / hash / word range
+#   words.bin          all words, UTF-8, concatenated
+#   word_offsets.npy   int64 [num_words + 1], byte offsets into words.bin
+#   boxes.npy          int16 [num_words, 4], normalized 0-1000
+#   labels.npy         int8  [num_words], label ids (dataset.LABELS)
+# Re-running only OCRs images that are new or changed (by content hash);
+# labels are always re-aligned, so relabeling never needs a new OCR pass.
+# Run with: python ml_engine/preprocess.py [--data-dir ml_engine/ground_truth]
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ocr import OCR_VERSION
+
+# Configuration
+GROUND_TRUTH_DIR = "./ml_engine/ground_truth"
+FEATURE_STORE_NAME = "_features"  # Leading underscore: skipped by the dataset's file scan
+STORE_FORMAT = 1
+
+
+class FeatureStore:
+    """Read-only view of a feature store. Arrays are memory-mapped, so
+    DataLoader workers (forked or spawned) share the page cache instead of
+    each holding a copy."""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.store_dir = store_dir
+        self.index = {item["name"]: item for item in self.manifest["items"]}
+
+        words_file = os.path.join(store_dir, "words.bin")
+        # np.memmap refuses empty files (a store where OCR found nothing)
+        self.words = np.memmap(words_file, dtype=np.uint8, mode="r") if os.path.getsize(words_file) else np.zeros(0, np.uint8)
+        self.word_offsets = np.load(os.path.join(store_dir, "word_offsets.npy"), mmap_mode="r")
+        self.boxes = np.load(os.path.join(store_dir, "boxes.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(store_dir, "labels.npy"), mmap_mode="r")
+
+    def __getstate__(self):
+        # Spawned DataLoader workers: re-open the files rather than pickling the arrays
+        return self.store_dir
+
+    def __setstate__(self, store_dir):
+        self.__init__(store_dir)
+
+    def close(self):
+        """Drop the memory maps. Windows can't rename or delete files that are still mapped."""
+        self.words = self.word_offsets = self.boxes = self.labels = None
+        gc.collect()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, name):
+        """Returns (words, boxes, word_labels) for one item, as plain lists."""
+        item = self.index[name]
+        start, end = item["words"]
+        offsets = self.word_offsets[start:end + 1] - self.word_offsets[start]
+        blob = bytes(self.words[self.word_offsets[start]:self.word_offsets[end]])
+        words = [blob[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+        return words, self.boxes[start:end].tolist(), self.labels[start:end].tolist()
+
+
+def open_store(store_dir, label_list=None):
+    """
+    Open a feature store if it exists and matches the current OCR settings
+    (and label schema). Returns None otherwise, so callers fall back to live OCR.
+    """
+    if not os.path.exists(os.path.join(store_dir, "manifest.json")):
+        return None
+    try:
+        store = FeatureStore(store_dir)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ Feature store at {store_dir} unreadable ({e}). Using live OCR.")
+        return None
+
+    manifest = store.manifest
+    if manifest.get("format") != STORE_FORMAT or manifest.get("ocr_version") != OCR_VERSION:
+        print(f"⚠️ Feature store at {store_dir} was built with different OCR settings "
+              f"({manifest.get('ocr_version')} != {OCR_VERSION}). Using live OCR; re-run preprocess.py.")
+        return None
+    if label_list is not None and manifest.get("labels") != list(label_list):
+        print(f"⚠️ Feature store at {store_dir} uses a different label schema. Using live OCR; re-run preprocess.py.")
+        return None
+    return store
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_store(store_dir, items, label_list):
+    """
+    items: [(name, image_file, image_hash, words, boxes, label_ids)]
+    Written to a temp dir then swapped in, so readers never see a half-written store.
+    """
+    tmp_dir = f"{store_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    manifest_items = []
+    encoded = []
+    boxes = []
+    labels = []
+    num_words = 0
+    for name, image_file, image_hash, item_words, item_boxes, item_labels in items:
+        manifest_items.append({
+            "name": name,
+            "image": image_file,
+            "sha256": image_hash,
+            "words": [num_words, num_words + len(item_words)]
+        })
+        encoded.extend(w.encode("utf-8") for w in item_words)
+        boxes.extend(item_boxes)
+        labels.extend(item_labels)
+        num_words += len(item_words)
+
+    word_offsets = np.zeros(num_words + 1, dtype=np.int64)
+    word_offsets[1:] = np.cumsum([len(w) for w in encoded])
+
+    with open(os.path.join(tmp_dir, "words.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(tmp_dir, "word_offsets.npy"), word_offsets)
+    np.save(os.path.join(tmp_dir, "boxes.npy"), np.array(boxes, dtype=np.int16).reshape(-1, 4))
+    np.save(os.path.join(tmp_dir, "labels.npy"), np.array(labels, dtype=np.int8))
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({
+            "format": STORE_FORMAT,
+            "ocr_version": OCR_VERSION,
+            "labels": list(label_list),
+            "num_words": num_words,
+            "items": manifest_items
+        }, f, indent=1)
+
+    # Swap: old store out, new store in
+    old_dir = f"{store_dir}.old-{os.getpid()}"
+    if os.path.exists(store_dir):
+        os.rename(store_dir, old_dir)
+    os.rename(tmp_dir, store_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def build_store(data_dir, store_dir=None, force=False):
+    from PIL import Image
+    from dataset import LABELS, find_pairs, ocr_words, align_labels
+
+    store_dir = store_dir or os.path.join(data_dir, FEATURE_STORE_NAME)
+    label2id = {l: i for i, l in enumerate(LABELS)}
+
+    names = find_pairs(data_dir)
+
+    previous = None if force else open_store(store_dir, LABELS)
+    reader = None
+    items = []
+    reused = ocr_count = 0
+    start = time.perf_counter()
+
+    for i, (name, image_file) in enumerate(names, 1):
+        image_path = os.path.join(data_dir, image_file)
+        image_hash = file_hash(image_path)
+        with open(os.path.join(data_dir, f"{name}.json")) as f:
+            label_data = json.load(f)
+
+        if previous is not None and name in previous and previous.index[name]["sha256"] == image_hash:
+            words, boxes, _ = previous.get(name)  # OCR unchanged; labels re-aligned below
+            reused += 1
+        else:
+            if reader is None:
+                import easyocr
+                reader = easyocr.Reader(['en'], verbose=False)
+            words, boxes = ocr_words(reader, Image.open(image_path).convert("RGB"), name)
+            ocr_count += 1
+            print(f"  [{i}/{len(names)}] {name}: {len(words)} words")
+
+        label_ids = [label2id.get(tag, 0) for tag in align_labels(words, label_data)]
+        items.append((name, image_file, image_hash, words, boxes, label_ids))
+
+    # Reused items are plain-list copies; release the old store's maps before swapping it out
+    if previous is not None:
+        previous.close()
+        previous = None
+    write_store(store_dir, items, LABELS)
+    print(f"✅ Feature store written to {store_dir}: {len(items)} items "
+          f"({ocr_count} OCR'd, {reused} reused) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ORC OCR Feature Store Builder")
+    parser.add_argument("--data-dir", default=GROUND_TRUTH_DIR)
+    parser.add_argument("--store-dir", help=f"Defaults to <data-dir>/{FEATURE_STORE_NAME}")
+    parser.add_argument("--force", action="store_true", help="Re-OCR everything")
+    args = parser.parse_args()
+
+    build_store(args.data_dir, args.store_dir, args.force)
@@ -1,53 +1,256 @@
-
 import os
-import torch
-from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
-from optimum.onnxruntime import ORTModelForTokenClassification
-from optimum.onnxruntime.configuration import AutoQuantizationConfig
-from optimum.onnxruntime import ORTQuantizer
+import sys
+import json
+import time
+import random
+import argparse
+
+# ONNX export + int8 quantization for CPU serving.
+# Builds up to four variants in ONNX_DIR and describes them in manifest.json,
+# which serve.py (INFERENCE_BACKEND=auto, see backends.py) picks from at startup:
+#   onnx              fp32 export
+#   onnx-opt          fp32 with transformer graph fusions (--optimize)
+#   onnx-int8         dynamic int8: weights quantized, activations at runtime
+#   onnx-int8-static  static int8 calibrated on ground_truth windows (--static):
+#                     no per-call activation quantization overhead
+# The int8 config follows the host CPU (avx2 / avx512 / avx512_vnni / arm64);
+# int8 kernels are ISA-specific, so quantize on the kind of node that serves.
+# The manifest recommends fp32 onnx unless --recommend pins a variant or a
+# benchmark.py report newer than the export passed one through its F1 gate;
+# then the fastest passing variant. Workflow: quantize, benchmark, then
+# quantize --skip-export again to pick up the report.
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backends import ONNX_FILES, MANIFEST_FILE, FALLBACK_ORDER, detect_isa
 
 # Paths
 MODEL_DIR = "./ml_engine/models/layoutlmv3-finetuned"
 ONNX_DIR = "./ml_engine/models/onnx"
+GROUND_TRUTH_DIR = "./ml_engine/ground_truth"
+BENCHMARK_REPORT = "./ml_engine/models/benchmark_report.json"  # benchmark.py's REPORT_PATH
+CALIBRATION_SAMPLES = 64
+MODEL_INPUTS = ("input_ids", "attention_mask", "bbox", "pixel_values")
+ISAS = ["avx2", "avx512", "avx512_vnni", "arm64"]
+
+
+def quantization_config(isa, is_static):
+    """
+    optimum config for the target ISA (per-tensor, as before). Without VNNI,
+    x86 int8 matmuls (u8 x s8) can saturate their 16-bit intermediate sums,
+    so weights use 7 bits there (reduce_range).
+    """
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    if isa in ("avx2", "avx512"):
+        return getattr(AutoQuantizationConfig, isa)(is_static=is_static, per_channel=False, reduce_range=True)
+    return getattr(AutoQuantizationConfig, isa)(is_static=is_static, per_channel=False)
+
+
+def calibration_dataset(processor_dir, data_dir, num_samples, seed=42):
+    """
+    Random sample of ground_truth windows as model inputs. OCR comes from the
+    feature store (see preprocess.py), so calibration doesn't re-run EasyOCR.
+    """
+    from datasets import Dataset
+    from transformers import LayoutLMv3Processor
+    from dataset import InvoiceDataset
+
+    processor = LayoutLMv3Processor.from_pretrained(processor_dir, apply_ocr=False)
+    invoices = InvoiceDataset(data_dir, processor)
+    indices = random.Random(seed).sample(range(len(invoices)), min(num_samples, len(invoices)))
+
+    rows = []
+    for i in indices:
+        item = invoices[i]
+        rows.append({key: item[key].numpy() for key in MODEL_INPUTS})
+    return Dataset.from_list(rows).with_format("numpy")
+
+
+def export_onnx(model_dir, onnx_dir):
+    from optimum.onnxruntime import ORTModelForTokenClassification
+    from transformers import LayoutLMv3Processor
+
+    # Load model and processor
+    model = ORTModelForTokenClassification.from_pretrained(model_dir, export=True)
+    processor = LayoutLMv3Processor.from_pretrained(model_dir)
+
+    # Save ONNX model
+    model.save_pretrained(onnx_dir)
+    processor.save_pretrained(onnx_dir)
+
+
+def optimize_graph(onnx_dir):
+    """
+    Fuse LayerNorm / SkipLayerNorm / BiasGelu with onnxruntime's transformer
+    optimizer. LayoutLMv3 isn't in optimum's ORTOptimizer model list, but its
+    encoder is BERT-shaped so the BERT patterns apply (attention stays unfused:
+    its relative position biases don't match the fused Attention op).
+    """
+    from onnxruntime.transformers.optimizer import optimize_model
+
+    with open(os.path.join(onnx_dir, "config.json")) as f:
+        config = json.load(f)
+    optimized = optimize_model(
+        os.path.join(onnx_dir, ONNX_FILES["onnx"]),
+        model_type="bert",
+        num_heads=config["num_attention_heads"],
+        hidden_size=config["hidden_size"]
+    )
+    optimized.save_model_to_file(os.path.join(onnx_dir, ONNX_FILES["onnx-opt"]))
+    return {op: n for op, n in optimized.get_fused_operator_statistics().items() if n}
+
+
+def quantize_variant(onnx_dir, source_file, isa, calibration=None):
+    """Quantize source_file into the onnx-int8 (dynamic) or onnx-int8-static file. Returns the output file name."""
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoCalibrationConfig
+
+    name = "onnx-int8-static" if calibration is not None else "onnx-int8"
+    qconfig = quantization_config(isa, is_static=calibration is not None)
+    quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name=source_file)
 
-def quantize_model():
-    print(f"🚀 Starting ONNX Quantization for {MODEL_DIR}...")
-    
-    if not os.path.exists(MODEL_DIR):
-        print(f"❌ Model directory {MODEL_DIR} does not exist. Train first!")
+    ranges = None
+    if calibration is not None:
+        calibration_config = AutoCalibrationConfig.minmax(calibration)
+        ranges = quantizer.fit(
+            dataset=calibration,
+            calibration_config=calibration_config,
+            onnx_augmented_model_name=os.path.join(onnx_dir, "augmented_model.onnx"),
+            operators_to_quantize=qconfig.operators_to_quantize
+        )
+        os.remove(os.path.join(onnx_dir, "augmented_model.onnx"))
+
+    # optimum writes <source>_<suffix>.onnx: model_quantized.onnx / model_static_quantized.onnx
+    # from model.onnx; anything else is renamed to the variant's file
+    suffix = "static_quantized" if calibration is not None else "quantized"
+    output = quantizer.quantize(
+        save_dir=onnx_dir, quantization_config=qconfig, calibration_tensors_range=ranges, file_suffix=suffix
+    )
+
+    target = os.path.join(onnx_dir, ONNX_FILES[name])
+    written = os.path.join(str(output), f"{os.path.splitext(source_file)[0]}_{suffix}.onnx")
+    if os.path.abspath(written) != os.path.abspath(target):
+        os.replace(written, target)
+    return ONNX_FILES[name]
+
+
+def benchmark_recommendation(report_path, onnx_dir, variants):
+    """
+    Fastest built variant that passed benchmark.py's promotion gate, or None.
+    Reports older than the export describe a previous model and are ignored.
+    """
+    if not report_path or not os.path.exists(report_path):
+        return None
+    if os.path.getmtime(report_path) < os.path.getmtime(os.path.join(onnx_dir, ONNX_FILES["onnx"])):
+        print(f"⚠️ Benchmark report {report_path} predates the export; ignoring it.")
+        return None
+    with open(report_path) as f:
+        promotion = json.load(f).get("promotion", {})
+    passed = [v for v in FALLBACK_ORDER if v in variants and promotion.get(v, {}).get("passed")]
+    return passed[0] if passed else None
+
+
+def write_manifest(onnx_dir, variants, isa, source, recommended=None):
+    """Describe the built variants for serve.py. Recommended = fp32 onnx unless pinned."""
+    for info in variants.values():
+        info["size_mb"] = round(os.path.getsize(os.path.join(onnx_dir, info["file"])) / 1e6, 1)
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "source": source,
+        "host_isa": isa,
+        "variants": variants,
+        "recommended": recommended or "onnx"
+    }
+    with open(os.path.join(onnx_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def quantize_model(args):
+    print(f"🚀 Starting ONNX Quantization for {args.model_dir}...")
+
+    if not args.skip_export and not os.path.exists(args.model_dir):
+        print(f"❌ Model directory {args.model_dir} does not exist. Train first!")
         return
 
+    isa = args.isa or detect_isa()
+    print(f"🖥️  Target ISA: {isa}" + ("" if args.isa else " (detected)"))
+
     # 1. Export to ONNX
-    print("📦 Exporting to ONNX...")
-    try:
-        # Load model and processor
-        model = ORTModelForTokenClassification.from_pretrained(MODEL_DIR, export=True)
-        processor = LayoutLMv3Processor.from_pretrained(MODEL_DIR)
-        
-        # Save ONNX model
-        model.save_pretrained(ONNX_DIR)
-        processor.save_pretrained(ONNX_DIR)
-        print(f"✅ ONNX Model exported to {ONNX_DIR}")
-        
-    except Exception as e:
-        print(f"❌ ONNX Export failed: {e}")
-        return
+    if args.skip_export:
+        print(f"📦 Reusing existing export in {args.onnx_dir}")
+    else:
+        print("📦 Exporting to ONNX...")
+        try:
+            export_onnx(args.model_dir, args.onnx_dir)
+            print(f"✅ ONNX Model exported to {args.onnx_dir}")
+        except Exception as e:
+            print(f"❌ ONNX Export failed: {e}")
+            return
+
+    variants = {"onnx": {"file": ONNX_FILES["onnx"], "isa": None, "mode": "fp32"}}
+
+    # 2. Graph optimization (optional, fp32 only). Quantization starts from the
+    # plain export: the quantizer's shape inference can't type the fused
+    # com.microsoft ops (SkipLayerNormalization, BiasGelu)
+    source_file = ONNX_FILES["onnx"]
+    if args.optimize:
+        print("🔧 Applying graph fusions...")
+        try:
+            fused = optimize_graph(args.onnx_dir)
+            variants["onnx-opt"] = {"file": ONNX_FILES["onnx-opt"], "isa": None, "mode": "fp32", "fused_ops": fused}
+            print(f"✅ Optimized graph saved to {args.onnx_dir}/{ONNX_FILES['onnx-opt']} ({fused})")
+        except Exception as e:
+            print(f"❌ Graph optimization failed: {e}")
 
-    # 2. Quantize (Dynamic Quantization for CPU)
-    print("📉 Quantizing (Float32 -> Int8)...")
+    # 3. Quantize (Dynamic)
+    print(f"📉 Quantizing (Float32 -> Int8, dynamic, {isa})...")
     try:
-        quantizer = ORTQuantizer.from_pretrained(ONNX_DIR, file_name="model.onnx")
-        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
-        
-        quantizer.quantize(
-            save_dir=ONNX_DIR,
-            quantization_config=qconfig,
-        )
-        print(f"✅ Quantized Model saved to {ONNX_DIR}/model_quantized.onnx")
-        
+        file_name = quantize_variant(args.onnx_dir, source_file, isa)
+        variants["onnx-int8"] = {"file": file_name, "isa": isa, "mode": "dynamic", "source": source_file}
+        print(f"✅ Quantized Model saved to {args.onnx_dir}/{file_name}")
     except Exception as e:
         print(f"❌ Quantization failed: {e}")
 
+    # 4. Quantize (Static, calibrated on ground_truth)
+    if args.static:
+        print(f"📉 Quantizing (Float32 -> Int8, static, {args.calibration_samples} calibration windows)...")
+        try:
+            calibration = calibration_dataset(args.onnx_dir, args.data_dir, args.calibration_samples)
+            file_name = quantize_variant(args.onnx_dir, source_file, isa, calibration=calibration)
+            variants["onnx-int8-static"] = {
+                "file": file_name, "isa": isa, "mode": "static", "source": source_file,
+                "calibration_samples": len(calibration)
+            }
+            print(f"✅ Static Quantized Model saved to {args.onnx_dir}/{file_name}")
+        except Exception as e:
+            print(f"❌ Static quantization failed: {e}")
+
+    if args.recommend and args.recommend not in variants:
+        print(f"⚠️ --recommend {args.recommend} was not built; choosing automatically.")
+        args.recommend = None
+    if not args.recommend:
+        args.recommend = benchmark_recommendation(args.benchmark_report, args.onnx_dir, variants)
+        if args.recommend:
+            print(f"📊 {args.recommend} passed the benchmark gate in {args.benchmark_report}")
+    manifest = write_manifest(args.onnx_dir, variants, isa, args.model_dir, args.recommend)
+    print(f"📝 Manifest: {', '.join(manifest['variants'])} (recommended: {manifest['recommended']})")
+
+
 if __name__ == "__main__":
     # Ensure optimum is installed: pip install optimum[onnxruntime]
-    quantize_model()
+    parser = argparse.ArgumentParser(description="ORC ONNX Export + Quantization")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--onnx-dir", default=ONNX_DIR)
+    parser.add_argument("--data-dir", default=GROUND_TRUTH_DIR, help="Calibration data for --static")
+    parser.add_argument("--isa", choices=ISAS, help="Override CPU ISA detection")
+    parser.add_argument("--static", action="store_true", help="Also build calibrated static int8")
+    parser.add_argument("--calibration-samples", type=int, default=CALIBRATION_SAMPLES)
+    parser.add_argument("--optimize", action="store_true", help="Also build the fused fp32 graph (onnx-opt)")
+    parser.add_argument("--skip-export", action="store_true", help="Reuse the model.onnx already in --onnx-dir")
+    parser.add_argument("--recommend", help="Variant serve.py should pick (default: fp32 onnx, or the benchmark's pick)")
+    parser.add_argument("--benchmark-report", default=BENCHMARK_REPORT, help="benchmark.py report whose passing variants may be recommended")
+    args = parser.parse_args()
+
+    quantize_model(args)
@@ -1,20 +1,75 @@
 
 import os
+import sys
 import shutil
 import io
-import torch
+import time
+import asyncio
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import uvicorn
 from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Processor
 from PIL import Image
-import easyocr
+
+# Heavy imports (torch, transformers, easyocr, pdfplumber) are deferred to
+# load time so the process can answer /health within a fraction of a second.
+PDF_SUPPORT = importlib.util.find_spec("pdfplumber") is not None
+
+# Ensure ml_engine directory is in python path for local imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from batching import MicroBatcher
+from backends import load_backend, resolve_backend
+from ocr import OCRCache, OCR_VERSION, read_page
+from decoding import word_probabilities, extract_spans
 
 # Configuration
 # Tricky: We want to load the fine-tuned model if available, else fallback to base for testing.
 FINE_TUNED_MODEL_DIR = "./ml_engine/models/layoutlmv3-finetuned"
 BASE_MODEL_NAME = "microsoft/layoutlmv3-base"
+ONNX_DIR = "./ml_engine/models/onnx"
+
+# Cold start: EasyOCR weights bundled with the image (no download at startup)
+# and an optional warm-up forward pass before reporting ready.
+EASYOCR_MODEL_DIR = os.getenv("EASYOCR_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "easyocr"))
+WARMUP = os.getenv("WARMUP", "1") == "1"
+
+# Pre-fork serving (python serve.py --workers N): OCR + model are loaded once in
+# the parent and shared copy-on-write with the forked workers.
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "1"))
+THREADS_PER_WORKER = int(os.getenv("THREADS_PER_WORKER", "0"))  # 0 = cores // workers
+
+# Inference backend: auto | torch | onnx | onnx-opt | onnx-int8 | onnx-int8-static
+# (falls back if the artifact is missing). "auto" picks the variant recommended
+# in quantize.py's manifest for this CPU, or torch if nothing was exported.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "auto")
+
+# Micro-batching: coalesce concurrent requests into one forward pass
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "10"))
+
+# Length-aware encoding: no padding to 512; pad each batch to its longest
+# sequence (rounded up), and split long pages into overlapping windows.
+MAX_SEQ_LENGTH = 512
+WINDOW_STRIDE = int(os.getenv("WINDOW_STRIDE", "128"))  # Tokens shared by consecutive windows
+PAD_TO_MULTIPLE = int(os.getenv("PAD_TO_MULTIPLE", "8"))
+LENGTH_BUCKET = int(os.getenv("LENGTH_BUCKET", "64"))  # Batched windows are grouped by length
+
+# OCR: dedicated worker pool (overlaps with the model thread) + content-hash cache
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "1024"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR")  # Unset = memory only
+OCR_CACHE_VERSION = f"{OCR_VERSION}-pixel-boxes"  # Entries hold source pixel boxes, not 0-1000 ones
+
+# PDF input: pages with a text layer skip OCR entirely (words + boxes from pdfplumber)
+PDF_MIN_WORDS = 3  # Fewer words than this => treat the page as a scan
+PDF_IMAGE_DPI = 72  # Render for the visual embedding only (resized to 224px anyway)
+PDF_OCR_DPI = 200  # Render for OCR of scanned pages
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "20"))
 
 app = FastAPI(title="ORC Local Inference API", version="1.0.0")
 
@@ -28,9 +83,25 @@ app.add_middleware(
 )
 
 # Global State
-model = None
+backend = None
 processor = None
 reader = None
+batcher = None
+ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+ocr_cache = OCRCache(max_entries=OCR_CACHE_SIZE, disk_dir=OCR_CACHE_DIR)
+
+# Model entity types -> response fields
+ENTITY_FIELDS = {
+    "TOTAL": "total_amount",
+    "DATE": "invoice_date",
+    "VENDOR": "vendor_name",
+    "ID": "invoice_id"
+}
+
+# Readiness (liveness is just "the process answers")
+startup_state = {"ready": False, "error": None, "timings_s": {}}
+process_started = time.perf_counter()
+worker_threads = None  # Per-worker torch/ORT thread budget in pre-fork mode
 
 # Entity Label Map (Same as dataset.py)
 # We need this to decode the ID predictions back to strings.
@@ -38,13 +109,27 @@ reader = None
 ID2LABEL = {}
 
 @app.on_event("startup")
-def load_artifacts():
-    global model, processor, reader, ID2LABEL
+def start_loading():
+    # Load in the background: /health answers immediately, /ready flips when done
+    threading.Thread(target=load_artifacts, name="artifact-loader", daemon=True).start()
+
+def timed_phase(name, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    startup_state["timings_s"][name] = round(time.perf_counter() - started, 3)
+    return result
+
+def load_ocr_reader():
+    import easyocr
     
-    print("🚀 Loading OCR Engine (EasyOCR)...")
-    reader = easyocr.Reader(['en'], verbose=False)
+    if os.path.isdir(EASYOCR_MODEL_DIR):
+        print(f"🚀 Loading OCR Engine (EasyOCR) from {EASYOCR_MODEL_DIR}...")
+        return easyocr.Reader(['en'], model_storage_directory=EASYOCR_MODEL_DIR, download_enabled=False, verbose=False)
     
-    print(f"📂 Loading Model...")
+    print(f"⚠️ {EASYOCR_MODEL_DIR} not found. EasyOCR may download weights (slow cold start).")
+    return easyocr.Reader(['en'], verbose=False)
+
+def resolve_model_path():
     # Priority: Env Var (Cloud) > Local Dir (Dev) > Base (Fallback)
     env_model = os.getenv("HF_MODEL_ID")
     
@@ -57,169 +142,384 @@ def load_artifacts():
     else:
         print(f"⚠️ Warning: No fine-tuned model found. Using BASE model {BASE_MODEL_NAME} for testing.")
         model_path = BASE_MODEL_NAME
+    return model_path
+
+def load_model():
+    from transformers import LayoutLMv3Processor
+    
+    loaded = load_backend(INFERENCE_BACKEND, resolve_model_path(), ONNX_DIR, threads=worker_threads)
+    # ONNX exports ship their own processor/config (see quantize.py)
+    return loaded, LayoutLMv3Processor.from_pretrained(loaded.model_path, apply_ocr=False)
 
+def warm_up():
+    """One tiny forward pass so the first real request doesn't pay for lazy init."""
+    encoding = processor([Image.new("RGB", (224, 224), "white")], [["warmup"]], boxes=[[[0, 0, 100, 100]]])
+    run_batch([{key: encoding[key][0] for key in ("input_ids", "bbox", "pixel_values")}])
+
+def load_shared_artifacts(include_model=True):
+    """
+    Load the EasyOCR reader and (optionally) the model. In pre-fork mode this
+    runs once in the parent, before any worker exists.
+    """
+    global backend, processor, reader
+    
+    # OCR and model weights load concurrently (both mostly I/O + deserialization)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ocr_future = pool.submit(timed_phase, "ocr", load_ocr_reader)
+        if include_model:
+            print(f"📂 Loading Model...")
+            backend, processor = timed_phase("model", load_model)
+        reader = ocr_future.result()
+
+def load_artifacts():
+    global backend, processor, batcher, ID2LABEL
+    
     try:
-        processor = LayoutLMv3Processor.from_pretrained(model_path, apply_ocr=False)
-        model = LayoutLMv3ForTokenClassification.from_pretrained(model_path)
-        model.eval()
+        if reader is None:
+            load_shared_artifacts()
+        if backend is None:
+            # Pre-fork with an ONNX backend: sessions are per worker
+            print(f"📂 Loading Model...")
+            backend, processor = timed_phase("model", load_model)
         
         # Load ID2LABEL from config
-        ID2LABEL = model.config.id2label
-        print(f"✅ Model Loaded. Labels: {ID2LABEL}")
+        ID2LABEL = backend.id2label
+        print(f"✅ Model Loaded ({backend.name} backend). Labels: {ID2LABEL}")
+        
+        if WARMUP:
+            timed_phase("warmup", warm_up)
+        
+        batcher = MicroBatcher(run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS).start()
+        print(f"📦 Micro-batching: up to {MAX_BATCH_SIZE} requests / {MAX_WAIT_MS}ms")
+        
+        startup_state["timings_s"]["total"] = round(time.perf_counter() - process_started, 3)
+        startup_state["ready"] = True
+        print(f"🟢 Ready in {startup_state['timings_s']['total']}s {startup_state['timings_s']}")
         
     except Exception as e:
         print(f"❌ Failed to load model: {e}")
-        # Fallback to hardcoded labels for base model to prevent crash? 
-        # Base model usually has standard NER labels or 2 labels.
-        pass
+        startup_state["error"] = str(e)
 
-def normalize_box(box, width, height):
-    return [
-        int(1000 * (box[0] / width)),
-        int(1000 * (box[1] / height)),
-        int(1000 * (box[2] / width)),
-        int(1000 * (box[3] / height)),
-    ]
+@app.on_event("shutdown")
+def stop_batcher():
+    if batcher:
+        batcher.stop()
+    ocr_pool.shutdown(wait=False)
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    if not model or not processor:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+def round_up(n, multiple):
+    return -(-n // multiple) * multiple
 
-    # 1. Read Image
-    try:
-        content = await file.read()
-        image = Image.open(io.BytesIO(content)).convert("RGB")
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid image file")
+def pad_windows(windows):
+    """
+    Stack unpadded windows into one batch, padded to the longest window
+    rounded up to PAD_TO_MULTIPLE.
+    """
+    seq_len = min(round_up(max(len(w["input_ids"]) for w in windows), PAD_TO_MULTIPLE), MAX_SEQ_LENGTH)
+    input_ids = np.full((len(windows), seq_len), processor.tokenizer.pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(windows), seq_len), dtype=np.int64)
+    bbox = np.zeros((len(windows), seq_len, 4), dtype=np.int64)
+    
+    for row, window in enumerate(windows):
+        length = len(window["input_ids"])
+        input_ids[row, :length] = window["input_ids"]
+        attention_mask[row, :length] = 1
+        bbox[row, :length] = window["bbox"]
+    
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "bbox": bbox,
+        "pixel_values": np.stack([w["pixel_values"] for w in windows]).astype(np.float32)
+    }
 
-    # 2. Run OCR
-    width, height = image.size
-    ocr_result = reader.readtext(np.array(image))
+def run_batch(windows):
+    """
+    Forward passes for a list of windows collected by the batcher (runs on the
+    batcher thread). Windows are bucketed by length so a short receipt is not
+    padded up to a long invoice. Returns unpadded per-window logits.
+    """
+    buckets = {}
+    for i, window in enumerate(windows):
+        buckets.setdefault(round_up(len(window["input_ids"]), LENGTH_BUCKET), []).append(i)
     
+    results = [None] * len(windows)
+    for indices in buckets.values():
+        logits = backend.run(pad_windows([windows[i] for i in indices]))
+        for row, i in enumerate(indices):
+            results[i] = logits[row, :len(windows[i]["input_ids"])]
+    return results
+
+def normalize_box(box, width, height):
+    # Clamp: deskewed boxes can poke slightly outside the page, and LayoutLMv3 requires 0-1000
+    return [
+        max(0, min(1000, int(1000 * (box[0] / width)))),
+        max(0, min(1000, int(1000 * (box[1] / height)))),
+        max(0, min(1000, int(1000 * (box[2] / width)))),
+        max(0, min(1000, int(1000 * (box[3] / height)))),
+    ]
+
+def run_ocr(image):
+    """
+    EasyOCR the page (downscaled / ROI, see ocr.read_page).
+    Returns (words, boxes as [x1, y1, x2, y2] in `image` pixels).
+    """
     words = []
     boxes = []
     
-    for (bbox, text, prob) in ocr_result:
-        # EasyOCR bbox: [[x1,y1], [x2,y1], [x2,y2], [x1,y2]]
-        # We need [x1, y1, x2, y2]
-        xs = [p[0] for p in bbox]
-        ys = [p[1] for p in bbox]
-        x1, y1 = min(xs), min(ys)
-        x2, y2 = max(xs), max(ys)
-        
-        normalized_box = normalize_box([x1, y1, x2, y2], width, height)
+    for (text, box, prob) in read_page(reader, image):
         words.append(text)
-        boxes.append(normalized_box)
+        boxes.append([round(v, 1) for v in box])
 
-    if not words:
-        return {"entities": {}, "raw_text": []}
+    return words, boxes
+
+def ocr_page(image, cache_key):
+    """OCR'd page (cached) as (image, words, 0-1000 boxes, source, source boxes, source size, units)."""
+    words, source_boxes = ocr_cache.get_or_compute(cache_key, lambda: run_ocr(image))
+    width, height = image.size
+    boxes = [normalize_box(box, width, height) for box in source_boxes]
+    return (image, words, boxes, "ocr", source_boxes, (width, height), "px")
+
+def load_pdf_pages(content, cache_key):
+    """
+    Split a PDF into pages of (image, words, boxes, source, source boxes,
+    source size, units). Digital pages take words and boxes straight from the
+    text layer (as in backend/pdf_extractor.py; source boxes in PDF points);
+    only scanned pages are rendered and OCR'd (source boxes in pixels of the
+    PDF_OCR_DPI render). `boxes` are the 0-1000 boxes fed to the model.
+    """
+    import pdfplumber
+    
+    pages = []
+    with pdfplumber.open(io.BytesIO(content)) as pdf:
+        for page_num, page in enumerate(pdf.pages[:MAX_PDF_PAGES]):
+            pdf_words = page.extract_words()
+            
+            if len(pdf_words) >= PDF_MIN_WORDS:
+                image = page.to_image(resolution=PDF_IMAGE_DPI).original.convert("RGB")
+                words = [w["text"] for w in pdf_words]
+                source_boxes = [[round(float(w[k]), 2) for k in ("x0", "top", "x1", "bottom")] for w in pdf_words]
+                boxes = [normalize_box(box, page.width, page.height) for box in source_boxes]
+                pages.append((image, words, boxes, "text_layer", source_boxes, (float(page.width), float(page.height)), "pt"))
+            else:
+                image = page.to_image(resolution=PDF_OCR_DPI).original.convert("RGB")
+                pages.append(ocr_page(image, f"{cache_key}-p{page_num}"))
+    return pages
+
+def prepare_inputs(content, cache_key, is_pdf=False):
+    """
+    Turn an upload into LayoutLMv3 inputs. Runs on the OCR pool.
+    Images are OCR'd (cached by content hash); PDFs go through load_pdf_pages.
+    All pages are encoded in one processor call, one unpadded window per
+    MAX_SEQ_LENGTH tokens (encoding["overflow_to_sample_mapping"] gives the page).
+    Returns (pages, encoding); encoding is None when no text was found.
+    Raises ValueError for uploads that can't be decoded.
+    """
+    if is_pdf:
+        try:
+            pages = load_pdf_pages(content, cache_key)
+        except Exception as e:
+            raise ValueError(f"Invalid PDF file: {e}") from e
+    else:
+        try:
+            image = Image.open(io.BytesIO(content)).convert("RGB")
+        except Exception as e:
+            raise ValueError("Invalid image file") from e
+        pages = [ocr_page(image, cache_key)]
+    
+    text_pages = [p for p in pages if p[1]]
+    if not text_pages:
+        return pages, None
 
-    # 3. Tokenize & Encode
     encoding = processor(
-        words,
-        boxes=boxes,
-        return_tensors="pt",
+        [p[0] for p in text_pages],
+        [p[1] for p in text_pages],
+        boxes=[p[2] for p in text_pages],
         truncation=True,
-        padding="max_length"
+        max_length=MAX_SEQ_LENGTH,
+        stride=WINDOW_STRIDE,
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True
     )
+    return pages, encoding
 
-    # 4. Inference
-    with torch.no_grad():
-        outputs = model(**encoding)
-    
-    logits = outputs.logits
-    predictions = logits.argmax(-1).squeeze().tolist()
-    token_boxes = encoding.bbox.squeeze().tolist()
-    
-    # 5. Decode Entities
-    # We need to map tokens back to words or just aggregate neighbor tokens
-    # Simple Aggregation Strategy:
-    # Group consecutive tokens with same "B-" or "I-" tag.
-    
-    entities = {
-        "total_amount": [],
-        "invoice_date": [],
-        "vendor_name": [],
-        "invoice_id": []
+@app.get("/health")
+def health():
+    """Liveness: the process is up (model may still be loading)."""
+    return {"status": "alive", "uptime_s": round(time.perf_counter() - process_started, 1)}
+
+@app.get("/ready")
+def ready():
+    """Readiness: OCR + model loaded (and warmed up). 503 until then."""
+    body = {
+        "ready": startup_state["ready"],
+        "pid": os.getpid(),
+        "error": startup_state["error"],
+        "backend": backend.name if backend else None,
+        "startup_timings_s": startup_state["timings_s"]
     }
+    return JSONResponse(body, status_code=200 if startup_state["ready"] else 503)
+
+@app.get("/metrics")
+def metrics():
+    """Batching metrics (queue depth, batch-size histogram, wait/compute times) and OCR cache stats."""
+    if not batcher:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return {**batcher.metrics(), "ocr_cache": ocr_cache.metrics()}
+
+@app.post("/predict")
+async def predict(file: UploadFile = File(...)):
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    # 1. Read Upload (image or PDF)
+    content = await file.read()
+    is_pdf = content[:5] == b"%PDF-" or file.content_type == "application/pdf"
+    if is_pdf and not PDF_SUPPORT:
+        raise HTTPException(status_code=415, detail="PDF support requires pdfplumber")
+
+    # 2-3. Text layer / OCR + Tokenize (CPU-bound, on the OCR pool so it overlaps with inference)
+    loop = asyncio.get_running_loop()
+    try:
+        pages, encoding = await loop.run_in_executor(ocr_pool, prepare_inputs, content, OCRCache.key(content, OCR_CACHE_VERSION), is_pdf)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    current_entity = None
-    current_text = []
-    
-    # Get word_ids to map subwords back to original words?
-    # processor returns word_ids()
-    word_ids = encoding.word_ids()
-    
-    # Helper to clean text
-    def clean(tokens):
-        return " ".join(tokens).replace(" ##", "") 
+    words = [word for page in pages for word in page[1]]
+    if encoding is None:
+        return {"entities": {}, "raw_text": []}
 
-    # LayoutLMv3 tokenizer is byte-level BPE, usually roberta-like.
-    # It decodes well.
+    # 4. Inference (coalesced with concurrent requests; one item per window)
+    windows = [
+        {key: encoding[key][i] for key in ("input_ids", "bbox", "pixel_values")}
+        for i in range(len(encoding["input_ids"]))
+    ]
+    window_logits = await asyncio.gather(*(batcher.submit(w) for w in windows))
     
-    tokens = processor.tokenizer.convert_ids_to_tokens(encoding.input_ids.squeeze())
+    # 5. Decode Entities (word level, vectorized; see decoding.py)
+    text_pages = [(number, page) for number, page in enumerate(pages, 1) if page[1]]
+    probs = word_probabilities(encoding, window_logits, [len(page[1]) for _, page in text_pages])
+    page_words = [word for _, page in text_pages for word in page[1]]
+    page_boxes = np.array([box for _, page in text_pages for box in page[2]])
+    source_boxes = np.array([box for _, page in text_pages for box in page[4]], dtype=np.float64)
+    page_numbers = [number for number, page in text_pages for _ in page[1]]
     
-    for idx, (token, label_id) in enumerate(zip(tokens, predictions)):
-        if label_id == -100: continue
-        if len(ID2LABEL) == 0: break # No labels
-        
-        label = ID2LABEL.get(label_id, "O")
-        
-        if label == "O":
-            if current_entity: 
-                # Close entity
-                entities[current_entity].append(clean(current_text))
-                current_entity = None
-                current_text = []
+    entities = []
+    fields = {field: [] for field in ENTITY_FIELDS.values()}
+    for entity_type, start, end, confidence in extract_spans(probs, ID2LABEL):
+        field = ENTITY_FIELDS.get(entity_type)
+        if not field:
             continue
-            
-        # It's B-Tag or I-Tag
-        prefix = label[0]
-        tag_type = label[2:] # TOTAL, DATE, VENDOR...
-        
-        # Map tag_type to json key
-        key_map = {
-            "TOTAL": "total_amount",
-            "DATE": "invoice_date",
-            "VENDOR": "vendor_name",
-            "ID": "invoice_id"
-        }
-        json_key = key_map.get(tag_type)
-        if not json_key: continue
-
-        if prefix == "B":
-            # Start new
-            if current_entity:
-                entities[current_entity].append(clean(current_text))
-            current_entity = json_key
-            current_text = [token]
-        
-        elif prefix == "I":
-            # Continue (only if same type)
-            if current_entity == json_key:
-                current_text.append(token)
-            else:
-                # Mismatch (I-Tag without B-Tag or changed type), treat as new B?
-                # Or just ignore
-                pass
-
-    # Flush last
-    if current_entity:
-        entities[current_entity].append(clean(current_text))
-
-    # Clean up lists to single strings (Take first likely candidate)
-    final_response = {}
-    for k, v in entities.items():
-        # Heuristic: Join all parts found? Or just take first?
-        # Often parts are fragmented. Join with space.
-        final_response[k] = " ".join(v).replace("Ġ", "").strip() # Remove RoBERTa special char
+        text = " ".join(page_words[start:end])
+        span_boxes = page_boxes[start:end]
+        span_source = source_boxes[start:end]
+        entities.append({
+            "field": field,
+            "text": text,
+            "confidence": round(confidence, 4),
+            "page": page_numbers[start],
+            # Union of the span's original OCR / text-layer word boxes, in the page's
+            # units ("pages"[i]["units"]: px of the OCR'd image, pt for PDF text)
+            "box": [round(float(v), 2) for v in (span_source[:, 0].min(), span_source[:, 1].min(), span_source[:, 2].max(), span_source[:, 3].max())],
+            # Same union in 0-1000 page coordinates, as fed to the model
+            "box_normalized": [int(span_boxes[:, 0].min()), int(span_boxes[:, 1].min()), int(span_boxes[:, 2].max()), int(span_boxes[:, 3].max())]
+        })
+        fields[field].append(text)
+    
+    # One string per field (all spans joined, as before); per-span detail is in "entities"
+    final_response = {field: " ".join(texts) for field, texts in fields.items()}
 
     return {
         "status": "success",
         "data": final_response,
-        "debug_raw_ocr": words
+        "entities": entities,
+        "debug_raw_ocr": words,
+        "pages": [
+            {"source": page[3], "words": len(page[1]), "width": page[5][0], "height": page[5][1], "units": page[6]}
+            for page in pages
+        ]
     }
 
+def serve_prefork(host, port, workers):
+    """
+    Pre-fork mode: load OCR + model once in this process, then fork `workers`
+    uvicorn servers on a shared listening socket. Weights stay shared
+    copy-on-write (inference never writes to them), so each worker only adds
+    its own activations and Python heap. Each worker gets cores // workers
+    torch threads so N workers don't oversubscribe the CPU.
+    Dead workers are re-forked from the (still clean) parent.
+    """
+    import gc
+    import signal
+    import socket
+    import torch
+    global worker_threads
+    
+    worker_threads = THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(worker_threads)
+    print(f"🍴 Pre-fork: {workers} workers x {worker_threads} threads")
+    
+    # ONNX Runtime thread pools don't survive fork(): ORT sessions are created per worker
+    load_shared_artifacts(include_model=(resolve_backend(INFERENCE_BACKEND, ONNX_DIR) == "torch"))
+    # Move everything loaded so far out of the GC's reach; collections in the
+    # workers would otherwise touch (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    
+    children = {}
+    stopping = False
+    
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            torch.set_num_threads(worker_threads)
+            uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=[sock])
+            os._exit(0)
+        children[pid] = index
+    
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    
+    for index in range(workers):
+        spawn(index)
+    print(f"🚀 Serving on http://{host}:{port} (parent pid {os.getpid()})")
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"⚠️ Worker {index} (pid {pid}) exited with status {status}. Respawning...")
+            spawn(index)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="ORC Local Inference API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Pre-forked workers sharing one copy of the weights")
+    args = parser.parse_args()
+    
+    if args.workers > 1:
+        serve_prefork(args.host, args.port, args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
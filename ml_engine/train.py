@@ -1,25 +1,30 @@
 
 import os
 import torch
-import numpy as np
 from transformers import (
     LayoutLMv3ForTokenClassification,
     LayoutLMv3Processor,
     TrainingArguments,
     Trainer,
-    EarlyStoppingCallback,
-    default_data_collator
+    EarlyStoppingCallback
 )
-import evaluate
+from transformers.trainer_pt_utils import LengthGroupedSampler
 
 from sklearn.model_selection import train_test_split
-from dataset import InvoiceDataset, LABELS
+from dataset import InvoiceDataset, LABELS, PaddingCollator
+from metrics import entity_metrics
 
 # Configuration
 MODEL_NAME = "microsoft/layoutlmv3-base"
 OUTPUT_DIR = "./ml_engine/models/layoutlmv3-finetuned"
 GROUND_TRUTH_DIR = "./ml_engine/ground_truth"
-BATCH_SIZE = 2
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "2"))  # Per forward pass (memory bound)
+EFFECTIVE_BATCH_SIZE = int(os.getenv("EFFECTIVE_BATCH_SIZE", str(BATCH_SIZE)))  # Per optimizer step
+GRADIENT_ACCUMULATION_STEPS = max(1, EFFECTIVE_BATCH_SIZE // BATCH_SIZE)
+DATALOADER_WORKERS = int(os.getenv("DATALOADER_WORKERS", str(min(4, os.cpu_count() or 1))))
+GROUP_BY_LENGTH = os.getenv("GROUP_BY_LENGTH", "1") == "1"
+# The dataset tokenizes in the parent before the DataLoader forks; keep workers' tokenizers single-threaded
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
 LEARNING_RATE = 5e-5
 NUM_EPOCHS = 10
 MAX_STEPS = 1000  # Cap valid steps (optional)
@@ -27,28 +32,48 @@ MAX_STEPS = 1000  # Cap valid steps (optional)
 # Global ID Map for Metrics
 id2label = {i: l for i, l in enumerate(LABELS)}
 
-def compute_metrics(p):
-    metric = evaluate.load("seqeval")
-    predictions, labels = p
-    predictions = np.argmax(predictions, axis=2)
-
-    # Remove ignored index (special tokens)
-    true_predictions = [
-        [id2label[p] for (p, l) in zip(prediction, label) if l != -100]
-        for prediction, label in zip(predictions, labels)
-    ]
-    true_labels = [
-        [id2label[l] for (p, l) in zip(prediction, label) if l != -100]
-        for prediction, label in zip(predictions, labels)
-    ]
-
-    results = metric.compute(predictions=true_predictions, references=true_labels)
-    return {
-        "precision": results["overall_precision"],
-        "recall": results["overall_recall"],
-        "f1": results["overall_f1"],
-        "accuracy": results["overall_accuracy"],
-    }
+def build_compute_metrics(dataset, eval_windows):
+    """
+    Document-level metrics: the eval windows' logits are stitched back into
+    one word-level prediction per document (overlaps averaged), so words in
+    the overlap of two windows are scored once and long invoices are scored whole.
+    """
+    def compute_metrics(p):
+        logits, _ = p  # Rows follow eval_windows; padded to the longest batch with -100
+
+        stitched = dataset.stitch_predictions(eval_windows, list(logits))
+        results = entity_metrics(
+            [predicted for predicted, _ in stitched.values()],
+            [gold for _, gold in stitched.values()],
+            id2label
+        )
+        return {
+            "precision": results["overall_precision"],
+            "recall": results["overall_recall"],
+            "f1": results["overall_f1"],
+            "accuracy": results["overall_accuracy"],
+        }
+    return compute_metrics
+
+class LengthGroupedTrainer(Trainer):
+    """
+    Trainer whose group_by_length sampler uses precomputed token lengths.
+    The stock sampler measures lengths by loading every item once, which for
+    InvoiceDataset means processing every image.
+    """
+
+    def __init__(self, *args, train_lengths=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_lengths = train_lengths
+
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.args.group_by_length and self.train_lengths is not None:
+            return LengthGroupedSampler(
+                self.args.train_batch_size * self.args.gradient_accumulation_steps,
+                lengths=self.train_lengths
+            )
+        return super()._get_train_sampler(*args, **kwargs)
+
 
 def main():
     print("🚀 Initializing Training Pipeline...")
@@ -63,20 +88,28 @@ def main():
     # Label Maps
     label_list = list(full_dataset.label2id.keys())
     num_labels = len(label_list)
-    print(f"✅ Found {len(full_dataset)} samples with {num_labels} labels: {label_list}")
+    num_docs = len(full_dataset.files)
+    print(f"✅ Found {num_docs} documents ({len(full_dataset)} windows) with {num_labels} labels: {label_list}")
     
-    if len(full_dataset) < 10:
+    if num_docs < 10:
         print("⚠️ Not enough data to split. Using full set for training (OVERFITTING WARNING).")
         train_dataset = full_dataset
         eval_dataset = full_dataset # Cheat for dry run
+        train_idx = eval_idx = list(range(len(full_dataset)))
     else:
-        # Split indices
-        indices = list(range(len(full_dataset)))
-        train_idx, eval_idx = train_test_split(indices, test_size=0.2, random_state=42)
+        # Split by document so no invoice has windows on both sides
+        docs = list(range(num_docs))
+        train_docs, eval_docs = train_test_split(docs, test_size=0.2, random_state=42)
+        train_idx = full_dataset.window_indices(train_docs)
+        eval_idx = full_dataset.window_indices(eval_docs)
         
         train_dataset = torch.utils.data.Subset(full_dataset, train_idx)
         eval_dataset = torch.utils.data.Subset(full_dataset, eval_idx)
-        print(f"📊 Split: Train ({len(train_dataset)}) | Val ({len(eval_dataset)})")
+        print(f"📊 Split: Train ({len(train_docs)} docs, {len(train_dataset)} windows) | Val ({len(eval_docs)} docs, {len(eval_dataset)} windows)")
+
+    # Token lengths for length-grouped batching
+    lengths = full_dataset.lengths()
+    train_lengths = [lengths[i] for i in train_idx] if GROUP_BY_LENGTH else None
 
     # 3. Model
     model = LayoutLMv3ForTokenClassification.from_pretrained(
@@ -92,6 +125,10 @@ def main():
         max_steps=MAX_STEPS,
         per_device_train_batch_size=BATCH_SIZE,
         per_device_eval_batch_size=BATCH_SIZE,
+        gradient_accumulation_steps=GRADIENT_ACCUMULATION_STEPS,
+        group_by_length=train_lengths is not None,
+        dataloader_num_workers=DATALOADER_WORKERS,
+        dataloader_persistent_workers=DATALOADER_WORKERS > 0,
         learning_rate=LEARNING_RATE,
         eval_strategy="steps",
         eval_steps=50,
@@ -106,14 +143,21 @@ def main():
     )
 
     # 5. Trainer
-    trainer = Trainer(
+    # Batches are padded to their longest item, not to 512
+    if EFFECTIVE_BATCH_SIZE % BATCH_SIZE:
+        print(f"⚠️ EFFECTIVE_BATCH_SIZE {EFFECTIVE_BATCH_SIZE} is not a multiple of BATCH_SIZE {BATCH_SIZE}: "
+              f"using {BATCH_SIZE * GRADIENT_ACCUMULATION_STEPS} per optimizer step")
+    print(f"⚙️ Batch {BATCH_SIZE} x {GRADIENT_ACCUMULATION_STEPS} accumulation steps | "
+          f"{DATALOADER_WORKERS} dataloader workers | group_by_length={train_lengths is not None}")
+    trainer = LengthGroupedTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=eval_dataset,
-        data_collator=default_data_collator,
-        compute_metrics=compute_metrics,
-        callbacks=[EarlyStoppingCallback(early_stopping_patience=2)]
+        data_collator=PaddingCollator(processor.tokenizer.pad_token_id),
+        compute_metrics=build_compute_metrics(full_dataset, eval_idx),
+        callbacks=[EarlyStoppingCallback(early_stopping_patience=2)],
+        train_lengths=train_lengths
     )
 
     # 6. Train